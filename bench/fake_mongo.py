@@ -0,0 +1,554 @@
+# bench/fake_mongo.py
+#
+# Заглушка коллекций Motor в памяти процесса. Поддерживает ровно то
+# подмножество запросов, которое используют обработчики, и считает операции.
+
+import asyncio
+import copy
+import re
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Счётчики текущего апдейта, их выставляет драйвер нагрузки
+current_probe = ContextVar("current_probe", default=None)
+
+_MISSING = object()
+
+
+def _get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _equals(value, expected):
+    # Условие на равенство для поля-массива выполняется и для любого его элемента
+    return value == expected or (isinstance(value, list) and expected in value)
+
+
+def _compare(value, operator, expected):
+    if operator == "$eq":
+        return _equals(value, expected)
+    if operator == "$ne":
+        return not _equals(value, expected)
+    if operator == "$in":
+        return any(_equals(value, item) for item in expected)
+    if operator == "$nin":
+        return not any(_equals(value, item) for item in expected)
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(expected)
+    if value is _MISSING or value is None:
+        return False
+    if operator == "$gt":
+        return value > expected
+    if operator == "$gte":
+        return value >= expected
+    if operator == "$lt":
+        return value < expected
+    if operator == "$lte":
+        return value <= expected
+    raise NotImplementedError(f"Оператор {operator} не поддерживается")
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+            continue
+
+        value = _get_path(document, key)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            for operator, expected in condition.items():
+                if not _compare(value, operator, expected):
+                    return False
+        elif isinstance(condition, re.Pattern):
+            if value is _MISSING or not condition.search(str(value)):
+                return False
+        else:
+            if value is _MISSING:
+                value = None
+            if not _equals(value, condition):
+                return False
+    return True
+
+
+def _evaluate(expression, document, variables):
+    # Выражения агрегации, которые встречаются в обновлениях-конвейерах
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        value = variables[name]
+        return _get_path(value, path) if path else value
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_path(document, expression[1:])
+    if isinstance(expression, list):
+        return [_evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict) or len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        if isinstance(expression, dict):
+            return {key: _evaluate(value, document, variables) for key, value in expression.items()}
+        return expression
+
+    operator, argument = next(iter(expression.items()))
+    if operator == "$literal":
+        return copy.deepcopy(argument)
+    if operator == "$ifNull":
+        for item in argument:
+            value = _evaluate(item, document, variables)
+            if value is not _MISSING and value is not None:
+                return value
+        return None
+    if operator == "$ne":
+        left, right = (_evaluate(item, document, variables) for item in argument)
+        return left != right
+    if operator == "$concatArrays":
+        return [item for array in argument for item in _evaluate(array, document, variables)]
+    if operator == "$filter":
+        items = _evaluate(argument["input"], document, variables)
+        name = argument.get("as", "this")
+        return [item for item in items if _evaluate(argument["cond"], document, {**variables, name: item})]
+    if operator == "$sortArray":
+        items = _evaluate(argument["input"], document, variables)
+        return _sort_documents(items, list(argument["sortBy"].items()))
+    if operator == "$slice":
+        items, limit = (_evaluate(item, document, variables) for item in argument)
+        return items[limit:] if limit < 0 else items[:limit]
+    raise NotImplementedError(f"Выражение {operator} не поддерживается")
+
+
+def _apply_pipeline(document, pipeline):
+    for stage in pipeline:
+        operator, fields = next(iter(stage.items()))
+        if operator not in ("$set", "$addFields"):
+            raise NotImplementedError(f"Стадия обновления {operator} не поддерживается")
+        values = {path: _evaluate(value, document, {}) for path, value in fields.items()}
+        for path, value in values.items():
+            _set_path(document, path, value)
+
+
+def apply_update(document, update, inserting=False):
+    if isinstance(update, list):
+        _apply_pipeline(document, update)
+        return
+    for operator, fields in update.items():
+        if operator == "$set":
+            for path, value in fields.items():
+                _set_path(document, path, copy.deepcopy(value))
+        elif operator == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    _set_path(document, path, copy.deepcopy(value))
+        elif operator == "$unset":
+            for path in fields:
+                _unset_path(document, path)
+        elif operator == "$inc":
+            for path, value in fields.items():
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current is _MISSING else current) + value)
+        elif operator == "$max":
+            for path, value in fields.items():
+                current = _get_path(document, path)
+                if current is _MISSING or value > current:
+                    _set_path(document, path, value)
+        elif operator == "$push":
+            for path, value in fields.items():
+                current = _get_path(document, path)
+                items = [] if current is _MISSING else list(current)
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(copy.deepcopy(value["$each"]))
+                    if "$sort" in value:
+                        items = _sort_documents(items, list(value["$sort"].items()))
+                    if "$slice" in value:
+                        limit = value["$slice"]
+                        items = items[limit:] if limit < 0 else items[:limit]
+                else:
+                    items.append(copy.deepcopy(value))
+                _set_path(document, path, items)
+        elif operator == "$pull":
+            for path, condition in fields.items():
+                current = _get_path(document, path)
+                if current is _MISSING:
+                    continue
+                if isinstance(condition, dict):
+                    kept = [item for item in current if not matches(item, condition)]
+                else:
+                    kept = [item for item in current if item != condition]
+                _set_path(document, path, kept)
+        else:
+            raise NotImplementedError(f"Оператор обновления {operator} не поддерживается")
+
+
+def project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = [field for field, flag in projection.items() if flag and field != "_id"]
+    if include:
+        result = {}
+        for field in include:
+            value = _get_path(document, field)
+            if value is not _MISSING:
+                _set_path(result, field, copy.deepcopy(value))
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    result = copy.deepcopy(document)
+    for field, flag in projection.items():
+        if not flag:
+            _unset_path(result, field)
+    return result
+
+
+class _Reversed:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(document, spec):
+    key = []
+    for field, direction in spec:
+        value = _get_path(document, field)
+        # Отсутствующие поля и None в Mongo сортируются раньше остальных
+        marker = (0, 0) if value is _MISSING or value is None else (1, value)
+        key.append(marker if direction >= 0 else _Reversed(marker))
+    return key
+
+
+def _sort_documents(documents, spec):
+    return sorted(documents, key=lambda document: _sort_key(document, spec))
+
+
+def _normalize_sort(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return list(key_or_list)
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection=None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _materialize(self):
+        documents = self._collection._find(self._query, self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        await self._collection.operation("find")
+        documents = self._materialize()
+        return documents[:length] if length else documents
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            await self._collection.operation("find")
+            self._results = iter(self._materialize())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "FAKE"}}}
+
+
+class FakeCollection:
+    def __init__(self, name, latency=0.0, unique_fields=(), indexed_fields=()):
+        self.name = name
+        self.latency = latency
+        self.documents = []
+        self.unique_fields = list(unique_fields)
+        # Хэш-индексы по полям равенства, чтобы заглушка не искажала замеры полным перебором
+        self._indexes = {
+            field: {} for field in ["_id", *self.unique_fields, *indexed_fields]
+        }
+
+    async def operation(self, name):
+        probe = current_probe.get()
+        if probe is not None:
+            probe["db_ops"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _index_value(value):
+        return repr(value) if isinstance(value, (dict, list)) else value
+
+    def _index_add(self, document):
+        for field, index in self._indexes.items():
+            value = _get_path(document, field)
+            if value is not _MISSING:
+                index.setdefault(self._index_value(value), []).append(document)
+
+    def _index_remove(self, document):
+        for field, index in self._indexes.items():
+            value = _get_path(document, field)
+            if value is _MISSING:
+                continue
+            bucket = index.get(self._index_value(value), [])
+            for position, existing in enumerate(bucket):
+                if existing is document:
+                    del bucket[position]
+                    break
+
+    def _check_unique(self, document):
+        for field in ["_id", *self.unique_fields]:
+            value = _get_path(document, field)
+            if value is not _MISSING and self._indexes[field].get(self._index_value(value)):
+                raise DuplicateKeyError(f"E11000 duplicate key error: {self.name}.{field}")
+
+    def _insert(self, document):
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self.documents.append(stored)
+        self._index_add(stored)
+        return document["_id"]
+
+    def _remove(self, document):
+        self._index_remove(document)
+        self.documents.remove(document)
+
+    def _update(self, document, update):
+        self._index_remove(document)
+        try:
+            apply_update(document, update)
+        finally:
+            self._index_add(document)
+
+    def _candidates(self, query):
+        for field, index in self._indexes.items():
+            condition = query.get(field, _MISSING)
+            if condition is _MISSING or isinstance(condition, (dict, re.Pattern)):
+                continue
+            return list(index.get(self._index_value(condition), []))
+        return self.documents
+
+    def _find(self, query, sort=None):
+        documents = [document for document in self._candidates(query) if matches(document, query)]
+        if sort:
+            documents = _sort_documents(documents, _normalize_sort(sort))
+        return documents
+
+    async def create_index(self, *args, **kwargs):
+        return "fake"
+
+    async def create_indexes(self, indexes, **kwargs):
+        return ["fake"] * len(indexes)
+
+    async def insert_one(self, document, **kwargs):
+        await self.operation("insert")
+        return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self.operation("insert")
+        inserted = []
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                if ordered:
+                    raise
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted, acknowledged=True)
+
+    async def find_one(self, query=None, projection=None, sort=None, **kwargs):
+        await self.operation("find")
+        documents = self._find(query or {}, sort)
+        return project(documents[0], projection) if documents else None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor(self, query or {}, projection)
+
+    async def count_documents(self, query, **kwargs):
+        await self.operation("count")
+        return len(self._find(query))
+
+    def _upsert_document(self, query, update):
+        document = {
+            key: value for key, value in query.items()
+            if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+        }
+        apply_update(document, update, inserting=True)
+        self._insert(document)
+        return document
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        await self.operation("update")
+        documents = self._find(query)
+        if documents:
+            self._update(documents[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            document = self._upsert_document(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        await self.operation("update")
+        documents = self._find(query)
+        for document in documents:
+            self._update(document, update)
+        return SimpleNamespace(matched_count=len(documents), modified_count=len(documents), upserted_id=None)
+
+    async def find_one_and_update(
+        self, query, update, projection=None, sort=None, upsert=False, return_document=False, **kwargs
+    ):
+        await self.operation("find_and_modify")
+        documents = self._find(query, sort)
+        if documents:
+            document = documents[0]
+            before = copy.deepcopy(document)
+            self._update(document, update)
+            return project(document if return_document else before, projection)
+        if upsert:
+            document = self._upsert_document(query, update)
+            return project(document, projection) if return_document else None
+        return None
+
+    async def find_one_and_delete(self, query, projection=None, sort=None, **kwargs):
+        await self.operation("find_and_modify")
+        documents = self._find(query, sort)
+        if not documents:
+            return None
+        self._remove(documents[0])
+        return project(documents[0], projection)
+
+    async def delete_one(self, query, **kwargs):
+        await self.operation("delete")
+        documents = self._find(query)
+        if documents:
+            self._remove(documents[0])
+        return SimpleNamespace(deleted_count=len(documents[:1]))
+
+    async def delete_many(self, query, **kwargs):
+        await self.operation("delete")
+        documents = self._find(query)
+        for document in documents:
+            self._remove(document)
+        return SimpleNamespace(deleted_count=len(documents))
+
+    async def replace_one(self, query, replacement, upsert=False, **kwargs):
+        await self.operation("update")
+        return self._replace(query, replacement, upsert)
+
+    def _replace(self, query, replacement, upsert):
+        documents = self._find(query)
+        if documents:
+            document = documents[0]
+            self._index_remove(document)
+            object_id = document["_id"]
+            document.clear()
+            document.update(copy.deepcopy(replacement))
+            document["_id"] = object_id
+            self._index_add(document)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            document = copy.deepcopy(replacement)
+            for key, value in query.items():
+                if not key.startswith("$") and not isinstance(value, dict):
+                    document.setdefault(key, value)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(document))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def bulk_write(self, operations, ordered=True, **kwargs):
+        # Разбираем операции pymongo по их внутренним полям — заглушке этого достаточно
+        await self.operation("bulk_write")
+        errors = []
+        for index, operation in enumerate(operations):
+            try:
+                self._bulk_operation(operation)
+            except DuplicateKeyError as e:
+                if ordered:
+                    raise
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return SimpleNamespace(acknowledged=True)
+
+    def _bulk_operation(self, operation):
+        kind = type(operation).__name__
+        if kind == "InsertOne":
+            self._insert(operation._doc)
+        elif kind in ("UpdateOne", "UpdateMany"):
+            documents = self._find(operation._filter)
+            if kind == "UpdateOne":
+                documents = documents[:1]
+            for document in documents:
+                self._update(document, operation._doc)
+            if not documents and operation._upsert:
+                self._upsert_document(operation._filter, operation._doc)
+        elif kind == "ReplaceOne":
+            self._replace(operation._filter, operation._doc, operation._upsert)
+        elif kind in ("DeleteOne", "DeleteMany"):
+            documents = self._find(operation._filter)
+            for document in documents[:1] if kind == "DeleteOne" else documents:
+                self._remove(document)
+        else:
+            raise NotImplementedError(f"Операция {kind} не поддерживается заглушкой")
+
+    def aggregate(self, pipeline, **kwargs):
+        raise NotImplementedError("aggregate не поддерживается заглушкой")
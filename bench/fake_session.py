@@ -0,0 +1,76 @@
+# bench/fake_session.py
+#
+# Сессия Bot, которая ничего не отправляет в Telegram, а записывает вызовы
+# и возвращает правдоподобные ответы.
+
+import asyncio
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import AnswerCallbackQuery, GetMe, TelegramMethod
+from aiogram.types import Chat, Message, User
+
+from bench.fake_mongo import current_probe
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class RecordingSession(BaseSession):
+    def __init__(self, latency=0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        # Последняя клавиатура в каждом чате — по ней драйвер «нажимает» кнопки
+        self.keyboards: Dict[int, Any] = {}
+        self._message_id = 0
+
+    async def close(self) -> None:
+        pass
+
+    def _message(self, chat_id, text=None, reply_markup=None):
+        self._message_id += 1
+        if reply_markup is not None:
+            self.keyboards[chat_id] = reply_markup
+        return Message(
+            message_id=self._message_id,
+            date=datetime.utcnow(),
+            chat=Chat(id=chat_id, type="private"),
+            from_user=User(**BOT_USER),
+            text=text,
+            reply_markup=reply_markup,
+        )
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None
+    ) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+        probe = current_probe.get()
+        if probe is not None:
+            probe["telegram_calls"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, GetMe):
+            return User(**BOT_USER)
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            return self._message(
+                chat_id, getattr(method, "text", None), getattr(method, "reply_markup", None)
+            )
+        return True
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
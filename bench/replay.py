@@ -0,0 +1,331 @@
+# bench/replay.py
+#
+# Нагрузочный прогон обработчиков: настоящий Dispatcher и роутеры бота,
+# коллекции Motor подменены заглушками в памяти, Telegram — записывающей сессией.
+#
+#   python -m bench.replay --users 2000 --actions 5 --concurrency 200 --output bench-results.json
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject, Update
+
+from bench.fake_mongo import FakeCollection, current_probe
+from bench.fake_session import BOT_USER, RecordingSession
+
+UNIQUE_FIELDS = {
+    "users": ["user_id", "link_id"],
+    "rating_aggregates": ["user_id"],
+    "archived_totals": ["user_id"],
+}
+
+INDEXED_FIELDS = {
+    "messages": ["recipient_user_id"],
+    "ratings": ["to_user_id"],
+}
+
+FIRST_USER_ID = 1_000_000
+
+
+def install_fake_collections(latency=0.0):
+    # Все коллекции бота — ленивые ссылки из bot.database.db; привязываем
+    # к каждой заглушку по имени, клиент MongoDB при этом не создаётся
+    import bot.main  # noqa: F401 — подтягивает все модули с обработчиками
+    from bot.database.db import collections
+
+    fakes = {}
+    for collection in collections():
+        fake = fakes.get(collection.name)
+        if fake is None:
+            fake = fakes[collection.name] = FakeCollection(
+                collection.name,
+                latency,
+                unique_fields=UNIQUE_FIELDS.get(collection.name, ()),
+                indexed_fields=INDEXED_FIELDS.get(collection.name, ()),
+            )
+        collection.bind(fake)
+    return fakes
+
+
+class HandlerProbeMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        probe = current_probe.get()
+        if probe is not None:
+            probe["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class Replay:
+    def __init__(self, bot, dp, session, fakes):
+        self.bot = bot
+        self.dp = dp
+        self.session = session
+        self.fakes = fakes
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._callback_ids = count(1)
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    async def feed(self, update):
+        probe = {"handler": "unhandled", "db_ops": 0, "telegram_calls": 0}
+        token = current_probe.set(probe)
+        try:
+            update = Update.model_validate(update, context={"bot": self.bot})
+            started = time.perf_counter()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                self.errors[probe["handler"]] += 1
+            elapsed = time.perf_counter() - started
+        finally:
+            current_probe.reset(token)
+        self.samples[probe["handler"]].append((elapsed, probe["db_ops"], probe["telegram_calls"]))
+
+    async def send_text(self, user_id, text):
+        await self.feed({
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        })
+
+    async def press(self, user_id, index=None, data=None):
+        markup = self.session.keyboards.get(user_id)
+        buttons = [
+            button
+            for row in (markup.inline_keyboard if markup else [])
+            for button in row
+            if button.callback_data
+        ]
+        if data is not None:
+            button = next((button for button in buttons if button.callback_data == data), None)
+        else:
+            button = buttons[index] if index is not None and index < len(buttons) else None
+        if button is None:
+            self.errors["missing_button"] += 1
+            return
+
+        await self.feed({
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._callback_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": button.callback_data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "bench",
+                },
+            },
+        })
+
+    def link_of(self, user_id):
+        users = self.fakes["users"]._find({"user_id": user_id})
+        return users[0]["link_id"] if users else None
+
+    # Сценарии одного пользователя
+
+    async def register(self, user_id):
+        await self.send_text(user_id, "/start")
+
+    async def rate(self, user_id, target_id, rng):
+        await self.send_text(user_id, f"/start send_{self.link_of(target_id)}")
+        await self.press(user_id, data="start_rating")
+        for _ in range(5):
+            await self.press(user_id, index=rng.randrange(10))
+        await self.press(user_id, index=rng.randrange(2))
+        await self.press(user_id, index=rng.randrange(2))
+        await self.press(user_id, index=1)
+        await self.press(user_id, index=rng.randrange(2))
+
+    async def message(self, user_id, target_id, rng):
+        await self.send_text(user_id, f"/start send_{self.link_of(target_id)}")
+        await self.press(user_id, data="send_message")
+        await self.send_text(user_id, "бенчмарк " * rng.randrange(1, 20))
+
+    async def view(self, user_id, screen):
+        await self.send_text(user_id, "/start")
+        await self.press(user_id, data=screen)
+        await self.press(user_id, data="back_to_start")
+
+    async def leaderboard(self, user_id):
+        await self.send_text(user_id, "/start")
+        await self.press(user_id, data="top")
+        await self.press(user_id, data="top:overall:0")
+
+    async def session_of(self, user_id, users, actions, rng):
+        for _ in range(actions):
+            target_id = rng.choice(users)
+            action = rng.choices(
+                ["rate", "message", "my_messages", "my_ratings", "top", "start"],
+                weights=[3, 2, 1, 1, 1, 1],
+            )[0]
+            if action == "rate" and target_id != user_id:
+                await self.rate(user_id, target_id, rng)
+            elif action == "message" and target_id != user_id:
+                await self.message(user_id, target_id, rng)
+            elif action in ("my_messages", "my_ratings"):
+                await self.view(user_id, action)
+            elif action == "top":
+                await self.leaderboard(user_id)
+            else:
+                await self.register(user_id)
+
+
+async def _bounded(semaphore, coroutine):
+    async with semaphore:
+        await coroutine
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    latencies = sorted(sample[0] for sample in samples)
+    return {
+        "updates": len(samples),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "db_ops_per_update": sum(sample[1] for sample in samples) / len(samples),
+        "telegram_calls_per_update": sum(sample[2] for sample in samples) / len(samples),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    from bot.config import RATING_WIZARD
+    from bot.main import create_dispatcher
+    from bot.middlewares.antispam import AntiSpamMiddleware
+    from bot.monitoring.middlewares import ApiMetricsMiddleware
+
+    fakes = install_fake_collections(args.db_latency / 1000)
+    session = RecordingSession(latency=args.api_latency / 1000)
+    session.middleware(ApiMetricsMiddleware())
+    bot = Bot(token="123456:BENCH", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    # Драйвер жмёт кнопки без пауз, поэтому лимиты антиспама подняты —
+    # проверка остаётся в цепочке и входит в замер
+    antispam = AntiSpamMiddleware(sender_rate=1e9, sender_burst=1e9, pair_rate=1e9, pair_burst=1e9)
+    dp = create_dispatcher(storage=MemoryStorage(), antispam=antispam)
+    dp.message.middleware(HandlerProbeMiddleware())
+    dp.callback_query.middleware(HandlerProbeMiddleware())
+
+    replay = Replay(bot, dp, session, fakes)
+    rng = random.Random(args.seed)
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_bounded(semaphore, replay.register(user_id)) for user_id in users))
+    await asyncio.gather(*(
+        _bounded(semaphore, replay.session_of(user_id, users, args.actions, random.Random(rng.random())))
+        for user_id in users
+    ))
+    duration = time.perf_counter() - started
+
+    all_samples = [sample for samples in replay.samples.values() for sample in samples]
+    report = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(),
+            "revision": _git_revision(),
+            "rating_wizard": RATING_WIZARD,
+            "users": args.users,
+            "actions": args.actions,
+            "concurrency": args.concurrency,
+            "db_latency_ms": args.db_latency,
+            "api_latency_ms": args.api_latency,
+            "seed": args.seed,
+        },
+        "totals": {
+            "duration_s": duration,
+            "updates_per_s": len(all_samples) / duration if duration else 0.0,
+            **summarize(all_samples),
+            "telegram_calls": dict(session.calls),
+            "queued_deliveries": len(fakes["outbox"].documents) if "outbox" in fakes else 0,
+            "errors": dict(replay.errors),
+            "antispam": antispam.stats(),
+        },
+        "handlers": {
+            handler: summarize(samples)
+            for handler, samples in sorted(replay.samples.items())
+        },
+    }
+    await bot.session.close()
+    return report
+
+
+def print_report(report):
+    totals = report["totals"]
+    print(
+        f"{totals['updates']} апдейтов за {totals['duration_s']:.2f} с — "
+        f"{totals['updates_per_s']:.0f} апдейтов/с"
+    )
+    print(f"{'обработчик':32} {'кол-во':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'БД/апд':>7} {'API/апд':>7}")
+    for handler, stats in report["handlers"].items():
+        print(
+            f"{handler:32} {stats['updates']:>8} {stats['p50_ms']:>7.2f}м {stats['p95_ms']:>7.2f}м "
+            f"{stats['p99_ms']:>7.2f}м {stats['db_ops_per_update']:>7.2f} {stats['telegram_calls_per_update']:>7.2f}"
+        )
+    if totals["errors"]:
+        print(f"Ошибки: {totals['errors']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--actions", type=int, default=5, help="Действий на пользователя после /start")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Задержка операции БД, мс")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка вызова Telegram API, мс")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench-results.json")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
@@ -0,0 +1,284 @@
+# bot/cluster/receiver.py
+#
+# Процесс-приёмник: забирает апдейты у Telegram и раскладывает их по
+# процессам-воркерам по id пользователя, следит за воркерами и
+# перезапускает упавшие. Очередь исходящих, пересчёт лидеров и /metrics
+# работают здесь, в одном экземпляре на весь бот.
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+from queue import Empty
+from time import monotonic
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from bot.cluster.routing import owner_of, routing_key
+from bot.cluster.worker import STOP, run_worker
+from bot.config import WORKER_PROCESSES, WORKER_MAX_PENDING, WORKER_REJOIN_TIMEOUT, STARTUP_BACKLOG
+from bot.monitoring.metrics import registry
+from bot.services.backlog import GET_UPDATES_LIMIT, skip_processed
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 0.5
+POLL_TIMEOUT = 30
+# Воркер, упавший быстрее этого, перезапускается с нарастающей паузой
+CRASH_LOOP_WINDOW = 10.0
+RESPAWN_DELAY_CAP = 60.0
+
+worker_restarts = registry.counter(
+    "cluster_worker_restarts_total", "Перезапуски процессов-воркеров", ("worker",)
+)
+updates_lost = registry.counter(
+    "cluster_updates_lost_total", "Апдейты, которые воркер взял и не успел обработать", ("worker",)
+)
+
+
+class _Worker:
+    __slots__ = ("id", "process", "queue", "processed", "sent", "started_at", "failures", "respawn_at")
+
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.process = None
+        self.queue = None
+        self.processed = None
+        self.sent = 0
+        self.started_at = 0.0
+        self.failures = 0
+        self.respawn_at = None
+
+    def depth(self):
+        return self.sent - self.processed.value
+
+
+class Receiver:
+    # Точка входа процесса-воркера; подменяется в нагрузочных прогонах
+    worker_target = staticmethod(run_worker)
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers=WORKER_PROCESSES, max_pending=WORKER_MAX_PENDING):
+        self.bot = bot
+        self.dp = dp
+        self.max_pending = max_pending
+        # spawn: воркер не наследует event loop и потоки драйвера MongoDB
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = {worker_id: _Worker(worker_id) for worker_id in range(workers)}
+        self._alive = []
+        # Перезапущенный воркер получает «свои» ключи обратно только после того,
+        # как остальные дообработают уже отправленные им апдейты этих ключей
+        self._joining = {}
+        # Ключи упавшего воркера придерживаются, пока его очередь не перераздана
+        self._draining = set()
+        self._held = []
+        self._stopping = asyncio.Event()
+
+        registry.gauge(
+            "cluster_worker_queue_depth", "Апдейты, отправленные воркеру и ещё не обработанные",
+            lambda: {(str(worker.id),): worker.depth() for worker in self._workers.values() if worker.processed},
+            ("worker",),
+        )
+        registry.gauge(
+            "cluster_held_updates", "Апдейты, придержанные на время возвращения воркера",
+            lambda: len(self._held),
+        )
+
+    # Процессы
+
+    def _spawn(self, worker):
+        worker.queue = self._context.Queue()
+        worker.processed = self._context.RawValue("Q", 0)
+        worker.sent = 0
+        worker.process = self._context.Process(
+            target=self.worker_target,
+            args=(worker.id, worker.queue, worker.processed),
+            name=f"bot-worker-{worker.id}",
+            daemon=False,
+        )
+        worker.process.start()
+        worker.started_at = monotonic()
+        worker.respawn_at = None
+
+    def _drain(self, worker):
+        # Апдейты, которые упавший воркер не успел забрать, — в исходном порядке
+        drained = []
+        while True:
+            try:
+                drained.append(worker.queue.get(timeout=0.05))
+            except Empty:
+                return drained
+
+    async def _handle_death(self, worker):
+        self._joining.pop(worker.id, None)
+        self._draining.add(worker.id)
+        drained = await asyncio.to_thread(self._drain, worker)
+        self._draining.discard(worker.id)
+        self._alive.remove(worker.id)
+        lost = worker.sent - worker.processed.value - len(drained)
+        if lost > 0:
+            updates_lost.inc(str(worker.id), amount=lost)
+        logger.error(
+            "Воркер %s завершился (код %s): %s апдейтов передано другим, %s потеряно",
+            worker.id, worker.process.exitcode, len(drained), max(lost, 0),
+        )
+        worker.queue.close()
+
+        # Его очередь, а за ней придержанные апдейты уходят новым владельцам
+        held, self._held = self._held, []
+        for raw in drained + held:
+            self._route(raw)
+
+        worker.failures = worker.failures + 1 if monotonic() - worker.started_at < CRASH_LOOP_WINDOW else 0
+        delay = min(2 ** worker.failures - 1, RESPAWN_DELAY_CAP)
+        worker.respawn_at = monotonic() + delay
+
+    def _rejoin(self, worker):
+        self._spawn(worker)
+        worker_restarts.inc(str(worker.id))
+        # Барьер: сколько апдейтов каждый воркер должен обработать, прежде чем
+        # ключи вернутся к перезапущенному
+        self._joining[worker.id] = (
+            monotonic() + WORKER_REJOIN_TIMEOUT,
+            {other: self._workers[other].sent for other in self._alive},
+        )
+        self._alive.append(worker.id)
+        logger.info("Воркер %s перезапущен", worker.id)
+
+    def _release_joined(self):
+        now = monotonic()
+        for worker_id, (deadline, barrier) in list(self._joining.items()):
+            drained = all(
+                self._workers[other].processed.value >= sent
+                for other, sent in barrier.items()
+                if other in self._alive
+            )
+            if drained or now >= deadline:
+                del self._joining[worker_id]
+        if not self._joining and not self._draining and self._held:
+            held, self._held = self._held, []
+            for raw in held:
+                self._route(raw)
+
+    async def _supervise(self):
+        while not self._stopping.is_set():
+            for worker in self._workers.values():
+                if worker.id in self._alive and not worker.process.is_alive():
+                    await self._handle_death(worker)
+                elif worker.respawn_at is not None and monotonic() >= worker.respawn_at:
+                    self._rejoin(worker)
+            self._release_joined()
+            await asyncio.sleep(CHECK_INTERVAL)
+
+    # Маршрутизация
+
+    def _route(self, raw):
+        if not self._alive:
+            # Все воркеры лежат — ждём перезапуска
+            self._held.append(raw)
+            return
+        owner = owner_of(routing_key(raw), self._alive)
+        if owner in self._joining or owner in self._draining:
+            self._held.append(raw)
+            return
+        worker = self._workers[owner]
+        worker.sent += 1
+        worker.queue.put(raw)
+
+    def pending(self):
+        return sum(worker.depth() for worker in self._workers.values() if worker.id in self._alive)
+
+    def overloaded(self):
+        return self.pending() + len(self._held) >= self.max_pending
+
+    def dispatch_raw(self, update):
+        # Точка входа для источника апдейтов: словарь в формате Bot API
+        self._route(update)
+
+    def dispatch(self, update):
+        self._route(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+
+    async def _poll(self):
+        offset = None
+        allowed_updates = self.dp.resolve_used_update_types()
+        backoff = 1.0
+        # Пока разбираются накопившиеся за простой апдейты, уже обработанные
+        # до остановки отсеиваются по processed_updates
+        catching_up = STARTUP_BACKLOG == "drain"
+        caught_up = skipped = 0
+        started = monotonic()
+        while not self._stopping.is_set():
+            # Воркеры не успевают — не забираем у Telegram новые апдейты
+            if self.overloaded():
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset,
+                    limit=GET_UPDATES_LIMIT,
+                    timeout=0 if catching_up else POLL_TIMEOUT,
+                    allowed_updates=allowed_updates,
+                )
+            except (TelegramNetworkError, TelegramServerError) as error:
+                logger.warning("Ошибка получения апдейтов: %s, повтор через %.0f с", error, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            if updates:
+                offset = updates[-1].update_id + 1
+            if catching_up:
+                # Неполная пачка — накопленное кончилось, дальше обычный long polling
+                catching_up = len(updates) == GET_UPDATES_LIMIT
+                fresh = await skip_processed(updates) if updates else updates
+                skipped += len(updates) - len(fresh)
+                caught_up += len(fresh)
+                updates = fresh
+                if not catching_up:
+                    logger.info(
+                        "Накопившиеся апдейты: %s передано воркерам, %s уже были обработаны, за %.1f с",
+                        caught_up, skipped, monotonic() - started,
+                    )
+            for update in updates:
+                self.dispatch(update)
+
+    # Жизненный цикл
+
+    def start_workers(self):
+        for worker in self._workers.values():
+            self._spawn(worker)
+            self._alive.append(worker.id)
+        logger.info("Запущено воркеров: %s", len(self._workers))
+
+    async def stop_workers(self, timeout=30.0):
+        for worker in self._workers.values():
+            if worker.process is not None and worker.process.is_alive():
+                worker.queue.put(STOP)
+        for worker in self._workers.values():
+            if worker.process is None:
+                continue
+            await asyncio.to_thread(worker.process.join, timeout)
+            if worker.process.is_alive():
+                logger.warning("Воркер %s не остановился за %.0f с, завершаем", worker.id, timeout)
+                worker.process.kill()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self, poll=True):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+
+        self.start_workers()
+        await self.dp.emit_startup(bot=self.bot)
+        tasks = [asyncio.create_task(self._supervise())]
+        if poll:
+            tasks.append(asyncio.create_task(self._poll()))
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.stop_workers()
+            await self.dp.emit_shutdown(bot=self.bot)
@@ -0,0 +1,36 @@
+# bot/cluster/routing.py
+#
+# Апдейт уходит воркеру с наибольшим весом hash(воркер, пользователь)
+# (rendezvous hashing): при выпадении воркера переезжают только его
+# пользователи, остальные остаются на своих местах.
+
+MASK = (1 << 64) - 1
+
+# Поля события, где лежит автор: у сообщений и нажатий — from,
+# у poll_answer и реакций — user, у постов в каналах — только chat
+OWNER_FIELDS = ("from", "user", "chat")
+
+
+def _mix(value):
+    # splitmix64: быстрый и хорошо перемешивающий хэш целого
+    value = (value + 0x9E3779B97F4A7C15) & MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+def routing_key(update):
+    # update — сырой словарь апдейта в формате Bot API
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        for owner_field in OWNER_FIELDS:
+            owner = event.get(owner_field)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return update["update_id"]
+
+
+def owner_of(key, workers):
+    key = _mix(key & MASK)
+    return max(workers, key=lambda worker: _mix(key ^ _mix(worker)))
@@ -0,0 +1,130 @@
+# bot/cluster/worker.py
+#
+# Процесс-воркер: свой Bot, свой Dispatcher и свои соединения с MongoDB.
+# Апдейты одного пользователя выполняются строго по очереди, разных — параллельно.
+
+import asyncio
+import logging
+import os
+import signal
+import threading
+from queue import Empty
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.types import Update
+
+from bot.cluster.routing import routing_key
+from bot.config import BOT_TOKEN, METRICS_PORT, WORKER_CONCURRENCY
+from bot.monitoring.middlewares import ApiMetricsMiddleware
+from bot.monitoring.server import MetricsServer
+
+logger = logging.getLogger(__name__)
+
+# Пустой апдейт в очереди — сигнал завершения от приёмника
+STOP = None
+
+
+class UserLanes:
+    # Цепочка задач на пользователя: каждый апдейт ждёт предыдущий апдейт
+    # того же пользователя, но не чужие
+
+    def __init__(self, concurrency=WORKER_CONCURRENCY):
+        self._tails = {}
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def submit(self, key, coroutine_factory):
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(key, previous, coroutine_factory))
+        self._tails[key] = task
+        return task
+
+    async def _run(self, key, previous, coroutine_factory):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            async with self._slots:
+                await coroutine_factory()
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+def _read_queue(queue, loop, inbox, prefetch):
+    # Блокирующее чтение multiprocessing-очереди в отдельном потоке. Из очереди
+    # забирается не больше prefetch необработанных апдейтов: остальные ждут
+    # в ней, и при падении воркера приёмник отдаст их другому.
+    # Если приёмник умер, не дождавшись остановки, воркер тоже завершается.
+    parent = os.getppid()
+    while True:
+        try:
+            if not prefetch.acquire(timeout=1):
+                raise Empty
+            try:
+                item = queue.get(timeout=1)
+            except Empty:
+                prefetch.release()
+                raise
+        except Empty:
+            if os.getppid() == parent:
+                continue
+            item = STOP
+        loop.call_soon_threadsafe(inbox.put_nowait, item)
+        if item is STOP:
+            return
+
+
+async def _serve(worker_id, queue, processed):
+    from bot.main import create_dispatcher, register_teardown
+
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(ApiMetricsMiddleware())
+    dp = create_dispatcher()
+    register_teardown(dp)
+    if METRICS_PORT:
+        # Метрики обработчиков каждого воркера — на своём порту
+        metrics_server = MetricsServer(port=METRICS_PORT + 1 + worker_id)
+        dp.startup.register(metrics_server.start)
+        dp.shutdown.register(metrics_server.stop)
+
+    await dp.emit_startup(bot=bot)
+    logger.info("Воркер %s запущен (pid %s)", worker_id, os.getpid())
+
+    inbox = asyncio.Queue()
+    prefetch = threading.Semaphore(WORKER_CONCURRENCY)
+    threading.Thread(
+        target=_read_queue, args=(queue, asyncio.get_running_loop(), inbox, prefetch), daemon=True
+    ).start()
+
+    lanes = UserLanes()
+
+    async def handle(raw):
+        try:
+            update = Update.model_validate(raw, context={"bot": bot})
+            await dp.feed_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки апдейта %s", raw.get("update_id"))
+        finally:
+            processed.value += 1
+            prefetch.release()
+
+    while (raw := await inbox.get()) is not STOP:
+        lanes.submit(routing_key(raw), lambda raw=raw: handle(raw))
+
+    await lanes.join()
+    await dp.emit_shutdown(bot=bot)
+    await bot.session.close()
+    logger.info("Воркер %s остановлен", worker_id)
+
+
+def run_worker(worker_id, queue, processed):
+    # Точка входа процесса. Ctrl+C получает вся группа процессов, но
+    # останавливает воркеры приёмник — после того как дочитаны очереди.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(worker_id, queue, processed))
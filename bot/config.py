@@ -1,7 +1,158 @@
 from dotenv import load_dotenv
+import hashlib
+import hmac
 import os
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
+
+# Подключение к MongoDB. Для локальной базы без TLS (тесты, бенчмарки):
+# MONGO_URI=mongodb://localhost:27017 MONGO_TLS=false
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "test")
+MONGO_TLS = os.getenv("MONGO_TLS", "true").lower() in ("1", "true", "yes")
+MONGO_TLS_CA_FILE = os.getenv("MONGO_TLS_CA_FILE")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+# Сжатие трафика, например "zstd,snappy,zlib" (zstd и snappy требуют своих пакетов)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+# Write concern по типам записи: число реплик или "majority"
+MONGO_W_USERS = os.getenv("MONGO_W_USERS", "majority")
+MONGO_W_RATINGS = os.getenv("MONGO_W_RATINGS", "majority")
+MONGO_W_MESSAGES = os.getenv("MONGO_W_MESSAGES", "1")
+MONGO_W_SERVICE = os.getenv("MONGO_W_SERVICE", "1")
+MONGO_WTIMEOUT_MS = int(os.getenv("MONGO_WTIMEOUT_MS", "5000"))
+
+# Экраны входящих только читают, им подходит вторичный узел реплики
+MONGO_INBOX_READ_PREFERENCE = os.getenv("MONGO_INBOX_READ_PREFERENCE", "secondaryPreferred")
+MONGO_INBOX_MAX_STALENESS_S = int(os.getenv("MONGO_INBOX_MAX_STALENESS_S", "-1"))
+
+INDEX_SELF_CHECK = os.getenv("INDEX_SELF_CHECK", "false").lower() in ("1", "true", "yes")
+
+# Очередь исходящих сообщений (лимиты Telegram: ~30 сообщений/с на бота, ~1/с в один чат)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_REPORT_INTERVAL = float(os.getenv("OUTBOX_REPORT_INTERVAL", "60"))
+
+# Режим мастера оценки: "fsm" — шаги в FSM-хранилище, "stateless" — в callback_data
+RATING_WIZARD = os.getenv("RATING_WIZARD", "fsm")
+WIZARD_SECRET = os.getenv("WIZARD_SECRET")
+
+# FSM-хранилище: "memory" — в памяти процесса, "mongo" — в коллекции fsm
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_TTL = int(os.getenv("FSM_TTL", str(2 * 24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "30"))
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.5"))
+# Неудачная отложенная запись повторяется с удвоением паузы не больше FSM_FLUSH_RETRIES раз
+FSM_FLUSH_RETRIES = int(os.getenv("FSM_FLUSH_RETRIES", "5"))
+
+# Пакетная запись оценок и сообщений: сброс по размеру пачки или по времени (секунды)
+BULK_MAX_BATCH = int(os.getenv("BULK_MAX_BATCH", "100"))
+BULK_MAX_DELAY = float(os.getenv("BULK_MAX_DELAY", "0.05"))
+
+# Таблицы лидеров: размер, порог числа оценок, период полного пересчёта и кэша (секунды)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "50"))
+LEADERBOARD_MIN_RATINGS = int(os.getenv("LEADERBOARD_MIN_RATINGS", "5"))
+LEADERBOARD_REBUILD_INTERVAL = float(os.getenv("LEADERBOARD_REBUILD_INTERVAL", "3600"))
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+
+# Антиспам: ведра на отправителя (все апдейты) и на пару отправитель-получатель
+# (отправка сообщения или оценки); скорость в токенах в секунду
+ANTISPAM_SENDER_RATE = float(os.getenv("ANTISPAM_SENDER_RATE", "2"))
+ANTISPAM_SENDER_BURST = float(os.getenv("ANTISPAM_SENDER_BURST", "20"))
+ANTISPAM_PAIR_RATE = float(os.getenv("ANTISPAM_PAIR_RATE", str(1 / 60)))
+ANTISPAM_PAIR_BURST = float(os.getenv("ANTISPAM_PAIR_BURST", "3"))
+ANTISPAM_MAX_TRACKED = int(os.getenv("ANTISPAM_MAX_TRACKED", "100000"))
+
+# Администраторы (через запятую): могут выгружать историю других пользователей
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Выгрузка истории: размер пачки курсора, число одновременных выгрузок
+# и предел размера файла (Bot API принимает документы до 50 МБ)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "2"))
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Метрики в формате Prometheus: локальный HTTP-эндпоинт /metrics (порт 0 — выключено)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Многопроцессный режим: один процесс принимает апдейты и раскладывает их
+# по WORKER_PROCESSES воркерам по id пользователя (0 — всё в одном процессе).
+# Чтобы шаги FSM переживали перезапуск воркера, нужен FSM_STORAGE=mongo
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "100"))
+WORKER_MAX_PENDING = int(os.getenv("WORKER_MAX_PENDING", "1000"))
+WORKER_REJOIN_TIMEOUT = float(os.getenv("WORKER_REJOIN_TIMEOUT", "10"))
+
+# Приём апдейтов: "polling" (по умолчанию) или "webhook"
+UPDATES_MODE = os.getenv("UPDATES_MODE", "polling")
+# Публичный адрес, на который Telegram шлёт апдейты, без пути: https://bot.example.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Без явного секрета выводится из BOT_TOKEN: одинаковый во всех процессах и после
+# перезапуска, так что апдейты, пришедшие во время переустановки вебхука, не отвергаются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hmac.new(
+    (BOT_TOKEN or "").encode(), b"webhook-secret", hashlib.sha256
+).hexdigest()
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "100"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Апдейты, накопившиеся пока бот был остановлен: "drain" — обработать
+# (по id апдейта отсеиваются уже обработанные), "drop" — выбросить
+STARTUP_BACKLOG = os.getenv("STARTUP_BACKLOG", "drain")
+BACKLOG_CONCURRENCY = int(os.getenv("BACKLOG_CONCURRENCY", "50"))
+BACKLOG_WINDOW = int(os.getenv("BACKLOG_WINDOW", "1000"))
+PROCESSED_UPDATES_TTL = int(os.getenv("PROCESSED_UPDATES_TTL", str(2 * 24 * 3600)))
+
+# Защита от повторной отправки оценок и сообщений (двойное нажатие, повтор апдейта):
+# сколько хранятся ключи и сколько последних держится в памяти
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "100000"))
+# Сколько секунд ключ принадлежит начатой попытке: после падения процесса
+# посреди записи следующая попытка забирает ключ, а не ждёт IDEMPOTENCY_TTL
+IDEMPOTENCY_LEASE = int(os.getenv("IDEMPOTENCY_LEASE", "60"))
+
+# Сводки для тех, кто включил их в меню: новые оценки и сообщения копятся
+# и приходят одним уведомлением не чаще раза за DIGEST_WINDOW секунд
+DIGEST_WINDOW = int(os.getenv("DIGEST_WINDOW", "3600"))
+DIGEST_LATEST = int(os.getenv("DIGEST_LATEST", "3"))
+DIGEST_POLL_INTERVAL = float(os.getenv("DIGEST_POLL_INTERVAL", "5"))
+# Сколько секунд держится в памяти настройка получателя
+DIGEST_PREFERENCE_TTL = float(os.getenv("DIGEST_PREFERENCE_TTL", "60"))
+
+# Рассылки администраторов (/broadcast): сколько сообщений в секунду отдаётся
+# рассылке из общего лимита OUTBOX_GLOBAL_RATE, сколько пользователей читается
+# за раз и сколько её доставок может ждать в очереди исходящих
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_MAX_PENDING = int(os.getenv("BROADCAST_MAX_PENDING", "2000"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "10"))
+
+# Экран статистики: оценки читаются пачками по STATS_BATCH_SIZE; столбцы и
+# готовый отчёт держатся в памяти для STATS_CACHE_SIZE пользователей
+STATS_BATCH_SIZE = int(os.getenv("STATS_BATCH_SIZE", "5000"))
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "500"))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "3600"))
+# Как часто пересчитываются средние по всему боту
+STATS_GLOBAL_TTL = float(os.getenv("STATS_GLOBAL_TTL", "600"))
+
+# Хранение сообщений и оценок: старше RETENTION_DAYS дней (0 — хранить всё)
+# они переносятся в сжатые файлы архива в RETENTION_ARCHIVE_DIR и удаляются
+# из рабочих коллекций; с пустым RETENTION_ARCHIVE_DIR — просто удаляются
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
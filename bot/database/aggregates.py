@@ -0,0 +1,180 @@
+# bot/database/aggregates.py
+
+from datetime import datetime
+from math import sqrt
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from bot.database.db import archived_totals_collection, ratings_collection, rating_aggregates_collection
+
+CRITERIA = ("appearance", "character", "intelligence", "humor", "trust")
+
+CRITERIA_LABELS = {
+    "appearance": "😍 Внешность",
+    "character": "👏 Характер",
+    "intelligence": "🧠 Ум",
+    "humor": "😂 Чувство юмора",
+    "trust": "🍬 Уровень доверия",
+}
+
+REBUILD_BATCH_SIZE = 500
+
+
+def build_aggregate_increment(rating_record):
+    increment = {"count": 1}
+    for criterion in CRITERIA:
+        score = rating_record["ratings"][criterion]
+        increment[f"sum.{criterion}"] = score
+        increment[f"sum_sq.{criterion}"] = score * score
+    increment["wants_relationship_yes"] = int(rating_record["wants_relationship"])
+    increment["knows_personally_yes"] = int(rating_record["knows_personally"])
+    return increment
+
+
+async def apply_rating_to_aggregate(rating_record):
+    # Один атомарный $inc на документ получателя вместо пересчёта по всем оценкам;
+    # обновлённый агрегат возвращается тем же запросом
+    return await rating_aggregates_collection.find_one_and_update(
+        {"user_id": rating_record["to_user_id"]},
+        {
+            "$inc": build_aggregate_increment(rating_record),
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+# Сколько последних пачек помнит документ итогов, чтобы не учесть повтор дважды
+ARCHIVED_BATCHES_KEPT = 16
+
+
+async def add_archived_totals(batch_key, ratings):
+    # Суммы уходящих в архив оценок копятся в archived_totals по получателю.
+    # Пачка с уже учтённым ключом (повтор после падения) пропускается: фильтр
+    # не находит документ, upsert упирается в уникальный user_id
+    totals = {}
+    for rating in ratings:
+        increment = totals.setdefault(rating["to_user_id"], {})
+        for field, value in build_aggregate_increment(rating).items():
+            increment[field] = increment.get(field, 0) + value
+    if not totals:
+        return
+    try:
+        await archived_totals_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"user_id": user_id, "batches": {"$ne": batch_key}},
+                    {
+                        "$inc": increment,
+                        "$push": {"batches": {"$each": [batch_key], "$slice": -ARCHIVED_BATCHES_KEPT}},
+                    },
+                    upsert=True,
+                )
+                for user_id, increment in totals.items()
+            ],
+            ordered=False,
+        )
+    except BulkWriteError as error:
+        if any(item["code"] != 11000 for item in error.details["writeErrors"]):
+            raise
+
+
+def summarize_aggregate(aggregate):
+    count = aggregate.get("count", 0) if aggregate else 0
+    if not count:
+        return None
+
+    averages = {}
+    deviations = {}
+    for criterion in CRITERIA:
+        total = aggregate["sum"][criterion]
+        mean = total / count
+        variance = max(aggregate["sum_sq"][criterion] / count - mean * mean, 0.0)
+        averages[criterion] = mean
+        deviations[criterion] = sqrt(variance)
+
+    return {
+        "count": count,
+        "averages": averages,
+        "deviations": deviations,
+        "wants_relationship_yes": aggregate.get("wants_relationship_yes", 0),
+        "knows_personally_yes": aggregate.get("knows_personally_yes", 0),
+    }
+
+
+def _rebuild_pipeline():
+    group = {"_id": "$to_user_id", "count": {"$sum": 1}}
+    for criterion in CRITERIA:
+        field = f"$ratings.{criterion}"
+        group[f"sum_{criterion}"] = {"$sum": field}
+        group[f"sum_sq_{criterion}"] = {"$sum": {"$multiply": [field, field]}}
+    group["wants_relationship_yes"] = {"$sum": {"$cond": ["$wants_relationship", 1, 0]}}
+    group["knows_personally_yes"] = {"$sum": {"$cond": ["$knows_personally", 1, 0]}}
+    return [{"$group": group}]
+
+
+def _aggregate_from_group(row, rebuilt_at):
+    return {
+        "user_id": row["_id"],
+        "count": row["count"],
+        "sum": {criterion: row[f"sum_{criterion}"] for criterion in CRITERIA},
+        "sum_sq": {criterion: row[f"sum_sq_{criterion}"] for criterion in CRITERIA},
+        "wants_relationship_yes": row["wants_relationship_yes"],
+        "knows_personally_yes": row["knows_personally_yes"],
+        "updated_at": rebuilt_at,
+    }
+
+
+async def rebuild_rating_aggregates(batch_size=REBUILD_BATCH_SIZE):
+    # Полный пересчёт из ratings_collection: группировка идёт на сервере,
+    # результат читается курсором и записывается пачками, так что в памяти
+    # держится не больше одной пачки. Затем добавляются итоги ушедших в архив
+    # оценок (archived_totals). Оценки, пришедшие во время пересчёта,
+    # могут быть учтены дважды или пропущены — запускайте в спокойное время.
+    rebuilt_at = datetime.utcnow()
+    cursor = ratings_collection.aggregate(
+        _rebuild_pipeline(), allowDiskUse=True, batchSize=batch_size
+    )
+
+    rebuilt = 0
+    operations = []
+    async for row in cursor:
+        aggregate = _aggregate_from_group(row, rebuilt_at)
+        operations.append(ReplaceOne({"user_id": aggregate["user_id"]}, aggregate, upsert=True))
+        if len(operations) >= batch_size:
+            await rating_aggregates_collection.bulk_write(operations, ordered=False)
+            rebuilt += len(operations)
+            operations = []
+
+    if operations:
+        await rating_aggregates_collection.bulk_write(operations, ordered=False)
+        rebuilt += len(operations)
+
+    # Архивные итоги добавляются к пересчитанному; у кого остались только
+    # архивные оценки, агрегат создаётся заново
+    operations = []
+    async for totals in archived_totals_collection.find({}, {"_id": 0, "batches": 0}).batch_size(batch_size):
+        user_id = totals.pop("user_id")
+        increment = {}
+        for field, value in totals.items():
+            if isinstance(value, dict):
+                increment.update({f"{field}.{key}": amount for key, amount in value.items()})
+            else:
+                increment[field] = value
+        operations.append(UpdateOne(
+            {"user_id": user_id}, {"$inc": increment, "$set": {"updated_at": rebuilt_at}}, upsert=True
+        ))
+        if len(operations) >= batch_size:
+            result = await rating_aggregates_collection.bulk_write(operations, ordered=False)
+            rebuilt += result.upserted_count
+            operations = []
+
+    if operations:
+        result = await rating_aggregates_collection.bulk_write(operations, ordered=False)
+        rebuilt += result.upserted_count
+
+    # Агрегаты пользователей, у которых больше нет оценок
+    await rating_aggregates_collection.delete_many({"updated_at": {"$lt": rebuilt_at}})
+    return rebuilt
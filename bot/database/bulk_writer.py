@@ -0,0 +1,144 @@
+# bot/database/bulk_writer.py
+
+import asyncio
+import logging
+from collections import deque
+from time import perf_counter
+
+from pymongo.errors import BulkWriteError, WriteError
+
+from bot.config import BULK_MAX_BATCH, BULK_MAX_DELAY
+from bot.database.db import ratings_collection, messages_collection, processed_updates_collection
+from bot.monitoring.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+flush_batch_size = registry.histogram(
+    "bulk_writer_batch_size", "Документов в пачке пакетной записи", ("collection",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+flush_seconds = registry.histogram(
+    "bulk_writer_flush_seconds", "Длительность записи пачки", ("collection",)
+)
+
+
+class BulkWriter:
+    # Копит вставки и пишет их одним insert_many(ordered=False), когда набралась
+    # пачка max_batch или прошло max_delay секунд с первой вставки в буфере.
+    # insert() возвращает _id документа только после того, как пачка записана;
+    # add() ставит документ в пачку и не ждёт записи.
+
+    def __init__(self, collection, max_batch=BULK_MAX_BATCH, max_delay=BULK_MAX_DELAY, history=1000):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.flushes = 0
+        self.documents = 0
+        self.errors = 0
+        self.batch_sizes = deque(maxlen=history)
+        self.flush_latencies = deque(maxlen=history)
+        self._buffer = []
+        self._flush_handle = None
+        self._tasks = set()
+        self._closed = False
+
+    async def insert(self, document):
+        if self._closed:
+            raise RuntimeError("BulkWriter уже закрыт")
+
+        future = asyncio.get_running_loop().create_future()
+        self._append(document, future)
+        return await future
+
+    def add(self, document):
+        if self._closed:
+            raise RuntimeError("BulkWriter уже закрыт")
+        self._append(document, None)
+
+    def _append(self, document, future):
+        self._buffer.append((document, future))
+        if len(self._buffer) >= self.max_batch:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.max_delay, self._start_flush)
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        started = perf_counter()
+        failed = {}
+        try:
+            await self.collection.insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = WriteError(error.get("errmsg"), error.get("code"), error)
+        except Exception as e:
+            failed = {index: e for index in range(len(batch))}
+        finally:
+            latency = perf_counter() - started
+            self.flushes += 1
+            self.batch_sizes.append(len(batch))
+            self.flush_latencies.append(latency)
+            flush_batch_size.observe(len(batch), self.collection.name)
+            flush_seconds.observe(latency, self.collection.name)
+
+        self.documents += len(batch) - len(failed)
+        self.errors += len(failed)
+        for index, (document, future) in enumerate(batch):
+            if future is None or future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(document["_id"])
+
+        # Ошибки документов из add() некому вернуть — только в лог
+        unobserved = sum(1 for index in failed if batch[index][1] is None)
+        if unobserved:
+            logger.warning("BulkWriter %s: не записано %s документов", self.collection.name, unobserved)
+
+    @property
+    def buffered(self):
+        # Документы, ещё не отправленные в базу
+        return len(self._buffer)
+
+    def stats(self):
+        sizes = list(self.batch_sizes)
+        latencies = sorted(self.flush_latencies)
+        return {
+            "flushes": self.flushes,
+            "documents": self.documents,
+            "errors": self.errors,
+            "buffered": self.buffered,
+            "avg_batch": sum(sizes) / len(sizes) if sizes else 0.0,
+            "max_batch": max(sizes) if sizes else 0,
+            "p50_flush_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+            "p99_flush_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        }
+
+    async def close(self):
+        # Дописываем всё, что осталось в буфере, и ждём незавершённые пачки
+        self._closed = True
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("BulkWriter %s остановлен: %s", self.collection.name, self.stats())
+
+
+ratings_writer = BulkWriter(ratings_collection)
+messages_writer = BulkWriter(messages_collection)
+# Отметки об обработанных апдейтах: не ждём записи и терпим дубликаты
+processed_updates_writer = BulkWriter(processed_updates_collection, max_delay=1.0)
+
+
+async def close_writers():
+    await asyncio.gather(ratings_writer.close(), messages_writer.close(), processed_updates_writer.close())
@@ -1,13 +1,147 @@
+# bot/database/db.py
+#
+# Клиент MongoDB создаётся при первом обращении к коллекции, а не при
+# импорте: настройки берутся из bot/config.py, а бенчмарк может подставить
+# свои коллекции через bind(), не касаясь сети.
+
 from motor.motor_asyncio import AsyncIOMotorClient
-from bot.config import MONGO_URI
+from pymongo import ReadPreference, WriteConcern
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 import certifi
 
-client = AsyncIOMotorClient(
+from bot.config import (
     MONGO_URI,
-    tls=True,
-    tlsCAFile=certifi.where()
+    MONGO_DB_NAME,
+    MONGO_TLS,
+    MONGO_TLS_CA_FILE,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_COMPRESSORS,
+    MONGO_W_USERS,
+    MONGO_W_RATINGS,
+    MONGO_W_MESSAGES,
+    MONGO_W_SERVICE,
+    MONGO_WTIMEOUT_MS,
+    MONGO_INBOX_READ_PREFERENCE,
+    MONGO_INBOX_MAX_STALENESS_S,
 )
-db = client["test"]
-users_collection = db["users"]
-messages_collection = db["messages"]
-ratings_collection = db["ratings"]
\ No newline at end of file
+from bot.monitoring.mongo import command_listener
+
+_client = None
+_collections = []
+
+
+def client_options():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        # Длительность команд по коллекциям для /metrics
+        "event_listeners": [command_listener],
+    }
+    if MONGO_TLS:
+        options["tls"] = True
+        options["tlsCAFile"] = MONGO_TLS_CA_FILE or certifi.where()
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(MONGO_URI, **client_options())
+    return _client
+
+
+def get_database():
+    return get_client()[MONGO_DB_NAME]
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+        for collection in _collections:
+            collection.reset()
+
+
+def write_concern(w):
+    return WriteConcern(w=int(w) if str(w).isdigit() else w, wtimeout=MONGO_WTIMEOUT_MS)
+
+
+def read_preference(name, max_staleness=-1):
+    if name == "primary":
+        return ReadPreference.PRIMARY
+    return make_read_preference(read_pref_mode_from_name(name), None, max_staleness)
+
+
+class LazyCollection:
+    # Ленивая ссылка на коллекцию: сама коллекция (с нужными write concern
+    # и read preference) появляется при первом вызове любого её метода
+
+    def __init__(self, name, write_concern=None, read_preference=None):
+        self.name = name
+        self.write_concern = write_concern
+        self.read_preference = read_preference
+        self._collection = None
+        _collections.append(self)
+
+    def resolve(self):
+        if self._collection is None:
+            collection = get_database()[self.name]
+            if self.write_concern is not None or self.read_preference is not None:
+                collection = collection.with_options(
+                    write_concern=self.write_concern, read_preference=self.read_preference
+                )
+            self._collection = collection
+        return self._collection
+
+    def bind(self, collection):
+        # Подставить готовую коллекцию (например, заглушку в бенчмарке)
+        self._collection = collection
+
+    def reset(self):
+        self._collection = None
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+def collections():
+    return list(_collections)
+
+
+INBOX_READ = read_preference(MONGO_INBOX_READ_PREFERENCE, MONGO_INBOX_MAX_STALENESS_S)
+
+users_collection = LazyCollection("users", write_concern(MONGO_W_USERS))
+messages_collection = LazyCollection("messages", write_concern(MONGO_W_MESSAGES))
+ratings_collection = LazyCollection("ratings", write_concern(MONGO_W_RATINGS))
+rating_aggregates_collection = LazyCollection("rating_aggregates", write_concern(MONGO_W_RATINGS))
+outbox_collection = LazyCollection("outbox", write_concern(MONGO_W_SERVICE))
+fsm_collection = LazyCollection("fsm", write_concern(MONGO_W_SERVICE))
+leaderboards_collection = LazyCollection("leaderboards", write_concern(MONGO_W_SERVICE))
+processed_updates_collection = LazyCollection("processed_updates", write_concern(MONGO_W_SERVICE))
+idempotency_collection = LazyCollection("idempotency", write_concern(MONGO_W_SERVICE))
+digests_collection = LazyCollection("digests", write_concern(MONGO_W_SERVICE))
+broadcasts_collection = LazyCollection("broadcasts", write_concern(MONGO_W_SERVICE))
+archive_index_collection = LazyCollection("archive_index", write_concern(MONGO_W_RATINGS))
+archived_totals_collection = LazyCollection("archived_totals", write_concern(MONGO_W_RATINGS))
+
+# Только для чтения на экранах входящих и в выгрузке
+inbox_messages_collection = LazyCollection("messages", read_preference=INBOX_READ)
+inbox_ratings_collection = LazyCollection("ratings", read_preference=INBOX_READ)
+inbox_rating_aggregates_collection = LazyCollection("rating_aggregates", read_preference=INBOX_READ)
@@ -0,0 +1,244 @@
+# bot/database/fsm_storage.py
+
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from time import monotonic
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from pymongo.errors import DuplicateKeyError
+
+from bot.config import FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_FLUSH_DELAY, FSM_FLUSH_RETRIES
+from bot.database.db import fsm_collection
+
+logger = logging.getLogger(__name__)
+
+STATE = "state"
+DATA = "data"
+# Сколько раз изменения накладываются на чужую версию, прежде чем сдаться
+CONFLICT_RETRIES = 3
+FLUSH_BACKOFF_CAP = 30.0
+
+
+class FSMConflictError(RuntimeError):
+    pass
+
+
+class _Record:
+    __slots__ = ("state", "data", "version", "loaded_at", "dirty", "changed", "failures", "flush_handle", "lock")
+
+    def __init__(self, state=None, data=None, version=0):
+        self.state = state
+        self.data = data or {}
+        self.version = version
+        self.loaded_at = monotonic()
+        self.dirty = False
+        # Какие части (состояние, данные) изменены с последней записи
+        self.changed = set()
+        self.failures = 0
+        self.flush_handle = None
+        self.lock = asyncio.Lock()
+
+
+class MongoStorage(BaseStorage):
+    # Состояние и данные FSM хранятся в одном документе на ключ. Изменения
+    # копятся в кэше процесса и пишутся одной операцией после обработчика
+    # (см. FSMFlushMiddleware) или через FSM_FLUSH_DELAY, если обработчик
+    # работал мимо диспетчера. Поле version защищает от перезаписи чужих
+    # изменений: запись проходит только если версия в базе не менялась,
+    # иначе документ перечитывается и изменённые части накладываются заново.
+    # Чистая запись кэша старше FSM_FLUSH_DELAY сверяет версию с базой, так что
+    # несколько процессов без шардирования не работают с устаревшим состоянием.
+
+    def __init__(
+        self,
+        collection=fsm_collection,
+        cache_size=FSM_CACHE_SIZE,
+        cache_ttl=FSM_CACHE_TTL,
+        flush_delay=FSM_FLUSH_DELAY,
+    ):
+        self.collection = collection
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.flush_delay = flush_delay
+        self.conflicts = 0
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def _document_id(key: StorageKey) -> str:
+        thread_id = key.thread_id if key.thread_id is not None else ""
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+    async def _record(self, key: StorageKey) -> _Record:
+        document_id = self._document_id(key)
+        record = self._cache.get(document_id)
+        if record is not None:
+            age = monotonic() - record.loaded_at
+            if record.dirty or age < self.flush_delay:
+                self._cache.move_to_end(document_id)
+                return record
+            if age < self.cache_ttl:
+                # Версия не менялась — кэш ещё верен, документ целиком не читаем
+                document = await self.collection.find_one({"_id": document_id}, {"version": 1})
+                version = document.get("version", 0) if document else 0
+                if record.dirty or version == record.version:
+                    record.loaded_at = monotonic()
+                    self._cache.move_to_end(document_id)
+                    return record
+
+        document = await self.collection.find_one({"_id": document_id})
+        # Пока шёл запрос, запись могли изменить в этом же процессе
+        current = self._cache.get(document_id)
+        if current is not None and current.dirty:
+            return current
+        if document:
+            record = _Record(document.get("state"), document.get("data"), document.get("version", 0))
+        else:
+            record = _Record()
+        self._cache[document_id] = record
+        self._evict()
+        return record
+
+    def _evict(self):
+        if len(self._cache) <= self.cache_size:
+            return
+        for document_id in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if not self._cache[document_id].dirty:
+                del self._cache[document_id]
+
+    def _mark_dirty(self, key: StorageKey, record: _Record, part=None, delay=None):
+        record.dirty = True
+        if part is not None:
+            record.changed.add(part)
+        if record.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            record.flush_handle = loop.call_later(
+                self.flush_delay if delay is None else delay, self._delayed_flush, key
+            )
+
+    def _delayed_flush(self, key: StorageKey):
+        task = asyncio.ensure_future(self.flush(key))
+        task.add_done_callback(lambda task: self._delayed_flush_done(key, task))
+
+    def _delayed_flush_done(self, key: StorageKey, task: asyncio.Task):
+        # Повтор запланировал сам flush, здесь ошибку остаётся только записать в лог
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Не удалось записать FSM для %s", self._document_id(key), exc_info=task.exception())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record, STATE)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        self._mark_dirty(key, record, DATA)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._record(key)
+        return record.data.copy()
+
+    async def _write(self, document_id, state, data, version):
+        # Возвращает новую версию или None, если версия в базе уже другая
+        try:
+            if state is None and not data:
+                result = await self.collection.delete_one({"_id": document_id, "version": version})
+                if result.deleted_count == 1:
+                    return 0
+                # Удалять нечего, только если документа и не было
+                if version == 0 and await self.collection.find_one({"_id": document_id}, {"_id": 1}) is None:
+                    return 0
+                return None
+            result = await self.collection.update_one(
+                {"_id": document_id, "version": version},
+                {
+                    "$set": {"state": state, "data": data, "updated_at": datetime.utcnow()},
+                    "$inc": {"version": 1},
+                },
+                upsert=version == 0,
+            )
+        except DuplicateKeyError:
+            return None
+        return version + 1 if result.matched_count == 1 or result.upserted_id is not None else None
+
+    async def _rebase(self, document_id, record, changed):
+        # Документ изменил другой процесс: берём его версию и накладываем
+        # свои изменения только на те части, которые меняли сами
+        document = await self.collection.find_one({"_id": document_id}) or {}
+        if STATE not in changed and STATE not in record.changed:
+            record.state = document.get("state")
+        if DATA not in changed and DATA not in record.changed:
+            record.data = document.get("data") or {}
+        record.version = document.get("version", 0)
+        record.changed |= changed
+        record.dirty = True
+
+    async def flush(self, key: StorageKey) -> bool:
+        document_id = self._document_id(key)
+        record = self._cache.get(document_id)
+        if record is None:
+            return True
+
+        async with record.lock:
+            if record.flush_handle is not None:
+                record.flush_handle.cancel()
+                record.flush_handle = None
+
+            for _ in range(CONFLICT_RETRIES + 1):
+                if not record.dirty:
+                    return True
+                state, data, version = record.state, record.data.copy(), record.version
+                changed, record.changed = record.changed, set()
+                record.dirty = False
+                try:
+                    new_version = await self._write(document_id, state, data, version)
+                    if new_version is None:
+                        self.conflicts += 1
+                        logger.info("Конфликт версий FSM для %s, изменения накладываются заново", document_id)
+                        await self._rebase(document_id, record, changed)
+                        continue
+                except Exception:
+                    record.dirty = True
+                    record.changed |= changed
+                    record.failures += 1
+                    if record.failures <= FSM_FLUSH_RETRIES:
+                        # Повтор с удвоением паузы; после FSM_FLUSH_RETRIES — при следующем апдейте
+                        delay = min(self.flush_delay * 2 ** record.failures, FLUSH_BACKOFF_CAP)
+                        self._mark_dirty(key, record, delay=delay)
+                    raise
+
+                # Изменения, появившиеся во время записи, уйдут следующим flush
+                record.version = new_version
+                record.failures = 0
+                if not record.dirty:
+                    record.loaded_at = monotonic()
+                return True
+
+            # Запись так и не прошла: не молчим, а отдаём ошибку вызывающему
+            self._cache.pop(document_id, None)
+            raise FSMConflictError(f"Не удалось записать FSM для {document_id}: версия меняется другим процессом")
+
+    async def flush_all(self):
+        keys = [document_id for document_id, record in self._cache.items() if record.dirty]
+        for document_id in keys:
+            bot_id, chat_id, user_id, thread_id, destiny = document_id.split(":", 4)
+            await self.flush(StorageKey(
+                bot_id=int(bot_id),
+                chat_id=int(chat_id),
+                user_id=int(user_id),
+                thread_id=int(thread_id) if thread_id else None,
+                destiny=destiny,
+            ))
+
+    async def close(self) -> None:
+        await self.flush_all()
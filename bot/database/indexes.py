@@ -0,0 +1,245 @@
+# bot/database/indexes.py
+
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from bot.database.db import (
+    get_database,
+    users_collection,
+    messages_collection,
+    ratings_collection,
+    rating_aggregates_collection,
+    outbox_collection,
+    fsm_collection,
+    processed_updates_collection,
+    idempotency_collection,
+    digests_collection,
+    broadcasts_collection,
+    archive_index_collection,
+    archived_totals_collection,
+)
+from bot.config import FSM_TTL, PROCESSED_UPDATES_TTL, IDEMPOTENCY_TTL
+from bot.database.projections import MESSAGE_PREVIEW_FIELDS, RATING_PREVIEW_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Доставленные и окончательно упавшие сообщения хранятся неделю
+OUTBOX_RETENTION = 7 * 24 * 3600
+
+INDEXES = [
+    (users_collection, [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("link_id", ASCENDING)], name="link_id_unique", unique=True),
+    ]),
+    (messages_collection, [
+        IndexModel(
+            [("recipient_user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="recipient_timestamp_id",
+        ),
+        # Частичный индекс только по непрочитанным — остаётся маленьким
+        IndexModel(
+            [("recipient_user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="recipient_unread_timestamp_id",
+            partialFilterExpression={"is_read": False},
+        ),
+        # Отбор старых сообщений для архива (bot/services/retention.py)
+        IndexModel([("timestamp", ASCENDING)], name="timestamp"),
+    ]),
+    (ratings_collection, [
+        IndexModel(
+            [("to_user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="recipient_timestamp_id",
+        ),
+        IndexModel([("timestamp", ASCENDING)], name="timestamp"),
+    ]),
+    (rating_aggregates_collection, [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ]),
+    (outbox_collection, [
+        IndexModel(
+            [("status", ASCENDING), ("priority", ASCENDING), ("not_before", ASCENDING)],
+            name="status_priority_not_before",
+        ),
+        IndexModel([("finished_at", ASCENDING)], name="finished_ttl", expireAfterSeconds=OUTBOX_RETENTION),
+        # Прогресс рассылки и отмена её недоставленных сообщений
+        IndexModel(
+            [("broadcast_id", ASCENDING), ("status", ASCENDING)],
+            name="broadcast_status",
+            partialFilterExpression={"broadcast_id": {"$exists": True}},
+        ),
+    ]),
+    (fsm_collection, [
+        # Брошенные на полпути сценарии удаляются сами
+        IndexModel([("updated_at", ASCENDING)], name="updated_ttl", expireAfterSeconds=FSM_TTL),
+    ]),
+    (processed_updates_collection, [
+        # Telegram хранит неотданные апдейты сутки — дольше отметки не нужны
+        IndexModel([("processed_at", ASCENDING)], name="processed_ttl", expireAfterSeconds=PROCESSED_UPDATES_TTL),
+    ]),
+    (idempotency_collection, [
+        # Уникальность ключа даёт сам _id; здесь только срок хранения
+        IndexModel([("created_at", ASCENDING)], name="created_ttl", expireAfterSeconds=IDEMPOTENCY_TTL),
+    ]),
+    (digests_collection, [
+        IndexModel([("due_at", ASCENDING)], name="due_at"),
+    ]),
+    (broadcasts_collection, [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ]),
+    (archive_index_collection, [
+        IndexModel([("user_id", ASCENDING), ("kind", ASCENDING), ("first", ASCENDING)], name="user_kind_first"),
+    ]),
+    (archived_totals_collection, [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ]),
+]
+
+# Индексы, которые покрываются более новыми и только замедляют запись
+OBSOLETE_INDEXES = [
+    (messages_collection, "recipient_timestamp"),
+    (ratings_collection, "recipient_timestamp"),
+]
+
+
+class QueryPlanError(RuntimeError):
+    pass
+
+
+class DuplicateUsersError(RuntimeError):
+    pass
+
+
+class UnsupportedServerError(RuntimeError):
+    pass
+
+
+# Минимальная версия сервера MongoDB: таблицы лидеров обновляются конвейером
+# с $sortArray (bot/services/leaderboard.py), он появился в 5.2. На старом
+# сервере каждая оценка падала бы при записи — проверяем при запуске
+MONGO_MIN_SERVER_VERSION = (5, 2)
+
+
+async def check_server_version(database=None):
+    info = await (database if database is not None else get_database()).command("buildInfo")
+    version = tuple(info.get("versionArray") or map(int, info["version"].split(".")[:2]))[:2]
+    if version < MONGO_MIN_SERVER_VERSION:
+        raise UnsupportedServerError(
+            f"Нужен MongoDB {'.'.join(map(str, MONGO_MIN_SERVER_VERSION))} или новее, "
+            f"сервер — {info.get('version')}"
+        )
+    return version
+
+
+DUPLICATE_KEY = 11000
+# Сколько повторяющихся значений показывать в сообщении об ошибке
+DUPLICATES_SHOWN = 10
+
+
+def find_duplicates(collection, field, limit=None):
+    # Значения поля, которые встречаются больше чем в одном документе, с _id этих документов
+    pipeline = [
+        {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    return collection.aggregate(pipeline, allowDiskUse=True)
+
+
+async def ensure_indexes():
+    await check_server_version()
+    for collection, indexes in INDEXES:
+        try:
+            names = await collection.create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY or collection is not users_collection:
+                raise
+            # Уникальный индекс не строится, пока в данных есть повторы
+            for field in ("user_id", "link_id"):
+                duplicates = [row["_id"] async for row in find_duplicates(collection, field, DUPLICATES_SHOWN)]
+                if duplicates:
+                    logger.error("Повторяющиеся %s в users: %s", field, ", ".join(map(str, duplicates)))
+            raise DuplicateUsersError(
+                "В users есть повторяющиеся user_id или link_id, уникальные индексы не созданы. "
+                "Уберите повторы: python manage.py dedupe-users"
+            ) from e
+        logger.info("Индексы %s: %s", collection.name, ", ".join(names))
+
+    for collection, name in OBSOLETE_INDEXES:
+        try:
+            await collection.drop_index(name)
+            logger.info("Удалён устаревший индекс %s.%s", collection.name, name)
+        except OperationFailure:
+            pass
+
+
+_PROBE_TIME = datetime(2000, 1, 1)
+_PROBE_ID = ObjectId("000000000000000000000000")
+
+
+def handler_queries():
+    # Те же запросы, что выполняют обработчики, с фиктивными значениями
+    return [
+        ("handle_referral", users_collection.find({"link_id": ""}).limit(1)),
+        ("start_cmd", users_collection.find({"user_id": 0}).limit(1)),
+        ("back_to_start", users_collection.find({"user_id": 0}).limit(1)),
+        (
+            "show_my_messages",
+            messages_collection.find(
+                {"recipient_user_id": 0}, MESSAGE_PREVIEW_FIELDS
+            ).sort([("timestamp", -1), ("_id", -1)]).limit(11),
+        ),
+        (
+            "show_my_messages:older",
+            messages_collection.find(
+                {
+                    "recipient_user_id": 0,
+                    "timestamp": {"$lte": _PROBE_TIME},
+                    "$or": [{"timestamp": {"$lt": _PROBE_TIME}}, {"_id": {"$lt": _PROBE_ID}}],
+                },
+                MESSAGE_PREVIEW_FIELDS,
+            ).sort([("timestamp", -1), ("_id", -1)]).limit(11),
+        ),
+        (
+            "show_my_messages:unread",
+            messages_collection.find(
+                {"recipient_user_id": 0, "is_read": False}, MESSAGE_PREVIEW_FIELDS
+            ).sort([("timestamp", -1), ("_id", -1)]).limit(11),
+        ),
+        (
+            "show_my_ratings",
+            ratings_collection.find(
+                {"to_user_id": 0}, RATING_PREVIEW_FIELDS
+            ).sort([("timestamp", -1), ("_id", -1)]).limit(6),
+        ),
+        ("show_my_ratings:aggregate", rating_aggregates_collection.find({"user_id": 0}).limit(1)),
+    ]
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+async def verify_query_plans():
+    failed = []
+    for name, cursor in handler_queries():
+        explanation = await cursor.explain()
+        stages = set(_plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {})))
+        if "COLLSCAN" in stages:
+            failed.append(name)
+        else:
+            logger.info("План запроса %s: %s", name, ", ".join(sorted(stages)))
+
+    if failed:
+        raise QueryPlanError(f"Запросы выполняются полным сканированием коллекции: {', '.join(failed)}")
@@ -0,0 +1,90 @@
+# bot/database/pagination.py
+#
+# Постраничный вывод по ключу (timestamp, _id) вместо skip: страница N
+# стоит столько же, сколько первая, потому что запрос начинается с границы
+# предыдущей страницы в индексе (получатель, timestamp, _id).
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from bot.utils.encoding import to_base36, from_base36
+
+OLDER = "o"
+NEWER = "n"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(document):
+    milliseconds = (document["timestamp"] - _EPOCH) // timedelta(milliseconds=1)
+    return f"{to_base36(milliseconds)}:{document['_id']}"
+
+
+def decode_cursor(cursor):
+    try:
+        milliseconds, object_id = cursor.split(":")
+        return _EPOCH + timedelta(milliseconds=from_base36(milliseconds)), ObjectId(object_id)
+    except (ValueError, InvalidId):
+        raise InvalidCursor(cursor)
+
+
+def parse_page_callback(data, prefix):
+    # "<prefix>:<направление>:<курсор>" или просто первая страница
+    if not data.startswith(f"{prefix}:"):
+        return OLDER, None
+    _, direction, cursor = data.split(":", 2)
+    if direction not in (OLDER, NEWER):
+        raise InvalidCursor(data)
+    return direction, decode_cursor(cursor)
+
+
+def page_callback(prefix, direction, document):
+    return f"{prefix}:{direction}:{encode_cursor(document)}"
+
+
+def _beyond(query, timestamp, object_id, direction, inclusive=False):
+    # Документы за границей (timestamp, _id) в сторону direction
+    query = dict(query)
+    if direction == OLDER:
+        query["timestamp"] = {"$lte": timestamp}
+        query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"_id": {"$lte" if inclusive else "$lt": object_id}}]
+    else:
+        query["timestamp"] = {"$gte": timestamp}
+        query["$or"] = [{"timestamp": {"$gt": timestamp}}, {"_id": {"$gte" if inclusive else "$gt": object_id}}]
+    return query
+
+
+async def _exists(collection, query):
+    return bool(await collection.find(query, {"_id": 1}).limit(1).to_list(length=1))
+
+
+async def fetch_page(collection, query, projection, limit, direction=OLDER, cursor=None):
+    # Возвращает документы от новых к старым и признаки наличия соседних страниц
+    order = -1 if direction == OLDER else 1
+    page_query = query if cursor is None else _beyond(query, *cursor, direction)
+    documents = await collection.find(page_query, projection).sort(
+        [("timestamp", order), ("_id", order)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    # С обратной стороны проверяем, есть ли что-то за границей страницы на самом деле:
+    # якорь мог быть крайним или уже уйти в архив
+    back = NEWER if direction == OLDER else OLDER
+    if cursor is None:
+        has_back = False
+    elif documents:
+        has_back = await _exists(collection, _beyond(query, documents[0]["timestamp"], documents[0]["_id"], back))
+    else:
+        has_back = await _exists(collection, _beyond(query, *cursor, back, inclusive=True))
+
+    if direction == OLDER:
+        return documents, has_more, has_back
+    documents.reverse()
+    return documents, has_back, has_more
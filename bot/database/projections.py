@@ -0,0 +1,24 @@
+# bot/database/projections.py
+#
+# Поля, которые реально выводятся на экранах входящих
+
+MESSAGE_PREVIEW_FIELDS = {"timestamp": 1, "message_text": 1, "is_read": 1}
+
+RATING_PREVIEW_FIELDS = {
+    "timestamp": 1,
+    "anonymous": 1,
+    "from_username": 1,
+    "ratings.appearance": 1,
+    "ratings.character": 1,
+    "ratings.intelligence": 1,
+}
+
+# Столбцы для экрана статистики: только оценки и время
+RATING_STATS_FIELDS = {
+    "timestamp": 1,
+    "ratings.appearance": 1,
+    "ratings.character": 1,
+    "ratings.intelligence": 1,
+    "ratings.humor": 1,
+    "ratings.trust": 1,
+}
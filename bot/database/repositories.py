@@ -0,0 +1,102 @@
+# bot/database/repositories.py
+#
+# Доступ к пользователям, оценкам и сообщениям для обработчиков. Записи идут
+# в основной узел с write concern своего типа, а экраны входящих читают
+# через коллекции с MONGO_INBOX_READ_PREFERENCE.
+
+from datetime import datetime
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+
+from bot.database.aggregates import apply_rating_to_aggregate
+from bot.database.bulk_writer import messages_writer, ratings_writer
+from bot.database.db import (
+    users_collection,
+    inbox_messages_collection,
+    inbox_ratings_collection,
+    inbox_rating_aggregates_collection,
+)
+from bot.database.pagination import fetch_page
+from bot.database.projections import MESSAGE_PREVIEW_FIELDS, RATING_PREVIEW_FIELDS
+
+
+class UsersRepository:
+    def __init__(self, collection=users_collection):
+        self.collection = collection
+
+    async def get(self, user_id):
+        return await self.collection.find_one({"user_id": user_id})
+
+    async def get_by_link(self, link_id):
+        return await self.collection.find_one({"link_id": link_id})
+
+    async def get_or_create(self, user_id, username):
+        # Проверка и вставка одним upsert: повторный /start не упирается
+        # в уникальный индекс user_id
+        return await self.collection.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {
+                "username": username,
+                "link_id": str(uuid4()),
+                "unread_messages": 0,
+                "created_at": datetime.utcnow(),
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def set_blocked(self, user_id, blocked):
+        # Заблокировавшие бота пропускаются рассылками, пока снова не напишут ему
+        if blocked:
+            update = {"$set": {"blocked": True, "blocked_at": datetime.utcnow()}}
+        else:
+            update = {"$unset": {"blocked": "", "blocked_at": ""}}
+        await self.collection.update_one({"user_id": user_id}, update)
+
+
+class MessagesRepository:
+    def __init__(self, writer=messages_writer, inbox=inbox_messages_collection):
+        self.writer = writer
+        self.inbox = inbox
+
+    async def add(self, message):
+        return await self.writer.insert(message)
+
+    async def page(self, recipient_user_id, limit, direction, cursor, unread_only=False):
+        query = {"recipient_user_id": recipient_user_id}
+        if unread_only:
+            query["is_read"] = False
+        return await fetch_page(self.inbox, query, MESSAGE_PREVIEW_FIELDS, limit, direction, cursor)
+
+
+class RatingsRepository:
+    def __init__(
+        self,
+        writer=ratings_writer,
+        inbox=inbox_ratings_collection,
+        aggregates=inbox_rating_aggregates_collection,
+    ):
+        self.writer = writer
+        self.inbox = inbox
+        self.aggregates = aggregates
+
+    async def add(self, rating):
+        await self.writer.insert(rating)
+
+    async def apply_to_aggregate(self, rating):
+        # Возвращает обновлённый агрегат получателя
+        return await apply_rating_to_aggregate(rating)
+
+    async def get_aggregate(self, user_id):
+        return await self.aggregates.find_one({"user_id": user_id})
+
+    async def page(self, to_user_id, limit, direction, cursor):
+        return await fetch_page(
+            self.inbox, {"to_user_id": to_user_id}, RATING_PREVIEW_FIELDS, limit, direction, cursor
+        )
+
+
+users_repo = UsersRepository()
+messages_repo = MessagesRepository()
+ratings_repo = RatingsRepository()
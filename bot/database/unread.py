@@ -0,0 +1,26 @@
+# bot/database/unread.py
+#
+# Счётчик непрочитанных хранится в документе пользователя, чтобы меню
+# не считало сообщения через count_documents при каждом показе.
+
+from bot.database.db import users_collection, messages_collection
+
+
+async def increment_unread(user_id):
+    await users_collection.update_one({"user_id": user_id}, {"$inc": {"unread_messages": 1}})
+
+
+async def mark_messages_read(user_id, message_ids):
+    if not message_ids:
+        return 0
+    # Помечаются только ещё непрочитанные, поэтому одновременные открытия
+    # входящих не уменьшат счётчик дважды
+    result = await messages_collection.update_many(
+        {"_id": {"$in": message_ids}, "recipient_user_id": user_id, "is_read": False},
+        {"$set": {"is_read": True}},
+    )
+    if result.modified_count:
+        await users_collection.update_one(
+            {"user_id": user_id}, {"$inc": {"unread_messages": -result.modified_count}}
+        )
+    return result.modified_count
@@ -0,0 +1,43 @@
+# bot/handlers/broadcast.py
+#
+# /broadcast <текст> — рассылка всем пользователям (только для администраторов).
+# /broadcast status — ход последней рассылки, /broadcast stop — отменить текущую.
+
+from aiogram import Router, F
+from aiogram.types import Message
+
+from bot.config import ADMIN_IDS
+from bot.services.broadcast import CANCELLED, DONE, RUNNING, broadcasts
+
+router = Router()
+
+STATUS_LABELS = {
+    RUNNING: "идёт",
+    DONE: "поставлена в очередь целиком",
+    CANCELLED: "отменена",
+}
+
+
+@router.message(F.text.startswith("/broadcast"), F.from_user.id.in_(ADMIN_IDS))
+async def broadcast_cmd(message: Message):
+    parts = message.html_text.split(maxsplit=1)
+    argument = parts[1].strip() if len(parts) > 1 else ""
+
+    if argument.lower() == "status":
+        broadcast = await broadcasts.latest()
+        if broadcast is None:
+            await message.answer("Рассылок ещё не было.")
+            return
+        sent, failed = await broadcasts.progress(broadcast)
+        await message.answer(
+            f"📣 Рассылка от {broadcast['created_at']:%d.%m.%Y %H:%M}: {STATUS_LABELS[broadcast['status']]}\n"
+            f"В очереди: {broadcast['enqueued']}, доставлено: {sent}, не доставлено: {failed}"
+        )
+    elif argument.lower() == "stop":
+        broadcast = await broadcasts.cancel()
+        await message.answer("⏹ Рассылка отменена." if broadcast else "Сейчас ничего не рассылается.")
+    elif argument:
+        await broadcasts.create(argument, message.from_user.id)
+        await message.answer("📣 Рассылка запущена. Ход: /broadcast status")
+    else:
+        await message.answer("❌ Использование: /broadcast <текст> | status | stop")
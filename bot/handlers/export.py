@@ -0,0 +1,100 @@
+# bot/handlers/export.py
+#
+# /export [csv|json] [gz] — выгрузка полученных оценок и сообщений файлом.
+# Администратор может добавить id пользователя: /export json 123456789
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import FSInputFile, Message
+
+from bot.config import ADMIN_IDS, EXPORT_MAX_BYTES
+from bot.services.export import CSV, FORMATS, export_history, export_slots
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Пользователи, чья выгрузка уже идёт: повторная команда не запускает вторую
+_running = set()
+# Выгрузки идут фоновыми задачами, чтобы не держать обработчик апдейта
+_tasks = set()
+
+
+def parse_export_args(text):
+    fmt, compress, target_user_id = CSV, False, None
+    for argument in text.split()[1:]:
+        argument = argument.lower()
+        if argument in FORMATS:
+            fmt = argument
+        elif argument in ("gz", "gzip"):
+            compress = True
+        elif argument.isdigit():
+            target_user_id = int(argument)
+        else:
+            raise ValueError(argument)
+    return fmt, compress, target_user_id
+
+
+@router.message(Command("export"))
+async def export_cmd(message: Message):
+    try:
+        fmt, compress, target_user_id = parse_export_args(message.text)
+    except ValueError:
+        await message.answer("❌ Использование: /export [csv|json] [gz]")
+        return
+
+    if target_user_id is None:
+        target_user_id = message.from_user.id
+    elif target_user_id != message.from_user.id and message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Выгружать можно только свою историю.")
+        return
+
+    if target_user_id in _running:
+        await message.answer("⏳ Выгрузка уже готовится, дождитесь файла.")
+        return
+
+    _running.add(target_user_id)
+    if export_slots.locked():
+        await message.answer("⏳ Сейчас готовятся другие выгрузки, ваша начнётся следом.")
+    else:
+        await message.answer("⏳ Готовим выгрузку, файл придёт сюда.")
+    task = asyncio.create_task(_export(message, target_user_id, fmt, compress))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _export(message, target_user_id, fmt, compress):
+    try:
+        async with export_slots:
+            path, rows = await export_history(target_user_id, fmt, compress)
+        try:
+            if os.path.getsize(path) > EXPORT_MAX_BYTES:
+                await message.answer("❌ Файл получился слишком большим. Попробуйте с параметром gz.")
+                return
+            filename = f"history_{target_user_id}_{datetime.utcnow():%Y%m%d}.{fmt}" + (".gz" if compress else "")
+            await message.answer_document(
+                FSInputFile(path, filename=filename),
+                caption=f"📦 Выгрузка истории: {rows} записей",
+            )
+        finally:
+            os.remove(path)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Не удалось выгрузить историю пользователя %s", target_user_id)
+        await message.answer("❌ Не удалось подготовить выгрузку, попробуйте позже.")
+    finally:
+        _running.discard(target_user_id)
+
+
+@router.shutdown()
+async def cancel_exports():
+    # Незаконченные выгрузки при остановке отменяются, временные файлы удаляются
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,65 @@
+# bot/handlers/leaderboard.py
+
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.config import LEADERBOARD_MIN_RATINGS
+from bot.handlers.start import CRITERIA_LABELS
+from bot.services.leaderboard import LEADERBOARD_CRITERIA, OVERALL, leaderboards
+
+router = Router()
+
+ENTRIES_PER_PAGE = 10
+
+LEADERBOARD_LABELS = {**CRITERIA_LABELS, OVERALL: "⭐ В среднем"}
+
+
+@router.callback_query(F.data == "top")
+async def choose_leaderboard(callback_query: CallbackQuery):
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=LEADERBOARD_LABELS[criterion], callback_data=f"top:{criterion}:0")]
+        for criterion in LEADERBOARD_CRITERIA
+    ] + [
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
+    ])
+
+    await callback_query.message.edit_text(
+        "🏆 Топ пользователей\n\n"
+        f"Учитываются пользователи, у которых не меньше {LEADERBOARD_MIN_RATINGS} оценок.\n"
+        "Выберите критерий:",
+        reply_markup=keyboard
+    )
+
+
+@router.callback_query(F.data.startswith("top:"))
+async def show_leaderboard(callback_query: CallbackQuery):
+    try:
+        _, criterion, page = callback_query.data.split(":")
+        page = int(page)
+    except ValueError:
+        await callback_query.answer("❌ Кнопка устарела")
+        return
+    if criterion not in LEADERBOARD_CRITERIA:
+        await callback_query.answer("❌ Кнопка устарела")
+        return
+
+    entries = await leaderboards.get(criterion)
+    offset = page * ENTRIES_PER_PAGE
+    page_entries = entries[offset:offset + ENTRIES_PER_PAGE]
+
+    text = f"🏆 Топ: {LEADERBOARD_LABELS[criterion]}\n\n"
+    if not page_entries:
+        text += "Пока никто не набрал достаточно оценок."
+    for position, entry in enumerate(page_entries, offset + 1):
+        username = f"@{entry['username']}" if entry.get('username') else "Без имени"
+        text += f"{position}. {username} — {entry['average']:.2f}/10 ({entry['count']} оценок)\n"
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"top:{criterion}:{page - 1}"))
+    if offset + ENTRIES_PER_PAGE < len(entries):
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"top:{criterion}:{page + 1}"))
+
+    rows = [navigation] if navigation else []
+    rows.append([InlineKeyboardButton(text="🔙 К критериям", callback_data="top")])
+    await callback_query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
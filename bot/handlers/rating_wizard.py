@@ -0,0 +1,231 @@
+# bot/handlers/rating_wizard.py
+#
+# Мастер оценки без FSM: уже выставленные оценки упакованы в callback_data
+# следующей клавиатуры и подписаны, так что промежуточные шаги не ходят
+# в хранилище. Подключается вместо шагов из start.py при RATING_WIZARD=stateless.
+
+import hashlib
+import hmac
+from base64 import urlsafe_b64encode
+
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.fsm.context import FSMContext
+
+from bot.config import BOT_TOKEN, WIZARD_SECRET
+from bot.database.aggregates import CRITERIA
+from bot.handlers.start import CRITERIA_LABELS, InteractionStates, deliver_rating
+from bot.utils.encoding import to_base36, from_base36
+
+router = Router()
+
+PREFIX = "wz"
+ACTION_ANSWER = "r"
+ACTION_WRITE_MESSAGE = "m"
+ACTION_SKIP_MESSAGE = "s"
+ACTION_SEND_ANONYMOUS = "a"
+ACTION_SEND_NAMED = "n"
+
+# Ограничение Telegram на длину callback_data
+CALLBACK_DATA_LIMIT = 64
+SIGNATURE_BYTES = 6
+
+CRITERIA_PROMPTS = {
+    "appearance": "😍 Оцените внешность (1-10):",
+    "character": "👏 Оцените характер (1-10):",
+    "intelligence": "🧠 Оцените ум (1-10):",
+    "humor": "😂 Оцените чувство юмора (1-10):",
+    "trust": "🍬 Оцените уровень доверия (1-10):",
+}
+
+# Ответы пакуются по одному символу: оценка 1-9 — цифрой, 10 — "0", да/нет — "y"/"n"
+STEPS = len(CRITERIA) + 2
+
+_secret = (WIZARD_SECRET or f"wizard:{BOT_TOKEN or ''}").encode()
+
+
+class InvalidWizardData(ValueError):
+    pass
+
+
+def _sign(user_id, action, recipient, answers):
+    message = f"{user_id}:{action}:{recipient}:{answers}".encode()
+    digest = hmac.new(_secret, message, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def pack(user_id, action, recipient_user_id, answers):
+    recipient = to_base36(recipient_user_id)
+    data = f"{PREFIX}{action}:{recipient}:{answers}:{_sign(user_id, action, recipient, answers)}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise InvalidWizardData("callback_data не помещается в 64 байта")
+    return data
+
+
+def unpack(user_id, data):
+    try:
+        head, recipient, answers, signature = data.split(":")
+    except ValueError:
+        raise InvalidWizardData("повреждённые данные мастера")
+
+    action = head[len(PREFIX):]
+    expected = _sign(user_id, action, recipient, answers)
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidWizardData("неверная подпись")
+    if len(answers) > STEPS:
+        raise InvalidWizardData("слишком много ответов")
+
+    return action, from_base36(recipient), answers
+
+
+def encode_score(score):
+    return str(score % 10)
+
+
+def decode_answers(answers):
+    scores = answers[:len(CRITERIA)]
+    ratings = {
+        criterion: int(char) or 10
+        for criterion, char in zip(CRITERIA, scores)
+    }
+    wants_relationship = None
+    knows_personally = None
+    if len(answers) > len(CRITERIA):
+        wants_relationship = "yes" if answers[len(CRITERIA)] == "y" else "no"
+    if len(answers) > len(CRITERIA) + 1:
+        knows_personally = "yes" if answers[len(CRITERIA) + 1] == "y" else "no"
+    return ratings, wants_relationship, knows_personally
+
+
+def _summary(answers):
+    ratings, wants_relationship, knows_personally = decode_answers(answers)
+    text = ""
+    for criterion, score in ratings.items():
+        text += f"{CRITERIA_LABELS[criterion]}: {score}/10 ✅\n"
+    if wants_relationship is not None:
+        text += f"👩‍❤️‍👨 Хочет встречаться: {'Да' if wants_relationship == 'yes' else 'Нет'} ✅\n"
+    if knows_personally is not None:
+        text += f"👀 Знакомы лично: {'Да' if knows_personally == 'yes' else 'Нет'} ✅\n"
+    return text
+
+
+def build_step(user_id, recipient_user_id, answers, recipient_username=None):
+    step = len(answers)
+
+    if step < len(CRITERIA):
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text=f"{i}",
+                callback_data=pack(user_id, ACTION_ANSWER, recipient_user_id, answers + encode_score(i))
+            )]
+            for i in range(1, 11)
+        ])
+        prompt = CRITERIA_PROMPTS[CRITERIA[step]]
+    elif step < STEPS:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="Да",
+                callback_data=pack(user_id, ACTION_ANSWER, recipient_user_id, answers + "y")
+            )],
+            [InlineKeyboardButton(
+                text="Нет",
+                callback_data=pack(user_id, ACTION_ANSWER, recipient_user_id, answers + "n")
+            )]
+        ])
+        if step == len(CRITERIA):
+            prompt = "👩‍❤️‍👨 Хотели бы встречаться с этим человеком?"
+        else:
+            prompt = "👀 Знакомы ли вы лично с этим человеком?"
+    else:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="✍️ Да, хочу написать сообщение",
+                callback_data=pack(user_id, ACTION_WRITE_MESSAGE, recipient_user_id, answers)
+            )],
+            [InlineKeyboardButton(
+                text="➡️ Нет, отправить только оценку",
+                callback_data=pack(user_id, ACTION_SKIP_MESSAGE, recipient_user_id, answers)
+            )]
+        ])
+        prompt = "💬 Хотите добавить личное сообщение к оценке?"
+
+    header = f"Оценка пользователя: @{recipient_username}\n\n" if recipient_username else ""
+    summary = _summary(answers)
+    if summary:
+        summary += "\n"
+    return header + summary + prompt, keyboard
+
+
+@router.callback_query(F.data == "start_rating")
+async def start_stateless_rating(callback_query: CallbackQuery, state: FSMContext):
+    # Получатель уже лежит в состоянии после перехода по ссылке
+    data = await state.get_data()
+    recipient_user_id = data.get('recipient_user_id')
+
+    if not recipient_user_id:
+        await callback_query.message.edit_text("❌ Произошла ошибка. Попробуйте еще раз.")
+        return
+
+    text, keyboard = build_step(
+        callback_query.from_user.id, recipient_user_id, "", data.get('recipient_username')
+    )
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith(PREFIX))
+async def handle_wizard_step(callback_query: CallbackQuery, state: FSMContext):
+    user_id = callback_query.from_user.id
+    try:
+        action, recipient_user_id, answers = unpack(user_id, callback_query.data)
+    except InvalidWizardData:
+        await callback_query.answer("❌ Кнопка устарела или повреждена", show_alert=True)
+        return
+
+    complete = len(answers) == STEPS
+    if action == ACTION_ANSWER:
+        text, keyboard = build_step(user_id, recipient_user_id, answers)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+        return
+
+    if not complete:
+        await callback_query.answer("❌ Кнопка устарела или повреждена", show_alert=True)
+        return
+
+    ratings, wants_relationship, knows_personally = decode_answers(answers)
+
+    if action == ACTION_WRITE_MESSAGE:
+        # Текст приходит отдельным сообщением, поэтому дальше работает обычный FSM-сценарий
+        await state.update_data(
+            recipient_user_id=recipient_user_id,
+            ratings=ratings,
+            wants_relationship=wants_relationship,
+            knows_personally=knows_personally,
+        )
+        await state.set_state(InteractionStates.writing_message)
+        await callback_query.message.edit_text(
+            "✍️ Напишите ваше сообщение для этого пользователя:\n\n"
+            "Отправьте текст сообщения следующим сообщением."
+        )
+    elif action == ACTION_SKIP_MESSAGE:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="👤 Скрыть мою личность (анонимно)",
+                callback_data=pack(user_id, ACTION_SEND_ANONYMOUS, recipient_user_id, answers)
+            )],
+            [InlineKeyboardButton(
+                text="📝 Показать мое имя",
+                callback_data=pack(user_id, ACTION_SEND_NAMED, recipient_user_id, answers)
+            )]
+        ])
+        await callback_query.message.edit_text("Как отправить оценку?", reply_markup=keyboard)
+    elif action in (ACTION_SEND_ANONYMOUS, ACTION_SEND_NAMED):
+        await deliver_rating(
+            callback_query,
+            anonymity="anonymous" if action == ACTION_SEND_ANONYMOUS else "named",
+            target_user_id=recipient_user_id,
+            ratings=ratings,
+            wants_relationship=wants_relationship,
+            knows_personally=knows_personally,
+            message_text=None,
+        )
+        await state.clear()
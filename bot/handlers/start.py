@@ -4,12 +4,28 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from bot.database.db import users_collection, messages_collection, ratings_collection
-from uuid import uuid4
+from bot.database.repositories import users_repo, messages_repo, ratings_repo
+from bot.database.aggregates import CRITERIA, CRITERIA_LABELS, summarize_aggregate
+from bot.database.pagination import InvalidCursor, parse_page_callback
+from bot.keyboards.inline import back_keyboard, pagination_keyboard, start_menu_keyboard
+from bot.database.unread import increment_unread, mark_messages_read
+from bot.services.leaderboard import leaderboards
+from bot.services.idempotency import idempotency
+from bot.services.digest import digests
+from bot.services.stats import rating_stats
 from datetime import datetime
 
 router = Router()
 
+MESSAGES_PAGE = "msgs"
+UNREAD_PAGE = "umsgs"
+MESSAGES_PER_PAGE = 10
+RATINGS_PAGE = "rates"
+RATINGS_PER_PAGE = 5
+
+RATING_ACCEPTED = "✅ Оценка принята и будет доставлена!"
+MESSAGE_ACCEPTED = "✅ Сообщение принято и будет доставлено!"
+
 class InteractionStates(StatesGroup):
     choosing_action = State()
     rating_appearance = State()
@@ -29,7 +45,7 @@ async def handle_referral(message: Message, state: FSMContext):
     link_id = message.text.replace("/start send_", "").strip()
     
     # Проверяем, существует ли пользователь с таким link_id
-    user = await users_collection.find_one({"link_id": link_id})
+    user = await users_repo.get_by_link(link_id)
     if user:
         # Сохраняем информацию о получателе в состоянии
         await state.update_data(recipient_user_id=user['user_id'], recipient_username=user['username'])
@@ -70,26 +86,33 @@ async def process_anonymous_message(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Сохраняем сообщение в базу данных
-    message_data = {
-        "recipient_user_id": recipient_user_id,
-        "sender_user_id": message.from_user.id,
-        "message_text": message.text,
-        "timestamp": datetime.utcnow(),
-        "is_read": False
-    }
-    
-    await messages_collection.insert_one(message_data)
+    async def submit():
+        # Сохраняем сообщение в базу данных
+        message_data = {
+            "recipient_user_id": recipient_user_id,
+            "sender_user_id": message.from_user.id,
+            "message_text": message.text,
+            "timestamp": datetime.utcnow(),
+            "is_read": False
+        }
+        
+        await messages_repo.add(message_data)
+        return MESSAGE_ACCEPTED
     
-    # Отправляем сообщение получателю
-    try:
-        await message.bot.send_message(
-            chat_id=recipient_user_id,
-            text=f"📨 Вам пришло анонимное сообщение:\n\n{message.text}"
+    async def notify():
+        await increment_unread(recipient_user_id)
+        
+        # Доставку выполняют воркеры очереди исходящих (или сводка, если получатель её включил)
+        await digests.notify_message(
+            recipient_user_id,
+            f"📨 Вам пришло анонимное сообщение:\n\n{message.text}",
+            message.text,
         )
-        await message.answer("✅ Сообщение успешно отправлено!")
-    except Exception as e:
-        await message.answer("❌ Не удалось доставить сообщение. Возможно, пользователь заблокировал бота.")
+    
+    # Повторно доставленный апдейт с тем же сообщением не сохраняется второй раз
+    text, duplicate = await idempotency.run(f"message:{message.chat.id}:{message.message_id}", submit, notify)
+    if not duplicate:
+        await message.answer(text)
     
     await state.clear()
 
@@ -331,16 +354,45 @@ async def choose_anonymity(callback_query: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("send_"))
 async def send_rating(callback_query: CallbackQuery, state: FSMContext):
     anonymity = callback_query.data.replace("send_", "")
-    user_id = callback_query.from_user.id
-    username = callback_query.from_user.username or f"id_{user_id}"
     
     data = await state.get_data()
-    target_user_id = data['recipient_user_id']
-    target_username = data['recipient_username']
-    ratings = data['ratings']
-    wants_relationship = data['wants_relationship']
-    knows_personally = data['knows_personally']
-    message_text = data.get('message')
+    if 'knows_personally' not in data:
+        # Состояние уже очищено: повторное нажатие после отправки или устаревшая кнопка
+        text = await idempotency.result(submission_key(callback_query))
+        await callback_query.answer(text or "❌ Кнопка устарела", show_alert=text is None)
+        return
+    
+    await deliver_rating(
+        callback_query,
+        anonymity=anonymity,
+        target_user_id=data['recipient_user_id'],
+        ratings=data['ratings'],
+        wants_relationship=data['wants_relationship'],
+        knows_personally=data['knows_personally'],
+        message_text=data.get('message'),
+    )
+    
+    await state.clear()
+
+def submission_key(callback_query: CallbackQuery):
+    # Кнопки отправки живут в одном сообщении мастера, поэтому оно и служит
+    # токеном отправки: все нажатия на них — одна и та же оценка
+    message = callback_query.message
+    if message is None:
+        return f"rating:callback:{callback_query.id}"
+    return f"rating:{message.chat.id}:{message.message_id}"
+
+async def deliver_rating(
+    callback_query: CallbackQuery,
+    anonymity,
+    target_user_id,
+    ratings,
+    wants_relationship,
+    knows_personally,
+    message_text,
+):
+    user_id = callback_query.from_user.id
+    username = callback_query.from_user.username or f"id_{user_id}"
     
     # Формируем сообщение с оценкой
     sender_name = "👤 Аноним" if anonymity == "anonymous" else f"👤 @{username}"
@@ -374,46 +426,41 @@ async def send_rating(callback_query: CallbackQuery, state: FSMContext):
         "timestamp": datetime.utcnow()
     }
     
-    await ratings_collection.insert_one(rating_record)
+    async def submit():
+        await ratings_repo.add(rating_record)
+        return RATING_ACCEPTED
     
-    # Отправляем оценку получателю
-    try:
-        await callback_query.bot.send_message(
-            chat_id=target_user_id,
-            text=rating_message
-        )
-        await callback_query.message.edit_text("✅ Оценка успешно отправлена!")
-    except Exception as e:
-        await callback_query.message.edit_text("❌ Не удалось отправить оценку. Возможно, пользователь заблокировал бота.")
+    async def publish():
+        # Оценка уже записана и ключ сохранён: сбой дальше не приведёт к повторной
+        # записи, а агрегат при необходимости восстановит manage.py rebuild-aggregates
+        aggregate = await ratings_repo.apply_to_aggregate(rating_record)
+        await leaderboards.apply_aggregate(aggregate)
+        rating_stats.invalidate(target_user_id)
+        
+        # Доставку выполняют воркеры очереди исходящих (или сводка, если получатель её включил)
+        await digests.notify_rating(target_user_id, rating_message, ratings, sender_name, message_text)
     
-    await state.clear()
+    text, duplicate = await idempotency.run(submission_key(callback_query), submit, publish)
+    if duplicate:
+        # Двойное нажатие: оценка уже записана (или ещё записывается)
+        await callback_query.answer(text or "⏳ Оценка уже отправляется")
+        return
+    await callback_query.message.edit_text(text)
 
 @router.message(F.text == "/start")
 async def start_cmd(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username or f"id_{user_id}"
     
-    existing_user = await users_collection.find_one({"user_id": user_id})
-    if not existing_user:
-        link_id = str(uuid4())
-        await users_collection.insert_one({
-            "user_id": user_id,
-            "username": username,
-            "link_id": link_id,
-            "ratings": [],
-            "created_at": datetime.utcnow()
-        })
-    else:
-        link_id = existing_user["link_id"]
+    user = await users_repo.get_or_create(user_id, username)
+    if user.get("blocked"):
+        # Пишет боту — значит, разблокировал: рассылки снова до него доходят
+        await users_repo.set_blocked(user_id, False)
     
     bot_username = (await message.bot.me()).username
-    link = f"https://t.me/{bot_username}?start=send_{link_id}"
+    link = f"https://t.me/{bot_username}?start=send_{user['link_id']}"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📬 Моя ссылка", url=link)],
-        [InlineKeyboardButton(text="📊 Мои сообщения", callback_data="my_messages")],
-        [InlineKeyboardButton(text="📈 Мои оценки", callback_data="my_ratings")]
-    ])
+    keyboard = start_menu_keyboard(link, user.get("unread_messages", 0), bool(user.get("digest")))
     
     await message.answer(
         "👋 Добро пожаловать в бота анонимных сообщений и оценок!\n\n"
@@ -426,54 +473,106 @@ async def start_cmd(message: Message):
         reply_markup=keyboard
     )
 
-@router.callback_query(F.data == "my_messages")
+@router.callback_query(
+    (F.data == "my_messages") | (F.data == "my_unread")
+    | F.data.startswith(f"{MESSAGES_PAGE}:") | F.data.startswith(f"{UNREAD_PAGE}:")
+)
 async def show_my_messages(callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
+    unread_only = callback_query.data == "my_unread" or callback_query.data.startswith(f"{UNREAD_PAGE}:")
+    prefix = UNREAD_PAGE if unread_only else MESSAGES_PAGE
     
-    messages_cursor = messages_collection.find(
-        {"recipient_user_id": user_id}
-    ).sort("timestamp", -1).limit(10)
+    try:
+        direction, cursor = parse_page_callback(callback_query.data, prefix)
+    except InvalidCursor:
+        await callback_query.answer("❌ Кнопка устарела")
+        return
+    
+    messages_list, has_older, has_newer = await messages_repo.page(
+        user_id, MESSAGES_PER_PAGE, direction, cursor, unread_only=unread_only
+    )
     
-    messages_list = await messages_cursor.to_list(length=10)
+    if unread_only:
+        filter_row = [InlineKeyboardButton(text="📋 Все сообщения", callback_data="my_messages")]
+    else:
+        filter_row = [InlineKeyboardButton(text="🆕 Только непрочитанные", callback_data="my_unread")]
     
     if not messages_list:
+        if unread_only:
+            text = "📭 Непрочитанных сообщений нет."
+        elif cursor is None:
+            text = "📭 У вас пока нет сообщений."
+        else:
+            text = "📭 Больше сообщений нет."
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            filter_row,
             [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
         ])
-        await callback_query.message.edit_text("📭 У вас пока нет сообщений.", reply_markup=keyboard)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
         return
     
-    text = "📨 Ваши последние сообщения:\n\n"
+    if unread_only:
+        text = "🆕 Непрочитанные сообщения:\n\n"
+    else:
+        text = "📨 Ваши последние сообщения:\n\n" if cursor is None else "📨 Ваши сообщения:\n\n"
     for i, msg in enumerate(messages_list, 1):
         timestamp = msg['timestamp'].strftime("%d.%m.%Y %H:%M")
         preview = msg['message_text'][:50] + "..." if len(msg['message_text']) > 50 else msg['message_text']
-        text += f"{i}. {timestamp}\n{preview}\n\n"
+        marker = "🆕 " if msg.get('is_read') is False else ""
+        text += f"{i}. {marker}{timestamp}\n{preview}\n\n"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
-    ])
+    keyboard = pagination_keyboard(prefix, messages_list, has_older, has_newer, extra_rows=[filter_row])
     
     await callback_query.message.edit_text(text, reply_markup=keyboard)
+    
+    # Показанная страница считается прочитанной
+    await mark_messages_read(
+        user_id, [msg['_id'] for msg in messages_list if msg.get('is_read') is False]
+    )
 
-@router.callback_query(F.data == "my_ratings")
+@router.callback_query((F.data == "my_ratings") | F.data.startswith(f"{RATINGS_PAGE}:"))
 async def show_my_ratings(callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     
-    # Получаем последние оценки пользователя
-    ratings_cursor = ratings_collection.find(
-        {"to_user_id": user_id}
-    ).sort("timestamp", -1).limit(5)
+    try:
+        direction, cursor = parse_page_callback(callback_query.data, RATINGS_PAGE)
+    except InvalidCursor:
+        await callback_query.answer("❌ Кнопка устарела")
+        return
     
-    ratings_list = await ratings_cursor.to_list(length=5)
+    text = ""
+    if cursor is None:
+        # Сводка читается одним запросом по индексу из агрегатов
+        summary = summarize_aggregate(await ratings_repo.get_aggregate(user_id))
+        
+        if not summary:
+            await callback_query.message.edit_text("📊 У вас пока нет оценок.", reply_markup=back_keyboard())
+            return
+        
+        count = summary['count']
+        text = f"📊 Всего оценок: {count}\n\n"
+        for criterion in CRITERIA:
+            text += (
+                f"{CRITERIA_LABELS[criterion]}: {summary['averages'][criterion]:.1f}/10 "
+                f"(±{summary['deviations'][criterion]:.1f})\n"
+            )
+        text += (
+            f"👩‍❤️‍👨 Хотят встречаться: {summary['wants_relationship_yes']} "
+            f"({summary['wants_relationship_yes'] * 100 // count}%)\n"
+            f"👀 Знакомы лично: {summary['knows_personally_yes']} "
+            f"({summary['knows_personally_yes'] * 100 // count}%)\n\n"
+        )
     
-    if not ratings_list:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
-        ])
-        await callback_query.message.edit_text("📊 У вас пока нет оценок.", reply_markup=keyboard)
+    # Получаем страницу оценок пользователя
+    ratings_list, has_older, has_newer = await ratings_repo.page(
+        user_id, RATINGS_PER_PAGE, direction, cursor
+    )
+    
+    if not ratings_list and cursor is not None:
+        await callback_query.message.edit_text("📊 Больше оценок нет.", reply_markup=back_keyboard())
         return
     
-    text = "📊 Ваши последние оценки:\n\n"
+    text += "📊 Ваши последние оценки:\n\n" if cursor is None else "📊 Ваши оценки:\n\n"
     
     for i, rating in enumerate(ratings_list, 1):
         sender_name = "Аноним" if rating['anonymous'] else f"@{rating.get('from_username', 'Unknown')}"
@@ -484,16 +583,14 @@ async def show_my_ratings(callback_query: CallbackQuery):
         text += f"   👏 Характер: {rating['ratings']['character']}/10\n"
         text += f"   🧠 Ум: {rating['ratings']['intelligence']}/10\n\n"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
-    ])
+    keyboard = pagination_keyboard(RATINGS_PAGE, ratings_list, has_older, has_newer)
     
     await callback_query.message.edit_text(text, reply_markup=keyboard)
 
 @router.callback_query(F.data == "back_to_start")
 async def back_to_start(callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
-    user = await users_collection.find_one({"user_id": user_id})
+    user = await users_repo.get(user_id)
     
     if not user:
         await callback_query.answer("Ошибка: пользователь не найден")
@@ -502,11 +599,7 @@ async def back_to_start(callback_query: CallbackQuery):
     bot_username = (await callback_query.bot.me()).username
     link = f"https://t.me/{bot_username}?start=send_{user['link_id']}"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📬 Моя ссылка", url=link)],
-        [InlineKeyboardButton(text="📊 Мои сообщения", callback_data="my_messages")],
-        [InlineKeyboardButton(text="📈 Мои оценки", callback_data="my_ratings")]
-    ])
+    keyboard = start_menu_keyboard(link, user.get('unread_messages', 0), user.get('digest', False))
     
     await callback_query.message.edit_text(
         "👋 Добро пожаловать в бота анонимных сообщений и оценок!\n\n"
@@ -517,4 +610,15 @@ async def back_to_start(callback_query: CallbackQuery):
         "• Отправить анонимное сообщение\n"
         "• Выбрать, показывать ли свое имя или остаться анонимом",
         reply_markup=keyboard
-    )
\ No newline at end of file
+    )
+
+@router.callback_query(F.data == "toggle_digest")
+async def toggle_digest(callback_query: CallbackQuery):
+    user_id = callback_query.from_user.id
+    enabled = not await digests.enabled(user_id)
+    await digests.set_enabled(user_id, enabled)
+    
+    await callback_query.answer(
+        "🗞 Оценки и сообщения будут приходить сводкой" if enabled else "🔔 Уведомления снова приходят сразу"
+    )
+    await back_to_start(callback_query)
\ No newline at end of file
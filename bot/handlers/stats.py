@@ -0,0 +1,53 @@
+# bot/handlers/stats.py
+
+from aiogram import Router, F
+from aiogram.types import CallbackQuery
+
+from bot.database.aggregates import CRITERIA, CRITERIA_LABELS
+from bot.keyboards.inline import back_keyboard
+from bot.services.stats import ROLLING_WEEKS, rating_stats
+
+router = Router()
+
+BARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values):
+    # Пустые корзины — нижний штрих, остальные пропорционально максимуму
+    top = max(values) or 1
+    return "".join(BARS[0] if not value else BARS[1 + round(value / top * (len(BARS) - 2))] for value in values)
+
+
+def format_report(report, global_averages):
+    text = f"📉 Статистика по {report['count']} оценкам\n\n"
+    for criterion in CRITERIA:
+        mean = report["means"][criterion]
+        percentiles = report["percentiles"][criterion]
+        text += f"{CRITERIA_LABELS[criterion]}: {mean:.1f}/10"
+        if criterion in global_averages:
+            difference = mean - global_averages[criterion]
+            text += f" (по боту {global_averages[criterion]:.1f}, {'▲' if difference >= 0 else '▼'}{abs(difference):.1f})"
+        text += (
+            f"\n   1 {sparkline(report['histograms'][criterion])} 10\n"
+            f"   медиана {percentiles[50]:.0f}, половина оценок {percentiles[25]:.0f}–{percentiles[75]:.0f}, "
+            f"90% не выше {percentiles[90]:.0f}\n\n"
+        )
+
+    text += f"📈 Средняя оценка за {ROLLING_WEEKS} недели:\n"
+    for week_start, rolling, amount in report["trend"]:
+        value = "—" if rolling is None else f"{rolling:.1f}"
+        text += f"   с {week_start:%d.%m}: {value} (+{amount})\n"
+    return text
+
+
+@router.callback_query(F.data == "my_stats")
+async def show_my_stats(callback_query: CallbackQuery):
+    user_id = callback_query.from_user.id
+
+    report = await rating_stats.report(user_id)
+    if report is None:
+        await callback_query.message.edit_text("📉 У вас пока нет оценок.", reply_markup=back_keyboard())
+        return
+
+    text = format_report(report, await rating_stats.global_averages())
+    await callback_query.message.edit_text(text, reply_markup=back_keyboard())
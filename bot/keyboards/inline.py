@@ -0,0 +1,43 @@
+# bot/keyboards/inline.py
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.database.pagination import OLDER, NEWER, page_callback
+
+
+def back_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")]
+    ])
+
+
+def start_menu_keyboard(link, unread_messages=0, digest=False):
+    messages_text = "📊 Мои сообщения"
+    if unread_messages > 0:
+        messages_text += f" (🆕 {unread_messages})"
+    digest_text = "🗞 Уведомления: сводкой" if digest else "🔔 Уведомления: сразу"
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📬 Моя ссылка", url=link)],
+        [InlineKeyboardButton(text=messages_text, callback_data="my_messages")],
+        [InlineKeyboardButton(text="📈 Мои оценки", callback_data="my_ratings")],
+        [InlineKeyboardButton(text="📉 Статистика", callback_data="my_stats")],
+        [InlineKeyboardButton(text="🏆 Топ пользователей", callback_data="top")],
+        [InlineKeyboardButton(text=digest_text, callback_data="toggle_digest")]
+    ])
+
+
+def pagination_keyboard(prefix, documents, has_older, has_newer, extra_rows=None):
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=page_callback(prefix, NEWER, documents[0])
+        ))
+    if has_older:
+        navigation.append(InlineKeyboardButton(
+            text="Старее ➡️", callback_data=page_callback(prefix, OLDER, documents[-1])
+        ))
+
+    rows = [navigation] if navigation else []
+    rows.extend(extra_rows or [])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_start")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -2,8 +2,101 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
-from bot.config import BOT_TOKEN
-from bot.handlers import start
+from bot.config import BOT_TOKEN, INDEX_SELF_CHECK, RATING_WIZARD, FSM_STORAGE, METRICS_PORT, WORKER_PROCESSES, UPDATES_MODE, STARTUP_BACKLOG
+from bot.database.fsm_storage import MongoStorage
+from bot.database.bulk_writer import close_writers
+from bot.database.db import close_client
+from bot.database.indexes import ensure_indexes, verify_query_plans
+from bot.handlers import start, rating_wizard, leaderboard, export, broadcast, stats
+from bot.services.outbox import OutboxWorkerPool
+from bot.services.leaderboard import leaderboards
+from bot.services.digest import digests
+from bot.services.broadcast import broadcasts
+from bot.services.retention import retention
+from bot.middlewares.fsm_flush import FSMFlushMiddleware
+from bot.middlewares.antispam import AntiSpamMiddleware
+from bot.middlewares.processed import ProcessedUpdateMiddleware
+from bot.services.backlog import drain_backlog
+from bot.monitoring.gauges import register_component_gauges
+from bot.monitoring.middlewares import ApiMetricsMiddleware, HandlerMetricsMiddleware
+from bot.monitoring.server import MetricsServer
+from bot.cluster.receiver import Receiver
+from bot.webhook import BoundedRequestHandler, ReceiverRequestHandler, create_app, serve, set_webhook
+
+def create_storage():
+    if FSM_STORAGE == "mongo":
+        return MongoStorage()
+    return MemoryStorage()
+
+def create_dispatcher(storage=None, antispam=None) -> Dispatcher:
+    # Добавляем хранилище для FSM
+    storage = storage or create_storage()
+    dp = Dispatcher(storage=storage)
+    if isinstance(storage, MongoStorage):
+        dp.update.outer_middleware(FSMFlushMiddleware())
+    # Отметки об обработанных апдейтах для тёплого перезапуска
+    dp.update.outer_middleware(ProcessedUpdateMiddleware())
+    
+    # Лимиты проверяются до фильтров, так что лишние апдейты не доходят до базы
+    antispam = antispam or AntiSpamMiddleware()
+    dp.message.outer_middleware(antispam)
+    dp.callback_query.outer_middleware(antispam)
+    dp["antispam"] = antispam
+    
+    # Время и ошибки каждого обработчика
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    
+    # Мастер без FSM перехватывает start_rating раньше шагов из start.py
+    if RATING_WIZARD == "stateless":
+        dp.include_router(rating_wizard.router)
+    # Команда выгрузки срабатывает в любом состоянии FSM
+    dp.include_router(export.router)
+    dp.include_router(broadcast.router)
+    dp.include_router(start.router)
+    dp.include_router(leaderboard.router)
+    dp.include_router(stats.router)
+    
+    return dp
+
+def register_services(dp: Dispatcher, bot: Bot, antispam=None):
+    # Фоновые задачи, которые должны работать в одном экземпляре на весь бот
+    
+    # Воркеры очереди исходящих живут столько же, сколько диспетчер
+    outbox = OutboxWorkerPool(bot)
+    dp.startup.register(outbox.start)
+    dp.shutdown.register(outbox.stop)
+    # Локальный эндпоинт /metrics
+    if METRICS_PORT:
+        register_component_gauges(outbox, antispam)
+        metrics_server = MetricsServer()
+        dp.startup.register(metrics_server.start)
+        dp.shutdown.register(metrics_server.stop)
+    # Периодический полный пересчёт таблиц лидеров
+    dp.startup.register(leaderboards.start)
+    dp.shutdown.register(leaderboards.stop)
+    # Рассылка накопленных сводок
+    dp.startup.register(digests.start)
+    dp.shutdown.register(digests.stop)
+    # Рассылки администраторов, в том числе продолжение прерванных
+    dp.startup.register(broadcasts.start)
+    dp.shutdown.register(broadcasts.stop)
+    # Перенос старых сообщений и оценок в архив (если задан RETENTION_DAYS)
+    dp.startup.register(retention.start)
+    dp.shutdown.register(retention.stop)
+
+def register_teardown(dp: Dispatcher):
+    # Буферы пакетной записи дописываются при остановке
+    dp.shutdown.register(close_writers)
+    # Клиент MongoDB закрывается последним, после сброса FSM и буферов
+    dp.shutdown.register(dp.fsm.storage.close)
+    dp.shutdown.register(close_client)
+
+async def drain_on_startup(bot: Bot, dispatcher: Dispatcher):
+    # Последний обработчик startup: очередь исходящих уже работает,
+    # polling начнётся, когда накопившиеся апдейты будут разобраны
+    report = await drain_backlog(bot, dispatcher)
+    print(f"📥 Накопившиеся апдейты: {report}")
 
 async def main():
     bot = Bot(
@@ -11,12 +104,48 @@ async def main():
         default=DefaultBotProperties(parse_mode="HTML")
     )
     
-    # Добавляем хранилище для FSM
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    bot.session.middleware(ApiMetricsMiddleware())
     
-    dp.include_router(start.router)
+    # Индексы создаются до приёма обновлений
+    await ensure_indexes()
+    if INDEX_SELF_CHECK:
+        await verify_query_plans()
+    
+    if WORKER_PROCESSES:
+        # Апдейты обрабатывают процессы-воркеры, здесь — только приём и фоновые задачи
+        dp = create_dispatcher(storage=MemoryStorage())
+        register_services(dp, bot)
+        register_teardown(dp)
+        receiver = Receiver(bot, dp)
+        if UPDATES_MODE == "webhook":
+            await set_webhook(bot, dp)
+            server = asyncio.create_task(serve(create_app(ReceiverRequestHandler(receiver, bot))))
+            print(f"🚀 Бот запущен! Вебхук, воркеров: {WORKER_PROCESSES}")
+            try:
+                await receiver.run(poll=False)
+            finally:
+                server.cancel()
+                await asyncio.gather(server, return_exceptions=True)
+        else:
+            await bot.delete_webhook(drop_pending_updates=STARTUP_BACKLOG == "drop")
+            print(f"🚀 Бот запущен! Воркеров: {WORKER_PROCESSES}")
+            await receiver.run()
+        return
+    
+    dp = create_dispatcher()
+    register_services(dp, bot, dp["antispam"])
+    register_teardown(dp)
+    
+    if UPDATES_MODE == "webhook":
+        # Вебхук не снимается при остановке: пока бот перезапускается,
+        # Telegram копит апдейты у себя
+        await set_webhook(bot, dp)
+        print("🚀 Бот запущен! Вебхук")
+        await serve(create_app(BoundedRequestHandler(dp, bot), dp, bot))
+        return
     
-    await bot.delete_webhook(drop_pending_updates=True)
+    await bot.delete_webhook(drop_pending_updates=STARTUP_BACKLOG == "drop")
+    if STARTUP_BACKLOG == "drain":
+        dp.startup.register(drain_on_startup)
     print("🚀 Бот запущен!")
-    await dp.start_polling(bot)
\ No newline at end of file
+    await dp.start_polling(bot)
@@ -0,0 +1,106 @@
+# bot/middlewares/antispam.py
+
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from bot.config import (
+    ANTISPAM_SENDER_RATE,
+    ANTISPAM_SENDER_BURST,
+    ANTISPAM_PAIR_RATE,
+    ANTISPAM_PAIR_BURST,
+    ANTISPAM_MAX_TRACKED,
+)
+from bot.handlers.start import InteractionStates
+from bot.handlers.rating_wizard import PREFIX as WIZARD_PREFIX, ACTION_SEND_ANONYMOUS, ACTION_SEND_NAMED
+from bot.utils.encoding import from_base36
+from bot.utils.ratelimit import BucketTable
+
+# Действия, которые пишут в базу и отправляют уведомление получателю
+SUBMISSION_STATES = {InteractionStates.waiting_message.state}
+SUBMISSION_CALLBACKS = {"send_anonymous", "send_named"}
+WIZARD_SUBMISSIONS = (WIZARD_PREFIX + ACTION_SEND_ANONYMOUS, WIZARD_PREFIX + ACTION_SEND_NAMED)
+RATE_LIMITED = "⏳ Слишком часто, попробуйте чуть позже"
+
+
+class AntiSpamMiddleware(BaseMiddleware):
+    # Отбрасывает апдейты сверх лимита до фильтров и обработчиков.
+    # Подключается как outer-middleware к message и callback_query.
+
+    def __init__(
+        self,
+        sender_rate=ANTISPAM_SENDER_RATE,
+        sender_burst=ANTISPAM_SENDER_BURST,
+        pair_rate=ANTISPAM_PAIR_RATE,
+        pair_burst=ANTISPAM_PAIR_BURST,
+        max_tracked=ANTISPAM_MAX_TRACKED,
+    ):
+        self.senders = BucketTable(sender_rate, sender_burst, max_tracked)
+        self.pairs = BucketTable(pair_rate, pair_burst, max_tracked)
+        # Не больше одного предупреждения на пару за время пополнения одного токена
+        self.notices = BucketTable(pair_rate, 1, max_tracked)
+        self.rejected = Counter()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        if not self.senders.try_acquire(user.id):
+            return await self._reject(event, "sender")
+
+        recipient_user_id = await self._submission_recipient(event, data)
+        pair = (user.id, recipient_user_id)
+        if recipient_user_id is not None and not self.pairs.try_acquire(pair):
+            return await self._reject(event, "pair", pair)
+
+        return await handler(event, data)
+
+    @staticmethod
+    async def _submission_recipient(event, data):
+        # Получатель отправки, если апдейт — отправка сообщения или оценки
+        if isinstance(event, Message):
+            if data.get("raw_state") not in SUBMISSION_STATES:
+                return None
+        elif isinstance(event, CallbackQuery) and event.data:
+            if event.data.startswith(WIZARD_SUBMISSIONS):
+                # Подпись проверит сам мастер, здесь достаточно ключа для лимита
+                try:
+                    return from_base36(event.data.split(":")[1])
+                except (IndexError, ValueError):
+                    return None
+            if event.data not in SUBMISSION_CALLBACKS:
+                return None
+        else:
+            return None
+
+        state = data.get("state")
+        if state is None:
+            return None
+        return (await state.get_data()).get("recipient_user_id")
+
+    async def _reject(self, event, reason, pair=None):
+        self.rejected[reason] += 1
+        # На нажатие кнопки отвечаем всегда, чтобы у пользователя не висели
+        # «часики». Флуд сообщениями отбрасывается молча, но отправленный
+        # получателю текст не должен пропасть незаметно — о нём предупреждаем
+        if isinstance(event, CallbackQuery):
+            await event.answer(RATE_LIMITED)
+        elif pair is not None and self.notices.try_acquire(pair):
+            await event.answer(RATE_LIMITED)
+        return None
+
+    def stats(self):
+        return {
+            "rejected_sender": self.rejected["sender"],
+            "rejected_pair": self.rejected["pair"],
+            "tracked_senders": len(self.senders),
+            "tracked_pairs": len(self.pairs),
+        }
@@ -0,0 +1,25 @@
+# bot/middlewares/fsm_flush.py
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.database.fsm_storage import MongoStorage
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    # Сбрасывает накопленные за обработку апдейта изменения FSM одной записью
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            state = data.get("state")
+            if state is not None and isinstance(state.storage, MongoStorage):
+                await state.storage.flush(state.key)
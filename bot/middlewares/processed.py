@@ -0,0 +1,40 @@
+# bot/middlewares/processed.py
+
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.config import IDEMPOTENCY_TTL, IDEMPOTENCY_CACHE_SIZE
+from bot.database.bulk_writer import processed_updates_writer
+from bot.utils.cache import TTLCache
+
+
+class ProcessedUpdateMiddleware(BaseMiddleware):
+    # Отмечает апдейт обработанным, чтобы после перезапуска не применить его
+    # второй раз (см. bot/services/backlog.py). Отметки пишутся пачками, в фоне.
+    # Апдейт, повторно доставленный в тот же процесс (вебхук не дождался
+    # ответа), отбрасывается сразу — даже если первый ещё обрабатывается.
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_size=IDEMPOTENCY_CACHE_SIZE):
+        self._seen = TTLCache(ttl, max_size)
+        self.duplicates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        if event.update_id in self._seen:
+            self.duplicates += 1
+            return None
+
+        self._seen.set(event.update_id, True)
+        try:
+            return await handler(event, data)
+        finally:
+            processed_updates_writer.add({"_id": event.update_id, "processed_at": datetime.utcnow()})
@@ -0,0 +1,54 @@
+# bot/monitoring/gauges.py
+#
+# Счётчики, которые компоненты уже ведут сами (очередь исходящих, пакетная
+# запись, антиспам), отдаются как есть в момент запроса /metrics. Растущие
+# с запуска итоги — счётчики с суффиксом _total, текущие размеры — gauge.
+
+from bot.database.bulk_writer import messages_writer, ratings_writer
+from bot.monitoring.metrics import registry
+
+WRITERS = {"ratings": ratings_writer, "messages": messages_writer}
+
+
+def register_component_gauges(outbox, antispam=None):
+    registry.collected_counter(
+        "outbox_deliveries_total",
+        "Доставки очереди исходящих с момента запуска",
+        lambda: {
+            ("sent",): outbox.stats.sent,
+            ("failed",): outbox.stats.failed,
+            ("retried",): outbox.stats.retried,
+        },
+        ("result",),
+    )
+    registry.gauge(
+        "outbox_queue_depth", "Ожидающие доставки (на момент последнего отчёта)",
+        lambda: outbox.stats.queue_depth,
+    )
+    registry.collected_counter(
+        "bulk_writer_documents_total", "Документы, записанные пакетной записью",
+        lambda: {(name,): writer.documents for name, writer in WRITERS.items()},
+        ("collection",),
+    )
+    registry.gauge(
+        "bulk_writer_buffered", "Документы в буфере пакетной записи",
+        lambda: {(name,): writer.buffered for name, writer in WRITERS.items()},
+        ("collection",),
+    )
+    registry.collected_counter(
+        "bulk_writer_errors_total", "Ошибки пакетной записи",
+        lambda: {(name,): writer.errors for name, writer in WRITERS.items()},
+        ("collection",),
+    )
+    if antispam is None:
+        return
+    registry.collected_counter(
+        "antispam_rejected_total", "Апдейты, отброшенные антиспамом",
+        lambda: {(reason,): count for reason, count in antispam.rejected.items()},
+        ("reason",),
+    )
+    registry.gauge(
+        "antispam_tracked", "Отслеживаемые ведра антиспама",
+        lambda: {("sender",): len(antispam.senders), ("pair",): len(antispam.pairs)},
+        ("kind",),
+    )
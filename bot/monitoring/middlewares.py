@@ -0,0 +1,64 @@
+# bot/monitoring/middlewares.py
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+
+from bot.monitoring.metrics import registry
+
+handler_seconds = registry.histogram(
+    "bot_handler_seconds", "Длительность обработчиков апдейтов", ("handler",)
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler", "error")
+)
+api_request_seconds = registry.histogram(
+    "telegram_api_seconds", "Длительность вызовов Bot API", ("method",)
+)
+api_request_errors = registry.counter(
+    "telegram_api_errors_total", "Ошибки вызовов Bot API", ("method", "error")
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Inner-middleware: к этому моменту фильтры уже выбрали обработчик
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as error:
+            handler_errors.inc(name, type(error).__name__)
+            raise
+        finally:
+            handler_seconds.observe(perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    # Подключается к сессии бота: bot.session.middleware(ApiMetricsMiddleware())
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        name = type(method).__name__
+        started = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as error:
+            api_request_errors.inc(name, type(error).__name__)
+            raise
+        finally:
+            api_request_seconds.observe(perf_counter() - started, name)
@@ -0,0 +1,43 @@
+# bot/monitoring/mongo.py
+
+from pymongo import monitoring
+
+from bot.monitoring.metrics import registry
+
+mongo_command_seconds = registry.histogram(
+    "mongo_command_seconds", "Длительность команд MongoDB", ("collection", "command")
+)
+mongo_command_errors = registry.counter(
+    "mongo_command_errors_total", "Ошибки команд MongoDB", ("collection", "command")
+)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    # Коллекция известна только в started-событии, поэтому запоминаем её
+    # до ответа по request_id
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        else:
+            collection = command.get(event.command_name)
+        if isinstance(collection, str):
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            mongo_command_seconds.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            mongo_command_seconds.observe(event.duration_micros / 1e6, collection, event.command_name)
+            mongo_command_errors.inc(collection, event.command_name)
+
+
+command_listener = CommandMetricsListener()
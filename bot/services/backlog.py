@@ -0,0 +1,122 @@
+# bot/services/backlog.py
+#
+# Тёплый перезапуск: апдейты, которые Telegram накопил, пока бот был
+# остановлен, обрабатываются до начала обычного polling. Уже обработанные
+# (их update_id есть в processed_updates) пропускаются. Апдейты одного
+# пользователя идут по порядку, а пользователи с короткими действиями
+# (/start и другие команды) обслуживаются раньше длинных сценариев оценки.
+
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from bot.config import BACKLOG_CONCURRENCY, BACKLOG_WINDOW
+from bot.database.db import processed_updates_collection
+
+logger = logging.getLogger(__name__)
+
+# Больше getUpdates не отдаёт за один вызов
+GET_UPDATES_LIMIT = 100
+
+
+class BacklogReport:
+    def __init__(self):
+        self.fetched = 0
+        self.handled = 0
+        self.skipped = 0
+        self.failed = 0
+        self.duration = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.handled} апдейтов обработано, {self.skipped} уже были обработаны, "
+            f"{self.failed} с ошибкой за {self.duration:.1f} с"
+        )
+
+
+async def skip_processed(updates):
+    ids = [update.update_id for update in updates]
+    cursor = processed_updates_collection.find({"_id": {"$in": ids}}, {"_id": 1})
+    processed = {document["_id"] async for document in cursor}
+    return [update for update in updates if update.update_id not in processed]
+
+
+def _owner(update):
+    event = update.event
+    for field in ("from_user", "user", "chat"):
+        owner = getattr(event, field, None)
+        if owner is not None:
+            return owner.id
+    return update.update_id
+
+
+def _is_short(update):
+    event = update.event
+    return isinstance(event, Message) and bool(event.text) and event.text.startswith("/")
+
+
+def build_lanes(updates):
+    # Очередь апдейтов на пользователя в исходном порядке; раньше идут очереди,
+    # начинающиеся с команды, а среди равных — более короткие
+    lanes = OrderedDict()
+    for update in updates:
+        lanes.setdefault(_owner(update), []).append(update)
+    return sorted(lanes.values(), key=lambda lane: (not _is_short(lane[0]), len(lane)))
+
+
+async def _fetch_window(bot: Bot, offset, allowed_updates, window):
+    # getUpdates подтверждает всё, что меньше offset, поэтому апдейты окна
+    # считаются полученными сразу; окно обрабатывается до следующего запроса
+    updates = []
+    while len(updates) < window:
+        batch = await bot.get_updates(
+            offset=offset,
+            limit=min(GET_UPDATES_LIMIT, window - len(updates)),
+            timeout=0,
+            allowed_updates=allowed_updates,
+        )
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    return updates, offset
+
+
+async def drain_backlog(bot: Bot, dp: Dispatcher, concurrency=BACKLOG_CONCURRENCY, window=BACKLOG_WINDOW):
+    report = BacklogReport()
+    started = monotonic()
+    allowed_updates = dp.resolve_used_update_types()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_lane(lane):
+        # Слоты семафора выдаются по порядку ожидания, то есть по приоритету очередей
+        async with slots:
+            for update in lane:
+                try:
+                    await dp.feed_update(bot, update)
+                    report.handled += 1
+                except Exception:
+                    report.failed += 1
+                    logger.exception("Ошибка обработки накопившегося апдейта %s", update.update_id)
+
+    offset = None
+    while True:
+        updates, offset = await _fetch_window(bot, offset, allowed_updates, window)
+        if not updates:
+            break
+        report.fetched += len(updates)
+        fresh = await skip_processed(updates)
+        report.skipped += len(updates) - len(fresh)
+        await asyncio.gather(*(run_lane(lane) for lane in build_lanes(fresh)))
+
+    if offset is not None:
+        # Подтверждаем последнее окно, чтобы polling не получил его снова
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+
+    report.duration = monotonic() - started
+    logger.info("Накопившиеся апдейты: %s", report)
+    return report
@@ -0,0 +1,162 @@
+# bot/services/broadcast.py
+#
+# Рассылка администратора всем пользователям. Получатели читаются пачками
+# по возрастанию user_id, каждая пачка ставится в очередь исходящих одним
+# insert_many, после чего в документе рассылки сохраняется последний
+# обработанный user_id. После перезапуска рассылка продолжается с него;
+# _id доставки — «рассылка:пользователь», поэтому повтор пачки не
+# отправит сообщение второй раз. Скорость отправки ограничивает очередь
+# исходящих (BROADCAST_RATE для приоритета PRIORITY_BULK), а рассылка
+# не ставит в очередь больше BROADCAST_MAX_PENDING доставок сразу.
+
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from bot.config import BROADCAST_BATCH_SIZE, BROADCAST_MAX_PENDING, BROADCAST_POLL_INTERVAL
+from bot.database.db import broadcasts_collection, outbox_collection, users_collection
+from bot.services.outbox import FAILED, PENDING, PRIORITY_BULK, SENT, build_delivery, enqueue_many
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+
+BACKPRESSURE_DELAY = 1.0
+
+
+class Broadcasts:
+    def __init__(
+        self,
+        batch_size=BROADCAST_BATCH_SIZE,
+        max_pending=BROADCAST_MAX_PENDING,
+        poll_interval=BROADCAST_POLL_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def create(self, text, created_by):
+        broadcast = {
+            "text": text,
+            "created_by": created_by,
+            "created_at": datetime.utcnow(),
+            "status": RUNNING,
+            "checkpoint": None,
+            "enqueued": 0,
+        }
+        await broadcasts_collection.insert_one(broadcast)
+        # В многопроцессном режиме команда выполняется в воркере, а рассылку
+        # ведёт приёмник — он найдёт её при следующем опросе
+        self._wakeup.set()
+        return broadcast
+
+    async def latest(self):
+        return await broadcasts_collection.find_one({}, sort=[("created_at", DESCENDING)])
+
+    async def cancel(self):
+        broadcast = await broadcasts_collection.find_one_and_update(
+            {"status": RUNNING},
+            {"$set": {"status": CANCELLED, "finished_at": datetime.utcnow()}},
+            sort=[("created_at", DESCENDING)],
+        )
+        if broadcast is None:
+            return None
+        # Ещё не отправленные сообщения рассылки снимаются с очереди
+        result = await outbox_collection.delete_many({"broadcast_id": broadcast["_id"], "status": PENDING})
+        logger.info("Рассылка %s отменена, снято с очереди: %s", broadcast["_id"], result.deleted_count)
+        return broadcast
+
+    async def progress(self, broadcast):
+        sent = await outbox_collection.count_documents({"broadcast_id": broadcast["_id"], "status": SENT})
+        failed = await outbox_collection.count_documents({"broadcast_id": broadcast["_id"], "status": FAILED})
+        return sent, failed
+
+    async def _wait_for_room(self):
+        # Очередь исходящих не успевает — ждём, а не наращиваем её
+        while await outbox_collection.count_documents(
+            {"status": PENDING, "priority": PRIORITY_BULK}
+        ) >= self.max_pending:
+            await asyncio.sleep(BACKPRESSURE_DELAY)
+
+    async def _next_batch(self, checkpoint):
+        query = {"blocked": {"$ne": True}}
+        if checkpoint is not None:
+            query["user_id"] = {"$gt": checkpoint}
+        cursor = (
+            users_collection.find(query, {"_id": 0, "user_id": 1})
+            .sort("user_id", ASCENDING)
+            .limit(self.batch_size)
+            .batch_size(self.batch_size)
+        )
+        return [user["user_id"] async for user in cursor]
+
+    async def run(self, broadcast):
+        broadcast_id = broadcast["_id"]
+        checkpoint = broadcast.get("checkpoint")
+        logger.info("Рассылка %s: старт с user_id > %s", broadcast_id, checkpoint)
+        while True:
+            await self._wait_for_room()
+            user_ids = await self._next_batch(checkpoint)
+            if not user_ids:
+                break
+
+            deliveries = []
+            for user_id in user_ids:
+                delivery = build_delivery(user_id, broadcast["text"], PRIORITY_BULK)
+                delivery["_id"] = f"{broadcast_id}:{user_id}"
+                delivery["broadcast_id"] = broadcast_id
+                deliveries.append(delivery)
+            inserted = await enqueue_many(deliveries)
+
+            checkpoint = user_ids[-1]
+            # Отменённая за это время рассылка дальше не идёт
+            if await broadcasts_collection.find_one_and_update(
+                {"_id": broadcast_id, "status": RUNNING},
+                {"$set": {"checkpoint": checkpoint}, "$inc": {"enqueued": inserted}},
+            ) is None:
+                # Пачка могла попасть в очередь уже после того, как отмена её очистила
+                await outbox_collection.delete_many({"broadcast_id": broadcast_id, "status": PENDING})
+                logger.info("Рассылка %s остановлена на user_id %s", broadcast_id, checkpoint)
+                return
+
+        await broadcasts_collection.update_one(
+            {"_id": broadcast_id, "status": RUNNING},
+            {"$set": {"status": DONE, "finished_at": datetime.utcnow()}},
+        )
+        logger.info("Рассылка %s поставлена в очередь целиком", broadcast_id)
+
+    async def _run_pending(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                # Незавершённые рассылки, в том числе прерванные перезапуском, — по очереди
+                while (broadcast := await broadcasts_collection.find_one(
+                    {"status": RUNNING}, sort=[("created_at", ASCENDING)]
+                )) is not None:
+                    await self.run(broadcast)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка рассылки")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run_pending())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+broadcasts = Broadcasts()
@@ -0,0 +1,163 @@
+# bot/services/digest.py
+#
+# Сводки вместо уведомления на каждую оценку и сообщение. Для получателя,
+# включившего сводки, новые события копятся в одном документе коллекции
+# digests ($inc счётчиков и сумм, последние события — $push с $slice).
+# Момент отправки у каждого получателя свой: смещение внутри окна задаётся
+# хэшем его id, поэтому сводки расходятся по всему окну, а не уходят разом.
+#
+# Документ сводки заводится на получателя и слот («получатель:слот»), так что
+# события после наступления слота копятся уже в следующем документе. Отправка
+# ставит сводку в очередь исходящих под _id «digest:получатель:слот» и только
+# потом удаляет документ: после падения между шагами повтор не задвоит сводку.
+
+import asyncio
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from bot.config import DIGEST_WINDOW, DIGEST_LATEST, DIGEST_POLL_INTERVAL, DIGEST_PREFERENCE_TTL
+from bot.database.aggregates import CRITERIA, CRITERIA_LABELS
+from bot.database.db import digests_collection, users_collection
+from bot.services.outbox import PRIORITY_LOW, build_delivery, enqueue_message, enqueue_many
+from bot.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+PREVIEW_LENGTH = 60
+# Событие, выбравшее слот перед самым его наступлением, может записаться чуть позже
+LATE_WRITES = timedelta(seconds=30)
+
+
+def next_slot(user_id, now, window=DIGEST_WINDOW):
+    # Ближайший после now момент вида offset + k * window
+    offset = zlib.crc32(str(user_id).encode()) % window
+    elapsed = (now - EPOCH).total_seconds() - offset
+    return EPOCH + timedelta(seconds=offset + (elapsed // window + 1) * window)
+
+
+def _preview(text):
+    if len(text) <= PREVIEW_LENGTH:
+        return text
+    return text[:PREVIEW_LENGTH - 1] + "…"
+
+
+def format_digest(digest):
+    lines = ["🗞 Сводка новых оценок и сообщений"]
+    count = digest.get("ratings", 0)
+    if count:
+        lines.append(f"\n⭐ Оценок: {count}")
+        for criterion in CRITERIA:
+            lines.append(f"{CRITERIA_LABELS[criterion]}: {digest['sum'][criterion] / count:.1f}/10")
+    if digest.get("messages"):
+        lines.append(f"\n📨 Сообщений: {digest['messages']}")
+
+    lines.append("\nПоследние:")
+    for item in reversed(digest.get("latest", [])):
+        if item["kind"] == "rating":
+            line = f"• ⭐ {item['average']:.1f}/10 от {item['sender']}"
+            if item.get("text"):
+                line += f": {item['text']}"
+        else:
+            line = f"• 📨 {item['text']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class Digests:
+    def __init__(
+        self,
+        window=DIGEST_WINDOW,
+        latest=DIGEST_LATEST,
+        poll_interval=DIGEST_POLL_INTERVAL,
+        preference_ttl=DIGEST_PREFERENCE_TTL,
+    ):
+        self.window = window
+        self.latest = latest
+        self.poll_interval = poll_interval
+        # Настройка получателя читается на каждую отправку ему — держим её в памяти.
+        # В многопроцессном режиме переключение доходит до других воркеров за время жизни записи
+        self._preferences = TTLCache(preference_ttl)
+        self.sent = 0
+        self._task = None
+
+    async def enabled(self, user_id):
+        enabled = self._preferences.get(user_id)
+        if enabled is None:
+            user = await users_collection.find_one({"user_id": user_id}, {"digest": 1})
+            enabled = bool(user and user.get("digest"))
+            self._preferences.set(user_id, enabled)
+        return enabled
+
+    async def set_enabled(self, user_id, enabled):
+        await users_collection.update_one({"user_id": user_id}, {"$set": {"digest": enabled}})
+        self._preferences.set(user_id, enabled)
+
+    async def notify(self, recipient_user_id, text, increment, item):
+        # Уведомление сразу или событие в сводку — по настройке получателя
+        if not await self.enabled(recipient_user_id):
+            await enqueue_message(recipient_user_id, text)
+            return
+        now = datetime.utcnow()
+        due_at = next_slot(recipient_user_id, now, self.window)
+        await digests_collection.update_one(
+            {"_id": f"{recipient_user_id}:{int((due_at - EPOCH).total_seconds())}"},
+            {
+                "$inc": increment,
+                "$push": {"latest": {"$each": [item], "$slice": -self.latest}},
+                "$setOnInsert": {"user_id": recipient_user_id, "created_at": now, "due_at": due_at},
+            },
+            upsert=True,
+        )
+
+    async def notify_rating(self, recipient_user_id, text, ratings, sender, message_text):
+        increment = {"ratings": 1}
+        for criterion in CRITERIA:
+            increment[f"sum.{criterion}"] = ratings[criterion]
+        item = {
+            "kind": "rating",
+            "average": sum(ratings[criterion] for criterion in CRITERIA) / len(CRITERIA),
+            "sender": sender,
+            "text": _preview(message_text) if message_text else None,
+        }
+        await self.notify(recipient_user_id, text, increment, item)
+
+    async def notify_message(self, recipient_user_id, text, message_text):
+        item = {"kind": "message", "text": _preview(message_text or "")}
+        await self.notify(recipient_user_id, text, {"messages": 1}, item)
+
+    async def send_due(self):
+        # Сначала сводка встаёт в очередь (повтор с тем же _id пропускается),
+        # затем документ удаляется — сводка не теряется, если процесс упадёт между ними
+        sent = 0
+        cursor = digests_collection.find({"due_at": {"$lte": datetime.utcnow() - LATE_WRITES}}).sort("due_at", 1)
+        async for digest in cursor:
+            delivery = build_delivery(digest["user_id"], format_digest(digest), PRIORITY_LOW)
+            delivery["_id"] = f"digest:{digest['_id']}"
+            sent += await enqueue_many([delivery])
+            await digests_collection.delete_one({"_id": digest["_id"]})
+        self.sent += sent
+        return sent
+
+    async def _send_periodically(self):
+        while True:
+            try:
+                await self.send_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось разослать сводки")
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._send_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+digests = Digests()
@@ -0,0 +1,171 @@
+# bot/services/export.py
+#
+# Выгрузка полученных оценок и сообщений в CSV или JSON. Документы читаются
+# курсором пачками и сразу дописываются в файл, поэтому память не зависит
+# от длины истории. Сначала идёт архив (bot/services/retention.py), затем
+# рабочие коллекции.
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from bot.config import EXPORT_BATCH_SIZE, EXPORT_CONCURRENCY
+from bot.database.aggregates import CRITERIA
+from bot.database.db import inbox_messages_collection, inbox_ratings_collection
+from bot.services.retention import MESSAGES, RATINGS, archived_documents
+
+CSV = "csv"
+JSON = "json"
+FORMATS = (CSV, JSON)
+
+COLUMNS = (
+    ["type", "timestamp", "from_user_id", "from_username", "anonymous"]
+    + list(CRITERIA)
+    + ["wants_relationship", "knows_personally", "text"]
+)
+
+RATING_FIELDS = {
+    "timestamp": 1,
+    "from_user_id": 1,
+    "from_username": 1,
+    "anonymous": 1,
+    "ratings": 1,
+    "wants_relationship": 1,
+    "knows_personally": 1,
+    "message": 1,
+}
+MESSAGE_FIELDS = {"timestamp": 1, "message_text": 1}
+
+# Тяжёлые выгрузки не должны занимать все соединения пула
+export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+
+def rating_row(document):
+    # Отправитель анонимной оценки в выгрузку не попадает
+    anonymous = document.get("anonymous", True)
+    ratings = document.get("ratings", {})
+    return {
+        "type": "rating",
+        "timestamp": document["timestamp"].isoformat(),
+        "from_user_id": None if anonymous else document.get("from_user_id"),
+        "from_username": None if anonymous else document.get("from_username"),
+        "anonymous": anonymous,
+        **{criterion: ratings.get(criterion) for criterion in CRITERIA},
+        "wants_relationship": document.get("wants_relationship"),
+        "knows_personally": document.get("knows_personally"),
+        "text": document.get("message"),
+    }
+
+
+def message_row(document):
+    # Сообщения всегда анонимные — id отправителя не выгружаем
+    return {
+        "type": "message",
+        "timestamp": document["timestamp"].isoformat(),
+        "anonymous": True,
+        "text": document.get("message_text"),
+    }
+
+
+class _Encoder:
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.rows = 0
+
+    def header(self):
+        if self.fmt == CSV:
+            return self._csv_line(COLUMNS)
+        return "[\n"
+
+    def encode(self, rows):
+        if self.fmt == CSV:
+            chunk = "".join(self._csv_line([row.get(column) for column in COLUMNS]) for row in rows)
+        else:
+            separator = ",\n" if self.rows else ""
+            chunk = separator + ",\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+        self.rows += len(rows)
+        return chunk
+
+    def footer(self):
+        if self.fmt == CSV:
+            return ""
+        return "\n]\n"
+
+    @staticmethod
+    def _csv_line(values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(["" if value is None else value for value in values])
+        return buffer.getvalue()
+
+
+async def _stream_archive(user_id, kind, convert, encoder, file):
+    # Архив пишется пачками в порядке (время, _id), поэтому повторно
+    # заархивированные документы отбрасываются сравнением с ключом последнего
+    # выгруженного, без множества _id. Ключ возвращается для рабочей коллекции
+    last = None
+    async for documents in archived_documents(user_id, kind):
+        rows = []
+        for document in documents:
+            key = (document["timestamp"], document["_id"])
+            if last is not None and key <= last:
+                continue
+            last = key
+            rows.append(convert(document))
+        if rows:
+            await asyncio.to_thread(file.write, encoder.encode(rows))
+    return last
+
+
+async def _stream(collection, query, projection, convert, encoder, file, after=None):
+    # after — ключ последнего документа из архива: всё не позже него уже выгружено,
+    # в том числе заархивированное, но ещё не удалённое из коллекции
+    if after is not None:
+        query = {**query, "timestamp": {"$gte": after[0]}}
+    cursor = (
+        collection.find(query, projection)
+        .sort([("timestamp", 1), ("_id", 1)])
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    batch = []
+    async for document in cursor:
+        if after is not None and (document["timestamp"], document["_id"]) <= after:
+            continue
+        batch.append(convert(document))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            await asyncio.to_thread(file.write, encoder.encode(batch))
+            batch = []
+    if batch:
+        await asyncio.to_thread(file.write, encoder.encode(batch))
+
+
+async def export_history(user_id, fmt=CSV, compress=False):
+    # Возвращает путь к временному файлу и число строк; файл удаляет вызывающий
+    suffix = f".{fmt}.gz" if compress else f".{fmt}"
+    descriptor, path = tempfile.mkstemp(prefix=f"export_{user_id}_", suffix=suffix)
+    os.close(descriptor)
+
+    encoder = _Encoder(fmt)
+    try:
+        if compress:
+            file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            file = open(path, "w", encoding="utf-8", newline="")
+        with file:
+            file.write(encoder.header())
+            last = await _stream_archive(user_id, RATINGS, rating_row, encoder, file)
+            await _stream(
+                inbox_ratings_collection, {"to_user_id": user_id}, RATING_FIELDS, rating_row, encoder, file, last
+            )
+            last = await _stream_archive(user_id, MESSAGES, message_row, encoder, file)
+            await _stream(
+                inbox_messages_collection, {"recipient_user_id": user_id}, MESSAGE_FIELDS, message_row, encoder, file, last
+            )
+            file.write(encoder.footer())
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, encoder.rows
@@ -0,0 +1,111 @@
+# bot/services/idempotency.py
+#
+# Защита от повторного выполнения одной и той же отправки. Сначала ключ
+# ищется в памяти (там же ждут повторы, пришедшие, пока первая попытка ещё
+# выполняется), затем вставляется в коллекцию idempotency: уникальный _id
+# не даст выполнить действие дважды и после перезапуска или в другом процессе.
+# Повтор получает сохранённый результат первой попытки.
+#
+# Действие — это только надёжная запись (вставка оценки или сообщения).
+# Как только она прошла, результат сохраняется в ключе, и ключ больше не
+# снимается: последующие шаги (after) могут упасть, но повтор не запишет
+# данные второй раз. Пока действие выполняется, ключ арендован на
+# IDEMPOTENCY_LEASE секунд; ключ упавшей посреди действия попытки
+# по истечении аренды забирает следующая.
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from bot.config import IDEMPOTENCY_TTL, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_LEASE
+from bot.database.db import idempotency_collection
+from bot.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyGuard:
+    def __init__(
+        self,
+        collection=idempotency_collection,
+        ttl=IDEMPOTENCY_TTL,
+        max_size=IDEMPOTENCY_CACHE_SIZE,
+        lease=IDEMPOTENCY_LEASE,
+    ):
+        self.collection = collection
+        self.lease = timedelta(seconds=lease)
+        # Ключ -> future с результатом первой попытки
+        self._recent = TTLCache(ttl, max_size)
+        self.duplicates = 0
+
+    async def _claim(self, key):
+        # Возвращает (ключ наш, результат прежней попытки)
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one(
+                {"_id": key, "created_at": now, "result": None, "pending_until": now + self.lease}
+            )
+            return True, None
+        except DuplicateKeyError:
+            pass
+        # Попытка, у которой истекла аренда, уже ничего не запишет — продолжаем за неё
+        if await self.collection.find_one_and_update(
+            {"_id": key, "pending_until": {"$lt": now}},
+            {"$set": {"pending_until": now + self.lease}},
+        ) is not None:
+            return True, None
+        document = await self.collection.find_one({"_id": key}, {"result": 1})
+        return False, document.get("result") if document else None
+
+    async def run(self, key, action, after=None):
+        # Возвращает (результат, повтор ли это). Для повтора результат — то,
+        # что вернула первая попытка, или None, если она ещё не сохранена.
+        # after выполняется после сохранения результата, только первой попыткой
+        recent = self._recent.get(key)
+        if recent is not None:
+            self.duplicates += 1
+            return await asyncio.shield(recent), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._recent.set(key, future)
+        try:
+            claimed, result = await self._claim(key)
+        except BaseException:
+            self._recent.pop(key)
+            future.set_result(None)
+            raise
+        if not claimed:
+            future.set_result(result)
+            self.duplicates += 1
+            return result, True
+
+        try:
+            result = await action()
+        except BaseException:
+            # Неудачная попытка не должна блокировать повтор
+            self._recent.pop(key)
+            future.set_result(None)
+            try:
+                await self.collection.delete_one({"_id": key})
+            except Exception:
+                logger.exception("Не удалось снять ключ %s", key)
+            raise
+
+        future.set_result(result)
+        await self.collection.update_one({"_id": key}, {"$set": {"result": result}, "$unset": {"pending_until": ""}})
+        if after is not None:
+            await after()
+        return result, False
+
+    async def result(self, key):
+        # Результат уже выполненного действия без попытки выполнить его
+        recent = self._recent.get(key)
+        if recent is not None:
+            return await asyncio.shield(recent)
+        document = await self.collection.find_one({"_id": key}, {"result": 1})
+        return document.get("result") if document else None
+
+
+idempotency = IdempotencyGuard()
@@ -0,0 +1,182 @@
+# bot/services/leaderboard.py
+#
+# Материализованные топ-K по каждому критерию: один документ на критерий
+# в коллекции leaderboards. Новые оценки обновляют таблицы точечно, а
+# периодический пересчёт из rating_aggregates исправляет накопившийся дрейф.
+
+import asyncio
+import logging
+from datetime import datetime
+from time import monotonic
+
+from pymongo import UpdateOne
+
+from bot.config import (
+    LEADERBOARD_SIZE,
+    LEADERBOARD_MIN_RATINGS,
+    LEADERBOARD_REBUILD_INTERVAL,
+    LEADERBOARD_CACHE_TTL,
+)
+from bot.database.aggregates import CRITERIA
+from bot.database.db import leaderboards_collection, rating_aggregates_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+OVERALL = "overall"
+LEADERBOARD_CRITERIA = CRITERIA + (OVERALL,)
+
+
+def aggregate_averages(aggregate):
+    count = aggregate["count"]
+    averages = {criterion: aggregate["sum"][criterion] / count for criterion in CRITERIA}
+    averages[OVERALL] = sum(aggregate["sum"][criterion] for criterion in CRITERIA) / (count * len(CRITERIA))
+    return averages
+
+
+def _average_expression(criterion):
+    if criterion == OVERALL:
+        total = {"$add": [f"$sum.{name}" for name in CRITERIA]}
+        return {"$divide": [total, {"$multiply": ["$count", len(CRITERIA)]}]}
+    return {"$divide": [f"$sum.{criterion}", "$count"]}
+
+
+def _rebuild_pipeline(criterion, size, min_ratings):
+    return [
+        {"$match": {"count": {"$gte": min_ratings}}},
+        {"$project": {"_id": 0, "user_id": 1, "count": 1, "average": _average_expression(criterion)}},
+        {"$sort": {"average": -1, "count": -1}},
+        {"$limit": size},
+        {"$lookup": {
+            "from": users_collection.name,
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "user",
+        }},
+        {"$project": {
+            "user_id": 1,
+            "count": 1,
+            "average": 1,
+            "username": {"$arrayElemAt": ["$user.username", 0]},
+        }},
+    ]
+
+
+class Leaderboards:
+    def __init__(
+        self,
+        size=LEADERBOARD_SIZE,
+        min_ratings=LEADERBOARD_MIN_RATINGS,
+        cache_ttl=LEADERBOARD_CACHE_TTL,
+        rebuild_interval=LEADERBOARD_REBUILD_INTERVAL,
+    ):
+        self.size = size
+        # Хранится вдвое больше мест, чем показывается: если среднее участника
+        # просядет, его место займёт кандидат из запаса, а не дождётся пересчёта
+        self.capacity = size * 2
+        self.min_ratings = min_ratings
+        self.cache_ttl = cache_ttl
+        self.rebuild_interval = rebuild_interval
+        self._cache = {}
+        self._task = None
+
+    async def get(self, criterion):
+        # Страница топа — это один закэшированный документ
+        entries = await self._entries(criterion)
+        return entries[:self.size]
+
+    async def _entries(self, criterion):
+        cached = self._cache.get(criterion)
+        if cached is not None and monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        board = await leaderboards_collection.find_one({"_id": criterion})
+        entries = board["entries"] if board else []
+        self._cache[criterion] = (monotonic(), entries)
+        return entries
+
+    async def apply_aggregate(self, aggregate):
+        if not aggregate or aggregate.get("count", 0) < self.min_ratings:
+            return
+
+        user_id = aggregate["user_id"]
+        username = None
+        operations = []
+        for criterion, average in aggregate_averages(aggregate).items():
+            entries = await self._entries(criterion)
+            current = next((entry for entry in entries if entry["user_id"] == user_id), None)
+            # Пользователь вне таблицы, и его среднее не выше последнего места — писать нечего
+            if current is None and len(entries) >= self.capacity and (average, aggregate["count"]) <= (
+                entries[-1]["average"], entries[-1]["count"]
+            ):
+                continue
+
+            if current is not None:
+                username = current.get("username")
+            elif username is None:
+                user = await users_collection.find_one({"user_id": user_id}, {"username": 1})
+                username = user["username"] if user else None
+
+            entry = {"user_id": user_id, "username": username, "average": average, "count": aggregate["count"]}
+            operations.append(UpdateOne({"_id": criterion}, self._replace_entry(entry), upsert=True))
+
+            # Держим локальную копию в актуальном виде для следующих проверок порога
+            updated = [existing for existing in entries if existing["user_id"] != user_id] + [entry]
+            updated.sort(key=lambda item: (item["average"], item["count"]), reverse=True)
+            self._cache[criterion] = (self._cache[criterion][0], updated[:self.capacity])
+
+        if operations:
+            await leaderboards_collection.bulk_write(operations, ordered=False)
+
+    def _replace_entry(self, entry):
+        # Старая запись пользователя убирается и новая вставляется одним
+        # обновлением-конвейером: параллельные обновления того же пользователя
+        # не могут вклиниться между ними и оставить его в таблице дважды.
+        # $sortArray требует MongoDB 5.2+ (MONGO_MIN_SERVER_VERSION, проверяется в ensure_indexes)
+        return [{"$set": {"entries": {"$slice": [
+            {"$sortArray": {
+                "input": {"$concatArrays": [
+                    {"$filter": {
+                        "input": {"$ifNull": ["$entries", []]},
+                        "cond": {"$ne": ["$$this.user_id", entry["user_id"]]},
+                    }},
+                    [{"$literal": entry}],
+                ]},
+                "sortBy": {"average": -1, "count": -1},
+            }},
+            self.capacity,
+        ]}}}]
+
+    async def rebuild(self):
+        rebuilt_at = datetime.utcnow()
+        for criterion in LEADERBOARD_CRITERIA:
+            entries = await rating_aggregates_collection.aggregate(
+                _rebuild_pipeline(criterion, self.capacity, self.min_ratings)
+            ).to_list(length=self.capacity)
+            await leaderboards_collection.replace_one(
+                {"_id": criterion},
+                {"_id": criterion, "entries": entries, "rebuilt_at": rebuilt_at},
+                upsert=True,
+            )
+            self._cache[criterion] = (monotonic(), entries)
+        logger.info("Таблицы лидеров пересчитаны")
+
+    async def _rebuild_periodically(self):
+        while True:
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось пересчитать таблицы лидеров")
+            await asyncio.sleep(self.rebuild_interval)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._rebuild_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+leaderboards = Leaderboards()
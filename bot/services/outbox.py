@@ -0,0 +1,293 @@
+# bot/services/outbox.py
+
+import asyncio
+import logging
+import random
+from collections import deque
+from datetime import datetime, timedelta
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from bot.config import (
+    OUTBOX_WORKERS,
+    OUTBOX_GLOBAL_RATE,
+    OUTBOX_CHAT_RATE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_REPORT_INTERVAL,
+    BROADCAST_RATE,
+)
+from bot.database.db import outbox_collection
+from bot.database.repositories import users_repo
+from bot.utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+# Массовые рассылки: идут после всех остальных и со своим лимитом
+PRIORITY_BULK = 30
+
+# Сколько доставка может висеть в статусе sending, прежде чем её заберёт другой воркер
+LEASE = timedelta(seconds=60)
+POLL_INTERVAL = 1.0
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 300.0
+
+_wakeup = asyncio.Event()
+
+DUPLICATE_KEY = 11000
+
+
+def build_delivery(chat_id, text, priority=PRIORITY_NORMAL, **params):
+    now = datetime.utcnow()
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "params": params,
+        "status": PENDING,
+        "priority": priority,
+        "attempts": 0,
+        "not_before": now,
+        "created_at": now,
+    }
+
+
+async def enqueue_message(chat_id, text, priority=PRIORITY_NORMAL, **params):
+    delivery = build_delivery(chat_id, text, priority, **params)
+    await outbox_collection.insert_one(delivery)
+    _wakeup.set()
+    return delivery["_id"]
+
+
+async def enqueue_many(deliveries):
+    # Пачка доставок одним запросом; доставки с уже существующим _id
+    # (повтор после перезапуска) пропускаются
+    try:
+        inserted = len((await outbox_collection.insert_many(deliveries, ordered=False)).inserted_ids)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        inserted = e.details["nInserted"]
+    _wakeup.set()
+    return inserted
+
+
+class OutboxStats:
+    def __init__(self, window=60.0):
+        self.window = window
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.queue_depth = 0
+        self._recent = deque()
+
+    def record_sent(self):
+        self.sent += 1
+        self._recent.append(monotonic())
+
+    def throughput(self):
+        # Доставок в секунду за последнее окно
+        border = monotonic() - self.window
+        while self._recent and self._recent[0] < border:
+            self._recent.popleft()
+        return len(self._recent) / self.window
+
+
+class OutboxWorkerPool:
+    def __init__(
+        self,
+        bot: Bot,
+        workers=OUTBOX_WORKERS,
+        global_rate=OUTBOX_GLOBAL_RATE,
+        chat_rate=OUTBOX_CHAT_RATE,
+        max_attempts=OUTBOX_MAX_ATTEMPTS,
+        bulk_rate=BROADCAST_RATE,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(global_rate)
+        # Рассылки расходуют только часть общего лимита, остальное остаётся живым ответам
+        self.bulk_bucket = TokenBucket(bulk_rate)
+        self.stats = OutboxStats()
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._stopping = False
+        self._tasks = []
+
+    async def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        logger.info("Очередь исходящих запущена: %s воркеров", self.workers)
+
+    async def stop(self):
+        self._stopping = True
+        _wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def queue_depth(self):
+        self.stats.queue_depth = await outbox_collection.count_documents({"status": PENDING})
+        return self.stats.queue_depth
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                # Паузу и общий лимит ждём до захвата: после него доставка
+                # только отправляется, иначе аренда LEASE может истечь
+                # и доставку заберёт и отправит второй воркер
+                pause = self._paused_until - monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                await self.global_bucket.acquire()
+                delivery = await self._claim()
+                if delivery is None:
+                    self.global_bucket.release()
+                    await self._wait_for_work()
+                    continue
+                await self._deliver(delivery)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка воркера очереди исходящих")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _wait_for_work(self):
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        query = {"status": PENDING, "not_before": {"$lte": now}}
+        if self.bulk_bucket.delay() > 0:
+            # Лимит рассылки на сейчас выбран — берём только обычные доставки
+            query["priority"] = {"$lt": PRIORITY_BULK}
+        return await outbox_collection.find_one_and_update(
+            query,
+            {"$set": {"status": SENDING, "locked_until": now + LEASE}, "$inc": {"attempts": 1}},
+            sort=[("priority", ASCENDING), ("not_before", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    async def _deliver(self, delivery):
+        # Захваченная доставка не ждёт лимитов: если отправлять сейчас нельзя,
+        # она откладывается, а воркер берёт следующую — так один популярный
+        # получатель не занимает весь пул. Токен общего лимита уже взят
+        delay = max(
+            self._chat_bucket(delivery["chat_id"]).delay(),
+            self._paused_until - monotonic(),
+        )
+        if delay <= 0 and delivery["priority"] >= PRIORITY_BULK and not self.bulk_bucket.try_acquire():
+            # Лимит рассылки успел выбрать другой воркер
+            delay = self.bulk_bucket.delay()
+        if delay > 0:
+            self.global_bucket.release()
+            await self._reschedule(delivery, delay, count_attempt=False)
+            return
+        self._chat_bucket(delivery["chat_id"]).try_acquire()
+
+        try:
+            await self.bot.send_message(
+                chat_id=delivery["chat_id"],
+                text=delivery["text"],
+                **delivery.get("params", {})
+            )
+        except TelegramRetryAfter as e:
+            # Flood control: притормаживаем весь пул и повторяем без штрафа
+            self._paused_until = max(self._paused_until, monotonic() + e.retry_after)
+            await self._reschedule(delivery, e.retry_after, count_attempt=False)
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота — повторять бессмысленно,
+            # а следующие рассылки его пропустят
+            await self._finish(delivery, FAILED, error=str(e))
+            await users_repo.set_blocked(delivery["chat_id"], True)
+        except Exception as e:
+            if delivery["attempts"] >= self.max_attempts:
+                await self._finish(delivery, FAILED, error=str(e))
+            else:
+                backoff = min(BACKOFF_BASE ** delivery["attempts"], BACKOFF_CAP)
+                await self._reschedule(delivery, backoff * random.uniform(0.5, 1.5), error=str(e))
+        else:
+            await self._finish(delivery, SENT)
+
+    async def _reschedule(self, delivery, delay, count_attempt=True, error=None):
+        update = {
+            "$set": {
+                "status": PENDING,
+                "not_before": datetime.utcnow() + timedelta(seconds=delay),
+            },
+            "$unset": {"locked_until": ""},
+        }
+        if error is not None:
+            update["$set"]["last_error"] = error
+            self.stats.retried += 1
+        if not count_attempt:
+            update["$inc"] = {"attempts": -1}
+        await outbox_collection.update_one({"_id": delivery["_id"]}, update)
+
+    async def _finish(self, delivery, status, error=None):
+        update = {"status": status, "finished_at": datetime.utcnow()}
+        if error is not None:
+            update["last_error"] = error
+        await outbox_collection.update_one(
+            {"_id": delivery["_id"]},
+            {"$set": update, "$unset": {"locked_until": ""}},
+        )
+        if status == SENT:
+            self.stats.record_sent()
+        else:
+            self.stats.failed += 1
+
+    async def requeue_expired(self):
+        # Возвращаем в очередь доставки упавших воркеров
+        result = await outbox_collection.update_many(
+            {"status": SENDING, "locked_until": {"$lt": datetime.utcnow()}},
+            {"$set": {"status": PENDING}, "$unset": {"locked_until": ""}},
+        )
+        return result.modified_count
+
+    async def _maintenance(self):
+        last_report = monotonic()
+        while not self._stopping:
+            await asyncio.sleep(POLL_INTERVAL * 10)
+            try:
+                await self.requeue_expired()
+                self._chat_buckets = {
+                    chat_id: bucket
+                    for chat_id, bucket in self._chat_buckets.items()
+                    if not bucket.is_full()
+                }
+                depth = await self.queue_depth()
+                if monotonic() - last_report >= OUTBOX_REPORT_INTERVAL:
+                    last_report = monotonic()
+                    logger.info(
+                        "Очередь исходящих: в очереди %s, %.2f доставок/с, отправлено %s, ошибок %s",
+                        depth, self.stats.throughput(), self.stats.sent, self.stats.failed,
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка обслуживания очереди исходящих")
@@ -0,0 +1,189 @@
+# bot/services/retention.py
+#
+# Сообщения и оценки старше RETENTION_DAYS уходят из рабочих коллекций,
+# чтобы они и их индексы помещались в память. Перед удалением пачка
+# дописывается в архив: файл RETENTION_ARCHIVE_DIR/<вид>/<ГГГГ-ММ>.jsonl.gz,
+# куда документы каждого получателя пишутся отдельным gzip-блоком (склеенные
+# блоки — тоже корректный gzip). Положение блока записывается в archive_index,
+# по нему /export достаёт архив пользователя, не распаковывая чужие данные.
+#
+# Суммы уходящих оценок добавляются в archived_totals, чтобы пересчёт
+# агрегатов (manage.py rebuild-aggregates) не терял архивные оценки.
+#
+# Порядок шагов — файл (с fsync), индекс, итоги, удаление. Если процесс упадёт
+# между ними, пачка будет заархивирована повторно; выгрузка отбрасывает повторы
+# по ключу (время, _id), а итоги пачки узнаются по её первому и последнему _id.
+# Счётчик непрочитанных уменьшается уже после удаления и ровно на число
+# удалённых непрочитанных, так что повтор пачки не вычтет их второй раз.
+
+import asyncio
+import gzip
+import logging
+import os
+from datetime import datetime, timedelta
+
+from bson import json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+from pymongo import ASCENDING, UpdateOne
+
+from bot.config import RETENTION_DAYS, RETENTION_ARCHIVE_DIR, RETENTION_BATCH_SIZE, RETENTION_INTERVAL
+from bot.database.aggregates import add_archived_totals
+from bot.database.db import archive_index_collection, messages_collection, ratings_collection, users_collection
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = "messages"
+RATINGS = "ratings"
+# Вид -> коллекция и поле получателя
+KINDS = {
+    MESSAGES: (messages_collection, "recipient_user_id"),
+    RATINGS: (ratings_collection, "to_user_id"),
+}
+
+
+def _append_members(path, groups):
+    # Дописывает по gzip-блоку на получателя; возвращает положение блоков
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    members = []
+    with open(path, "ab") as file:
+        offset = file.seek(0, os.SEEK_END)
+        for user_id, documents in groups.items():
+            lines = "".join(json_util.dumps(document, json_options=RELAXED_JSON_OPTIONS) + "\n" for document in documents)
+            member = gzip.compress(lines.encode())
+            file.write(member)
+            members.append((user_id, offset, len(member), documents))
+            offset += len(member)
+        file.flush()
+        os.fsync(file.fileno())
+    return members
+
+
+def _read_member(path, offset, length):
+    with open(path, "rb") as file:
+        file.seek(offset)
+        data = file.read(length)
+    return [json_util.loads(line) for line in gzip.decompress(data).decode().splitlines()]
+
+
+async def archived_documents(user_id, kind, archive_dir=RETENTION_ARCHIVE_DIR):
+    # Архивные документы пользователя пачками, от старых к новым
+    cursor = archive_index_collection.find({"user_id": user_id, "kind": kind}).sort("first", ASCENDING)
+    async for entry in cursor:
+        path = os.path.join(archive_dir, entry["file"])
+        try:
+            yield await asyncio.to_thread(_read_member, path, entry["offset"], entry["length"])
+        except OSError:
+            logger.exception("Не удалось прочитать архив %s (смещение %s)", path, entry["offset"])
+
+
+class Retention:
+    def __init__(
+        self,
+        days=RETENTION_DAYS,
+        archive_dir=RETENTION_ARCHIVE_DIR,
+        batch_size=RETENTION_BATCH_SIZE,
+        interval=RETENTION_INTERVAL,
+    ):
+        self.days = days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task = None
+
+    async def _archive(self, kind, owner_field, batch):
+        groups = {}
+        for document in batch:
+            groups.setdefault(document[owner_field], []).append(document)
+        relative = os.path.join(kind, f"{datetime.utcnow():%Y-%m}.jsonl.gz")
+        members = await asyncio.to_thread(_append_members, os.path.join(self.archive_dir, relative), groups)
+
+        archived_at = datetime.utcnow()
+        await archive_index_collection.insert_many([
+            {
+                "user_id": user_id,
+                "kind": kind,
+                "file": relative,
+                "offset": offset,
+                "length": length,
+                "count": len(documents),
+                "first": documents[0]["timestamp"],
+                "last": documents[-1]["timestamp"],
+                "archived_at": archived_at,
+            }
+            for user_id, offset, length, documents in members
+        ])
+
+    async def _delete_messages(self, batch):
+        # Как в mark_messages_read: непрочитанные удаляются с условием is_read
+        # по получателям, и счётчик уменьшается на то, что удалено на самом деле
+        unread = {}
+        for message in batch:
+            if message.get("is_read") is False:
+                unread.setdefault(message["recipient_user_id"], []).append(message["_id"])
+        results = await asyncio.gather(*(
+            messages_collection.delete_many({"_id": {"$in": ids}, "is_read": False}) for ids in unread.values()
+        ))
+        released = [
+            UpdateOne({"user_id": user_id}, {"$inc": {"unread_messages": -result.deleted_count}})
+            for user_id, result in zip(unread, results)
+            if result.deleted_count
+        ]
+        if released:
+            await users_collection.bulk_write(released, ordered=False)
+        await messages_collection.delete_many({"_id": {"$in": [message["_id"] for message in batch]}})
+
+    async def sweep(self, kind, cutoff):
+        collection, owner_field = KINDS[kind]
+        removed = 0
+        while True:
+            # Порядок однозначен, чтобы повтор после падения взял ту же пачку
+            batch = await collection.find(
+                {"timestamp": {"$lt": cutoff}}
+            ).sort([("timestamp", ASCENDING), ("_id", ASCENDING)]).limit(self.batch_size).to_list(
+                length=self.batch_size
+            )
+            if not batch:
+                break
+            if self.archive_dir:
+                await self._archive(kind, owner_field, batch)
+            if kind == MESSAGES:
+                await self._delete_messages(batch)
+            else:
+                await add_archived_totals(f"{batch[0]['_id']}:{batch[-1]['_id']}:{len(batch)}", batch)
+                await collection.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+            removed += len(batch)
+            if len(batch) < self.batch_size:
+                break
+        return removed
+
+    async def run_once(self):
+        cutoff = datetime.utcnow() - timedelta(days=self.days)
+        removed = {kind: await self.sweep(kind, cutoff) for kind in KINDS}
+        logger.info(
+            "Хранение: старше %s убрано сообщений %s, оценок %s%s",
+            cutoff, removed[MESSAGES], removed[RATINGS], " (в архив)" if self.archive_dir else "",
+        )
+        return removed
+
+    async def _run_periodically(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось перенести старые данные в архив")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self.days > 0:
+            self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+retention = Retention()
@@ -0,0 +1,211 @@
+# bot/services/stats.py
+#
+# Статистика полученных оценок: распределения, динамика по неделям и
+# процентили по каждому критерию. Оценки читаются пачками и складываются
+# в столбцы NumPy (оценки — матрица n × критерии, время — вектор), все
+# расчёты векторные и идут в отдельном потоке, чтобы не держать event loop.
+#
+# Столбцы и готовый отчёт кэшируются на пользователя. Новая оценка
+# сбрасывает отчёт (invalidate), а столбцы дочитываются только новыми
+# оценками. Счётчик оценок сверяется с rating_aggregates, так что оценки,
+# принятые другим процессом, тоже подхватываются. Агрегат учитывает и
+# ушедшие в архив оценки, поэтому сравнивается прирост, а не общее число.
+
+import asyncio
+from datetime import datetime
+from time import monotonic
+
+import numpy as np
+from pymongo import ASCENDING
+
+from bot.config import STATS_BATCH_SIZE, STATS_CACHE_SIZE, STATS_CACHE_TTL, STATS_GLOBAL_TTL
+from bot.database.aggregates import CRITERIA
+from bot.database.db import inbox_ratings_collection, inbox_rating_aggregates_collection
+from bot.database.projections import RATING_STATS_FIELDS
+from bot.database.repositories import ratings_repo
+from bot.utils.cache import TTLCache
+
+SCORES = 10
+PERCENTILES = (25, 50, 75, 90)
+# Скользящее среднее считается по окну из ROLLING_WEEKS недель, показываются последние TREND_WEEKS
+ROLLING_WEEKS = 4
+TREND_WEEKS = 8
+
+
+def _monday_weeks(timestamps):
+    # Номер недели с понедельника: 1970-01-01 был четвергом
+    days = timestamps.astype("datetime64[D]").astype(np.int64)
+    return (days + 3) // 7
+
+
+def compute_report(scores, timestamps, now):
+    count = len(scores)
+    criteria = len(CRITERIA)
+    scores = np.clip(scores, 1, SCORES)
+
+    # Гистограммы всех критериев одним bincount: у каждого критерия свой диапазон корзин
+    offsets = np.arange(criteria) * SCORES
+    histograms = np.bincount(
+        (scores.astype(np.int64) - 1 + offsets).ravel(), minlength=criteria * SCORES
+    ).reshape(criteria, SCORES)
+
+    means = scores.mean(axis=0)
+    percentiles = np.percentile(scores, PERCENTILES, axis=0, method="nearest")
+
+    # Средняя оценка по неделям и скользящее среднее по ROLLING_WEEKS неделям до текущей
+    weeks = _monday_weeks(timestamps)
+    first = weeks.min()
+    current = _monday_weeks(np.array([now], dtype="datetime64[s]"))[0]
+    week_count = max(current, weeks.max()) - first + 1
+    index = weeks - first
+    week_sums = np.bincount(index, weights=scores.mean(axis=1), minlength=week_count)
+    week_counts = np.bincount(index, minlength=week_count)
+    cumulative_sums = np.concatenate(([0.0], np.cumsum(week_sums)))
+    cumulative_counts = np.concatenate(([0], np.cumsum(week_counts)))
+    ends = np.arange(1, week_count + 1)
+    starts = np.maximum(ends - ROLLING_WEEKS, 0)
+    window_counts = cumulative_counts[ends] - cumulative_counts[starts]
+    rolling = np.divide(
+        cumulative_sums[ends] - cumulative_sums[starts],
+        window_counts,
+        out=np.full(week_count, np.nan),
+        where=window_counts > 0,
+    )
+    shown = slice(max(week_count - TREND_WEEKS, 0), week_count)
+    week_starts = ((np.arange(week_count) + first) * 7 - 3).astype("datetime64[D]")
+
+    return {
+        "count": count,
+        "histograms": {criterion: histograms[i].tolist() for i, criterion in enumerate(CRITERIA)},
+        "means": {criterion: float(means[i]) for i, criterion in enumerate(CRITERIA)},
+        "percentiles": {
+            criterion: dict(zip(PERCENTILES, percentiles[:, i].tolist())) for i, criterion in enumerate(CRITERIA)
+        },
+        "trend": [
+            (week_start.item(), None if np.isnan(value) else float(value), int(amount))
+            for week_start, value, amount in zip(week_starts[shown], rolling[shown], week_counts[shown])
+        ],
+    }
+
+
+class _Columns:
+    __slots__ = ("count", "scores", "timestamps", "last_timestamp", "boundary", "report")
+
+    def __init__(self, scores, timestamps, last_timestamp, boundary):
+        # Счётчик агрегата на момент чтения
+        self.count = None
+        self.scores = scores
+        self.timestamps = timestamps
+        # Время последней прочитанной оценки и _id оценок с этим временем:
+        # следующее чтение начинается с него и пропускает уже прочитанные
+        self.last_timestamp = last_timestamp
+        self.boundary = boundary
+        self.report = None
+
+
+class RatingStats:
+    def __init__(
+        self,
+        batch_size=STATS_BATCH_SIZE,
+        cache_size=STATS_CACHE_SIZE,
+        cache_ttl=STATS_CACHE_TTL,
+        global_ttl=STATS_GLOBAL_TTL,
+    ):
+        self.batch_size = batch_size
+        self.global_ttl = global_ttl
+        self._cache = TTLCache(cache_ttl, cache_size)
+        self._global = None
+
+    async def _load(self, user_id, since=None, seen=frozenset()):
+        query = {"to_user_id": user_id}
+        if since is not None:
+            query["timestamp"] = {"$gte": since}
+        cursor = (
+            inbox_ratings_collection.find(query, RATING_STATS_FIELDS)
+            .sort("timestamp", ASCENDING)
+            .batch_size(self.batch_size)
+        )
+
+        score_chunks, time_chunks, rows = [], [], []
+        last_timestamp, boundary = since, set(seen)
+
+        def flush():
+            score_chunks.append(np.array(
+                [[row["ratings"][criterion] for criterion in CRITERIA] for row in rows], dtype=np.int8
+            ))
+            time_chunks.append(np.array([row["timestamp"] for row in rows], dtype="datetime64[s]"))
+            rows.clear()
+
+        async for rating in cursor:
+            if rating["_id"] in seen:
+                continue
+            if rating["timestamp"] != last_timestamp:
+                last_timestamp, boundary = rating["timestamp"], set()
+            boundary.add(rating["_id"])
+            rows.append(rating)
+            if len(rows) >= self.batch_size:
+                flush()
+        if rows:
+            flush()
+
+        if not score_chunks:
+            scores = np.empty((0, len(CRITERIA)), dtype=np.int8)
+            timestamps = np.empty(0, dtype="datetime64[s]")
+        else:
+            scores, timestamps = np.concatenate(score_chunks), np.concatenate(time_chunks)
+        return _Columns(scores, timestamps, last_timestamp, boundary)
+
+    async def _columns(self, user_id, count):
+        columns = self._cache.get(user_id)
+        if columns is not None and columns.count < count:
+            fresh = await self._load(user_id, columns.last_timestamp, columns.boundary)
+            if len(fresh.scores) == count - columns.count:
+                fresh.scores = np.concatenate((columns.scores, fresh.scores))
+                fresh.timestamps = np.concatenate((columns.timestamps, fresh.timestamps))
+                fresh.count = count
+                return fresh
+            # Оценка записалась с временем раньше прочитанных — перечитываем всё
+            columns = None
+        if columns is None or columns.count != count:
+            columns = await self._load(user_id)
+            columns.count = count
+        return columns
+
+    async def report(self, user_id):
+        aggregate = await ratings_repo.get_aggregate(user_id)
+        count = aggregate.get("count", 0) if aggregate else 0
+        if not count:
+            return None
+
+        columns = self._cache.get(user_id)
+        if columns is None or columns.report is None or columns.count != count:
+            columns = await self._columns(user_id, count)
+            if not len(columns.scores):
+                return None
+            columns.report = await asyncio.to_thread(
+                compute_report, columns.scores, columns.timestamps, datetime.utcnow()
+            )
+            self._cache.set(user_id, columns)
+        return columns.report
+
+    def invalidate(self, user_id):
+        columns = self._cache.get(user_id)
+        if columns is not None:
+            columns.report = None
+
+    async def global_averages(self):
+        # Средние по всем оценкам бота — из агрегатов, раз в global_ttl
+        if self._global is not None and monotonic() - self._global[0] < self.global_ttl:
+            return self._global[1]
+        group = {"_id": None, "count": {"$sum": "$count"}}
+        for criterion in CRITERIA:
+            group[criterion] = {"$sum": f"$sum.{criterion}"}
+        totals = await inbox_rating_aggregates_collection.aggregate([{"$group": group}]).to_list(length=1)
+        averages = {}
+        if totals and totals[0]["count"]:
+            averages = {criterion: totals[0][criterion] / totals[0]["count"] for criterion in CRITERIA}
+        self._global = (monotonic(), averages)
+        return averages
+
+
+rating_stats = RatingStats()
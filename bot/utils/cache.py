@@ -0,0 +1,43 @@
+# bot/utils/cache.py
+
+from collections import OrderedDict
+from time import monotonic
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Словарь с ограниченным размером и сроком жизни записей: при переполнении
+    # вытесняются самые старые, просроченные удаляются при обращении
+    __slots__ = ("ttl", "max_size", "_items")
+
+    def __init__(self, ttl, max_size=100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= monotonic():
+            del self._items[key]
+            return default
+        return value
+
+    def set(self, key, value):
+        self._items[key] = (monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._items.pop(key, None)
+        return default if item is None else item[1]
@@ -0,0 +1,19 @@
+# bot/utils/encoding.py
+
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number):
+    if number == 0:
+        return "0"
+    sign = "-" if number < 0 else ""
+    number = abs(number)
+    encoded = ""
+    while number:
+        number, remainder = divmod(number, 36)
+        encoded = BASE36_DIGITS[remainder] + encoded
+    return sign + encoded
+
+
+def from_base36(encoded):
+    return int(encoded, 36)
@@ -0,0 +1,73 @@
+# bot/utils/ratelimit.py
+
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def release(self, tokens=1):
+        # Вернуть взятые токены, если они не понадобились
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def delay(self, tokens=1):
+        # Сколько секунд ждать, пока в ведре наберётся нужное число токенов
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+
+class BucketTable:
+    # Ведра по ключам с вытеснением давно не использованных: память ограничена
+    # max_size записями, сколько бы отправителей ни приходило. Вытесненное
+    # ведро при следующем обращении создаётся заново — полным.
+    __slots__ = ("rate", "capacity", "max_size", "_buckets")
+
+    def __init__(self, rate, capacity=None, max_size=100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def try_acquire(self, key, tokens=1):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.try_acquire(tokens)
@@ -0,0 +1,99 @@
+# bot/webhook.py
+#
+# Приём апдейтов через вебхук. Telegram получает ответ сразу, а апдейт
+# обрабатывается фоновой задачей; число одновременных задач ограничено.
+
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_CONCURRENCY,
+    WEBHOOK_MAX_CONNECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    # Когда все слоты заняты, ответ Telegram задерживается до освобождения
+    # слота: он держит не больше max_connections запросов и сам притормозит,
+    # а очередь задач в памяти не растёт
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency=WEBHOOK_CONCURRENCY, **data):
+        super().__init__(
+            dispatcher, bot, handle_in_background=True, secret_token=WEBHOOK_SECRET, **data
+        )
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._feed(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed(self, bot: Bot, update):
+        try:
+            await self._background_feed_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки апдейта %s", update.get("update_id"))
+        finally:
+            self._slots.release()
+
+
+class ReceiverRequestHandler(SimpleRequestHandler):
+    # Вебхук многопроцессного режима: апдейт только раскладывается по воркерам
+
+    def __init__(self, receiver, bot: Bot):
+        super().__init__(receiver.dp, bot, handle_in_background=True, secret_token=WEBHOOK_SECRET)
+        self.receiver = receiver
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        # Воркеры не успевают — держим ответ, Telegram подождёт
+        while self.receiver.overloaded():
+            await asyncio.sleep(0.05)
+        self.receiver.dispatch_raw(update)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def create_app(handler, dp: Dispatcher = None, bot: Bot = None):
+    app = web.Application()
+    handler.register(app, path=WEBHOOK_PATH)
+    if dp is not None:
+        # startup/shutdown диспетчера привязываются к жизненному циклу приложения
+        setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для UPDATES_MODE=webhook нужен WEBHOOK_URL")
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+
+async def serve(app):
+    # Работает до отмены задачи; при отмене приложение корректно закрывается
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info("Вебхук слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+from uuid import uuid4
+
+from bot.config import RETENTION_DAYS, RETENTION_ARCHIVE_DIR
+from bot.database.aggregates import rebuild_rating_aggregates
+from bot.database.db import users_collection
+from bot.database.indexes import ensure_indexes, find_duplicates, verify_query_plans
+from bot.services.retention import Retention
+
+
+async def rebuild_aggregates(args):
+    rebuilt = await rebuild_rating_aggregates(batch_size=args.batch_size)
+    print(f"✅ Пересчитано агрегатов: {rebuilt}")
+
+
+async def check_indexes(args):
+    await ensure_indexes()
+    await verify_query_plans()
+    print("✅ Все запросы обработчиков используют индексы")
+
+
+async def strip_user_ratings(args):
+    # Поле users.ratings никогда не заполнялось, но читается с каждым пользователем.
+    # Удаляется пачками по _id, чтобы не держать одну долгую операцию
+    stripped = 0
+    while True:
+        ids = [
+            user["_id"]
+            async for user in users_collection.find({"ratings": {"$exists": True}}, {"_id": 1}).limit(args.batch_size)
+        ]
+        if not ids:
+            break
+        result = await users_collection.update_many({"_id": {"$in": ids}}, {"$unset": {"ratings": ""}})
+        stripped += result.modified_count
+    print(f"✅ Поле ratings удалено у пользователей: {stripped}")
+
+
+async def dedupe_users(args):
+    # Повторы user_id остались от старого /start (проверка и вставка отдельными запросами).
+    # Остаётся самый ранний документ, непрочитанные сообщения повторов переносятся в него
+    removed = 0
+    async for row in find_duplicates(users_collection, "user_id"):
+        users = await users_collection.find({"_id": {"$in": row["ids"]}}).sort("_id", 1).to_list(length=None)
+        keep, extra = users[0], users[1:]
+        unread = sum(user.get("unread_messages", 0) for user in extra)
+        if unread:
+            await users_collection.update_one({"_id": keep["_id"]}, {"$inc": {"unread_messages": unread}})
+        await users_collection.delete_many({"_id": {"$in": [user["_id"] for user in extra]}})
+        removed += len(extra)
+        print(f"user_id {row['_id']}: оставлен {keep['_id']}, удалено повторов {len(extra)}")
+
+    # Совпавшие link_id у разных пользователей: все, кроме первого, получают новую ссылку
+    relinked = 0
+    async for row in find_duplicates(users_collection, "link_id"):
+        for _id in sorted(row["ids"])[1:]:
+            await users_collection.update_one({"_id": _id}, {"$set": {"link_id": str(uuid4())}})
+            relinked += 1
+    print(f"✅ Удалено повторов пользователей: {removed}, выдано новых ссылок: {relinked}")
+
+
+async def run_retention(args):
+    if args.days <= 0:
+        print("❌ Укажите срок хранения: --days или RETENTION_DAYS")
+        return
+    retention = Retention(days=args.days, archive_dir="" if args.no_archive else args.archive_dir)
+    removed = await retention.run_once()
+    print(f"✅ Убрано из рабочих коллекций: сообщений {removed['messages']}, оценок {removed['ratings']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser(
+        "rebuild-aggregates", help="Пересчитать агрегаты оценок из коллекции ratings и архивных итогов"
+    )
+    rebuild.add_argument("--batch-size", type=int, default=500)
+    rebuild.set_defaults(handler=rebuild_aggregates)
+
+    check = subparsers.add_parser(
+        "check-indexes", help="Создать индексы и проверить планы запросов обработчиков"
+    )
+    check.set_defaults(handler=check_indexes)
+
+    dedupe = subparsers.add_parser(
+        "dedupe-users", help="Убрать повторяющиеся user_id и link_id перед созданием уникальных индексов"
+    )
+    dedupe.set_defaults(handler=dedupe_users)
+
+    strip = subparsers.add_parser(
+        "strip-user-ratings", help="Удалить неиспользуемый массив ratings из документов пользователей"
+    )
+    strip.add_argument("--batch-size", type=int, default=1000)
+    strip.set_defaults(handler=strip_user_ratings)
+
+    archive = subparsers.add_parser(
+        "run-retention", help="Один проход переноса старых сообщений и оценок в архив"
+    )
+    archive.add_argument("--days", type=int, default=RETENTION_DAYS)
+    archive.add_argument("--archive-dir", default=RETENTION_ARCHIVE_DIR)
+    archive.add_argument("--no-archive", action="store_true", help="удалить без архивации")
+    archive.set_defaults(handler=run_retention)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(args.handler(args))
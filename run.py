@@ -1,5 +1,7 @@
 import asyncio
+import logging
 from bot.main import main
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
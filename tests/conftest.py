@@ -0,0 +1,9 @@
+import pytest
+
+from bench.replay import install_fake_collections
+
+
+@pytest.fixture
+def fakes():
+    # Свежие коллекции в памяти на каждый тест, привязанные ко всем LazyCollection бота
+    return install_fake_collections()
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+from bot.handlers.rating_wizard import ACTION_SEND_ANONYMOUS, pack
+from bot.handlers.start import InteractionStates
+from bot.middlewares.antispam import RATE_LIMITED, AntiSpamMiddleware
+from bot.utils import ratelimit
+
+SENDER = User(id=1, is_bot=False, first_name="sender")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    sent = []
+
+    async def answer(self, text=None, *args, **kwargs):
+        sent.append((type(self).__name__, text))
+
+    monkeypatch.setattr(Message, "answer", answer)
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    return sent
+
+
+class FakeState:
+    def __init__(self, data):
+        self.data = data
+
+    async def get_data(self):
+        return dict(self.data)
+
+
+def message(text="привет"):
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"), from_user=SENDER, text=text)
+
+
+def callback(data):
+    return CallbackQuery(id="1", from_user=SENDER, chat_instance="chat", data=data)
+
+
+def submission_data(recipient_user_id=2):
+    return {
+        "event_from_user": SENDER,
+        "raw_state": InteractionStates.waiting_message.state,
+        "state": FakeState({"recipient_user_id": recipient_user_id}),
+    }
+
+
+def run(middleware, event, data):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+        return "handled"
+
+    result = asyncio.run(middleware(handler, event, data))
+    return result, bool(handled)
+
+
+def middleware(**kwargs):
+    settings = {"sender_rate": 100, "sender_burst": 100, "pair_rate": 0.1, "pair_burst": 2, "max_tracked": 100}
+    settings.update(kwargs)
+    return AntiSpamMiddleware(**settings)
+
+
+def test_sender_flood_dropped_silently(clock, answers):
+    antispam = middleware(sender_rate=1, sender_burst=2)
+    data = {"event_from_user": SENDER}
+    assert [run(antispam, message(), data)[1] for _ in range(3)] == [True, True, False]
+    assert answers == []
+    assert antispam.stats()["rejected_sender"] == 1
+
+
+def test_pair_limit_warns_once_per_window(clock, answers):
+    antispam = middleware()
+    assert [run(antispam, message(), submission_data())[1] for _ in range(4)] == [True, True, False, False]
+    assert answers == [("Message", RATE_LIMITED)]
+    assert antispam.stats()["rejected_pair"] == 2
+
+    # Через окно пополнения токен снова есть — лимит пары пропускает одно сообщение
+    clock[0] += 10
+    assert run(antispam, message(), submission_data())[1]
+    assert not run(antispam, message(), submission_data())[1]
+    assert answers == [("Message", RATE_LIMITED)] * 2
+
+
+def test_pairs_are_limited_independently(clock, answers):
+    antispam = middleware(pair_burst=1)
+    assert run(antispam, message(), submission_data(2))[1]
+    assert not run(antispam, message(), submission_data(2))[1]
+    assert run(antispam, message(), submission_data(3))[1]
+
+
+def test_messages_outside_submission_states_skip_pair_limit(clock, answers):
+    antispam = middleware(pair_burst=1)
+    data = dict(submission_data(), raw_state=None)
+    assert all(run(antispam, message(), data)[1] for _ in range(3))
+    assert antispam.stats()["tracked_pairs"] == 0
+
+
+def test_rejected_callback_always_answered(clock, answers):
+    antispam = middleware(pair_burst=1)
+    data = submission_data()
+    assert run(antispam, callback("send_anonymous"), data)[1]
+    assert not run(antispam, callback("send_named"), data)[1]
+    assert not run(antispam, callback("send_named"), data)[1]
+    assert answers == [("CallbackQuery", RATE_LIMITED)] * 2
+
+
+def test_wizard_submission_limited_by_packed_recipient(clock, answers):
+    antispam = middleware(pair_burst=1)
+    # Получатель берётся из callback_data, состояние FSM не нужно
+    data = {"event_from_user": SENDER}
+    submit = callback(pack(SENDER.id, ACTION_SEND_ANONYMOUS, 42, "12345"))
+    assert run(antispam, submit, data)[1]
+    assert not run(antispam, submit, data)[1]
+    assert antispam.pairs.try_acquire((SENDER.id, 7))
+    assert not antispam.pairs.try_acquire((SENDER.id, 42))
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from bot.services.backlog import build_lanes, drain_backlog
+
+
+def message_update(update_id, user_id, text):
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"), from_user=user, text=text,
+    ))
+
+
+def callback_update(update_id, user_id, data="rate"):
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="chat", data=data,
+    ))
+
+
+def ids(lane):
+    return [update.update_id for update in lane]
+
+
+def test_lanes_keep_user_order_and_put_commands_first():
+    updates = [
+        callback_update(1, 10),
+        message_update(2, 20, "/start"),
+        callback_update(3, 10),
+        message_update(4, 30, "/top"),
+        message_update(5, 30, "текст"),
+        message_update(6, 40, "просто текст"),
+    ]
+    lanes = build_lanes(updates)
+    # Сначала очереди с команды (короче — раньше), затем остальные по длине
+    assert [ids(lane) for lane in lanes] == [[2], [4, 5], [6], [1, 3]]
+
+
+class FakeBot:
+    def __init__(self, updates):
+        self.updates = updates
+        self.calls = []
+
+    async def get_updates(self, offset=None, limit=100, timeout=0, allowed_updates=None):
+        self.calls.append((offset, limit))
+        start = offset or 0
+        return [update for update in self.updates if update.update_id >= start][:limit]
+
+
+class FakeDispatcher:
+    def __init__(self, fail=()):
+        self.fed = []
+        self.fail = set(fail)
+
+    def resolve_used_update_types(self):
+        return ["message", "callback_query"]
+
+    async def feed_update(self, bot, update):
+        await asyncio.sleep(0)
+        self.fed.append(update.update_id)
+        if update.update_id in self.fail:
+            raise RuntimeError("обработчик упал")
+
+
+def test_drain_skips_processed_and_confirms_last_window(fakes):
+    updates = [message_update(update_id, 10 + update_id % 3, "/start") for update_id in range(1, 8)]
+    bot, dp = FakeBot(updates), FakeDispatcher(fail={5})
+
+    async def scenario():
+        await fakes["processed_updates"].insert_many([{"_id": 2}, {"_id": 3}])
+        return await drain_backlog(bot, dp, concurrency=2, window=3)
+
+    report = asyncio.run(scenario())
+    assert sorted(dp.fed) == [1, 4, 5, 6, 7]
+    assert (report.fetched, report.handled, report.skipped, report.failed) == (7, 4, 2, 1)
+    # Окна по три апдейта: третье добирается до пустого ответа, следующее
+    # окно пусто, затем подтверждение последнего окна
+    assert bot.calls == [(None, 3), (4, 3), (7, 3), (8, 2), (8, 3), (8, 1)]
+
+
+def test_single_slot_serves_lanes_by_priority(fakes):
+    updates = [
+        callback_update(1, 10),
+        callback_update(2, 10),
+        message_update(3, 20, "/start"),
+        message_update(4, 30, "текст"),
+    ]
+    dp = FakeDispatcher()
+    asyncio.run(drain_backlog(FakeBot(updates), dp, concurrency=1, window=10))
+    assert dp.fed == [3, 4, 1, 2]
+
+
+def test_empty_backlog_does_not_confirm(fakes):
+    bot = FakeBot([])
+    report = asyncio.run(drain_backlog(bot, FakeDispatcher()))
+    assert report.fetched == 0
+    assert bot.calls == [(None, 100)]
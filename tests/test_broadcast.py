@@ -0,0 +1,84 @@
+import asyncio
+
+from bot.services.broadcast import CANCELLED, DONE, Broadcasts
+from bot.services.outbox import PENDING, PRIORITY_BULK, build_delivery, enqueue_many
+
+
+def seed_users(fakes, user_ids, blocked=()):
+    return fakes["users"].insert_many([
+        {"user_id": user_id, "link_id": f"link{user_id}", "blocked": user_id in blocked} for user_id in user_ids
+    ])
+
+
+def recipients(fakes):
+    return sorted(delivery["chat_id"] for delivery in fakes["outbox"].documents)
+
+
+def test_run_enqueues_everyone_in_batches(fakes):
+    async def scenario():
+        await seed_users(fakes, [5, 1, 4, 2, 3], blocked={4})
+        broadcasts = Broadcasts(batch_size=2, max_pending=100)
+        broadcast = await broadcasts.create("📢 Новости", created_by=1)
+        await broadcasts.run(broadcast)
+        return broadcast["_id"], await broadcasts.latest()
+
+    broadcast_id, stored = asyncio.run(scenario())
+    assert recipients(fakes) == [1, 2, 3, 5]
+    assert all(
+        delivery["_id"] == f"{broadcast_id}:{delivery['chat_id']}" and delivery["priority"] == PRIORITY_BULK
+        for delivery in fakes["outbox"].documents
+    )
+    assert (stored["status"], stored["checkpoint"], stored["enqueued"]) == (DONE, 5, 4)
+
+
+def test_resume_after_crash_does_not_duplicate(fakes):
+    async def scenario():
+        await seed_users(fakes, range(1, 6))
+        broadcasts = Broadcasts(batch_size=2, max_pending=100)
+        broadcast = await broadcasts.create("📢 Новости", created_by=1)
+        # Процесс упал после постановки первой пачки, не сохранив чекпоинт
+        first_batch = []
+        for user_id in (1, 2):
+            delivery = build_delivery(user_id, broadcast["text"], PRIORITY_BULK)
+            delivery["_id"] = f"{broadcast['_id']}:{user_id}"
+            delivery["broadcast_id"] = broadcast["_id"]
+            first_batch.append(delivery)
+        await enqueue_many(first_batch)
+        await broadcasts.run(await broadcasts.latest())
+        return await broadcasts.latest()
+
+    stored = asyncio.run(scenario())
+    assert recipients(fakes) == [1, 2, 3, 4, 5]
+    # Повторно поставленная пачка пропущена и не учтена второй раз
+    assert stored["status"] == DONE and stored["enqueued"] == 3
+
+
+def test_run_from_checkpoint_skips_earlier_users(fakes):
+    async def scenario():
+        await seed_users(fakes, range(1, 6))
+        broadcasts = Broadcasts(batch_size=10, max_pending=100)
+        broadcast = await broadcasts.create("📢 Новости", created_by=1)
+        await broadcasts.run(dict(broadcast, checkpoint=3))
+
+    asyncio.run(scenario())
+    assert recipients(fakes) == [4, 5]
+
+
+def test_cancel_stops_run_and_clears_queue(fakes):
+    async def scenario():
+        await seed_users(fakes, range(1, 6))
+        broadcasts = Broadcasts(batch_size=2, max_pending=100)
+        broadcast = await broadcasts.create("📢 Новости", created_by=1)
+        # Отмена приходит, пока рассылка ставит в очередь первую пачку
+        cancelled = await broadcasts.cancel()
+        await broadcasts.run(broadcast)
+        return cancelled, await broadcasts.latest()
+
+    cancelled, stored = asyncio.run(scenario())
+    assert cancelled["_id"] == stored["_id"]
+    assert stored["status"] == CANCELLED and stored["checkpoint"] is None
+    assert [delivery for delivery in fakes["outbox"].documents if delivery["status"] == PENDING] == []
+
+
+def test_cancel_without_running_broadcast(fakes):
+    assert asyncio.run(Broadcasts().cancel()) is None
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+import pytest
+from pymongo.errors import WriteError
+
+from bench.fake_mongo import FakeCollection
+from bot.database.bulk_writer import BulkWriter, flush_batch_size, flush_seconds
+
+
+class CountingCollection(FakeCollection):
+    def __init__(self, name):
+        super().__init__(name)
+        self.batches = []
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        self.batches.append(len(documents))
+        return await super().insert_many(documents, ordered=ordered, **kwargs)
+
+
+def test_inserts_batched_until_max_batch():
+    async def scenario():
+        collection = CountingCollection("bw_batched")
+        writer = BulkWriter(collection, max_batch=3, max_delay=60)
+        ids = await asyncio.gather(*(writer.insert({"_id": index}) for index in range(3)))
+        return ids, collection.batches, writer.stats()
+
+    ids, batches, stats = asyncio.run(scenario())
+    assert ids == [0, 1, 2]
+    assert batches == [3]
+    assert stats["flushes"] == 1 and stats["documents"] == 3 and stats["buffered"] == 0
+
+
+def test_partial_failure_only_fails_broken_documents():
+    async def scenario():
+        collection = FakeCollection("bw_partial")
+        await collection.insert_one({"_id": "taken"})
+        writer = BulkWriter(collection, max_batch=3, max_delay=60)
+        results = await asyncio.gather(
+            writer.insert({"_id": "a"}),
+            writer.insert({"_id": "taken"}),
+            writer.insert({"_id": "b"}),
+            return_exceptions=True,
+        )
+        return results, writer, await collection.count_documents({})
+
+    results, writer, stored = asyncio.run(scenario())
+    assert results[0] == "a" and results[2] == "b"
+    assert isinstance(results[1], WriteError) and results[1].code == 11000
+    assert writer.documents == 2 and writer.errors == 1
+    assert stored == 3
+
+
+def test_failed_batch_fails_every_waiter(caplog):
+    class Down(FakeCollection):
+        async def insert_many(self, documents, ordered=True, **kwargs):
+            raise ConnectionError("база недоступна")
+
+    async def scenario():
+        writer = BulkWriter(Down("bw_down"), max_batch=3, max_delay=60)
+        writer.add({"_id": "fire-and-forget"})
+        results = await asyncio.gather(
+            writer.insert({"_id": "a"}), writer.insert({"_id": "b"}), return_exceptions=True
+        )
+        return results, writer
+
+    with caplog.at_level(logging.WARNING):
+        results, writer = asyncio.run(scenario())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert writer.errors == 3 and writer.documents == 0
+    # Документ из add() некому вернуть ошибку — она попадает в лог
+    assert "не записано 1 документов" in caplog.text
+
+
+def test_flush_after_max_delay_and_metrics():
+    async def scenario():
+        collection = CountingCollection("bw_delay")
+        writer = BulkWriter(collection, max_batch=100, max_delay=0.01)
+        writer.add({"_id": 1})
+        writer.add({"_id": 2})
+        assert writer.buffered == 2
+        await asyncio.sleep(0.05)
+        return collection.batches, writer.buffered
+
+    batches, buffered = asyncio.run(scenario())
+    assert batches == [2]
+    assert buffered == 0
+    sizes = dict(flush_batch_size._values)[("bw_delay",)]
+    assert sizes[flush_batch_size.buckets.index(2)] == 1
+    assert dict(flush_seconds._values)[("bw_delay",)][-1] > 0
+
+
+def test_closed_writer_rejects_inserts():
+    async def scenario():
+        writer = BulkWriter(FakeCollection("bw_closed"), max_batch=10, max_delay=60)
+        writer.add({"_id": 1})
+        await writer.close()
+        with pytest.raises(RuntimeError):
+            writer.add({"_id": 2})
+        return writer.documents
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,90 @@
+import asyncio
+import zlib
+from datetime import datetime, timedelta
+
+from bot.database.aggregates import CRITERIA
+from bot.services.digest import EPOCH, LATE_WRITES, Digests, next_slot
+
+WINDOW = 3600
+
+
+def _offset(user_id):
+    return zlib.crc32(str(user_id).encode()) % WINDOW
+
+
+def test_slot_is_users_offset_in_window():
+    now = datetime(2024, 5, 1, 10, 17, 3)
+    for user_id in (1, 42, 123456789):
+        slot = next_slot(user_id, now, WINDOW)
+        assert now < slot <= now + timedelta(seconds=WINDOW)
+        assert (slot - EPOCH).total_seconds() % WINDOW == _offset(user_id)
+
+
+def test_slot_strictly_after_now():
+    # Ровно в момент слота следующая сводка — через окно
+    user_id = 42
+    now = datetime(2024, 5, 1) + timedelta(seconds=_offset(user_id))
+    assert next_slot(user_id, now, WINDOW) == now + timedelta(seconds=WINDOW)
+    assert next_slot(user_id, now - timedelta(seconds=1), WINDOW) == now
+
+
+def test_slot_is_stable_within_window():
+    user_id = 7
+    first = next_slot(user_id, datetime(2024, 5, 1, 10), WINDOW)
+    assert next_slot(user_id, first - timedelta(seconds=WINDOW - 1), WINDOW) == first
+    assert next_slot(user_id, first - timedelta(seconds=1), WINDOW) == first
+
+
+def test_slots_spread_across_window():
+    now = datetime(2024, 5, 1, 10)
+    slots = {next_slot(user_id, now, WINDOW) for user_id in range(1000)}
+    assert len(slots) > 500
+
+
+def test_disabled_digest_sends_immediately(fakes):
+    async def scenario():
+        await fakes["users"].insert_one({"user_id": 1, "digest": False})
+        await Digests(window=WINDOW).notify_message(1, "📨 Новое сообщение", "привет")
+
+    asyncio.run(scenario())
+    assert [delivery["text"] for delivery in fakes["outbox"].documents] == ["📨 Новое сообщение"]
+    assert fakes["digests"].documents == []
+
+
+def test_events_accumulate_in_slot_document(fakes):
+    async def scenario():
+        await fakes["users"].insert_one({"user_id": 1, "digest": True})
+        digests = Digests(window=WINDOW, latest=2)
+        await digests.notify_rating(1, "⭐", {criterion: 8 for criterion in CRITERIA}, "Аноним", None)
+        await digests.notify_message(1, "📨", "первое")
+        await digests.notify_message(1, "📨", "второе")
+
+    asyncio.run(scenario())
+    assert fakes["outbox"].documents == []
+    [digest] = fakes["digests"].documents
+    assert digest["user_id"] == 1
+    assert digest["_id"] == f"1:{int((digest['due_at'] - EPOCH).total_seconds())}"
+    assert (digest["ratings"], digest["messages"]) == (1, 2)
+    assert [item["text"] for item in digest["latest"]] == ["первое", "второе"]
+
+
+def test_send_due_enqueues_once_then_deletes(fakes):
+    due_at = datetime.utcnow() - LATE_WRITES - timedelta(seconds=1)
+    digest = {"_id": "1:100", "user_id": 1, "due_at": due_at, "messages": 1, "latest": [{"kind": "message", "text": "привет"}]}
+    future = {"_id": "2:200", "user_id": 2, "due_at": datetime.utcnow() + timedelta(hours=1), "messages": 1, "latest": []}
+
+    async def scenario():
+        digests = Digests(window=WINDOW)
+        await fakes["digests"].insert_many([dict(digest), future])
+        first = await digests.send_due()
+        # Падение между постановкой в очередь и удалением: документ остался
+        await fakes["digests"].insert_one(dict(digest))
+        second = await digests.send_due()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert (first, second) == (1, 0)
+    [delivery] = fakes["outbox"].documents
+    assert delivery["_id"] == "digest:1:100" and delivery["chat_id"] == 1
+    assert "привет" in delivery["text"]
+    assert [document["_id"] for document in fakes["digests"].documents] == ["2:200"]
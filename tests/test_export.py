@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from aiogram.types import Chat, Message, User
+
+from bot.database.aggregates import CRITERIA
+from bot.handlers import export as export_handler
+from bot.services import export
+from bot.services.export import CSV, JSON, export_history
+from bot.services.retention import MESSAGES, RATINGS
+
+START = datetime(2024, 1, 1)
+
+
+def rating(index, anonymous=False):
+    return {
+        "_id": f"r{index}",
+        "to_user_id": 1,
+        "from_user_id": 100 + index,
+        "from_username": f"user{index}",
+        "anonymous": anonymous,
+        "ratings": {criterion: index for criterion in CRITERIA},
+        "timestamp": START + timedelta(minutes=index),
+    }
+
+
+def inbox_message(index):
+    return {"_id": f"m{index}", "recipient_user_id": 1, "message_text": f"текст {index}", "timestamp": START + timedelta(minutes=index)}
+
+
+@pytest.fixture
+def archive(monkeypatch):
+    batches = {RATINGS: [], MESSAGES: []}
+
+    async def archived_documents(user_id, kind):
+        for batch in batches[kind]:
+            yield batch
+
+    monkeypatch.setattr(export, "archived_documents", archived_documents)
+    return batches
+
+
+def read(path, fmt):
+    try:
+        with open(path, encoding="utf-8", newline="") as file:
+            if fmt == CSV:
+                return list(csv.DictReader(file))
+            return json.load(file)
+    finally:
+        os.remove(path)
+
+
+def test_json_hides_anonymous_senders(fakes, archive):
+    async def scenario():
+        await fakes["ratings"].insert_many([rating(1), rating(2, anonymous=True)])
+        await fakes["messages"].insert_one(inbox_message(3))
+        return await export_history(1, JSON)
+
+    path, rows = asyncio.run(scenario())
+    documents = read(path, JSON)
+    assert rows == 3
+    assert [document["type"] for document in documents] == ["rating", "rating", "message"]
+    assert documents[0]["from_user_id"] == 101
+    assert documents[1]["from_user_id"] is None and documents[1]["from_username"] is None
+    assert documents[2]["text"] == "текст 3"
+
+
+def test_archive_and_hot_collection_deduplicated(fakes, archive):
+    # r2 уже в архиве, но ещё не удалён из рабочей коллекции; r1 архивирован дважды
+    archive[RATINGS] = [[rating(1), rating(2)], [rating(1)]]
+    archive[MESSAGES] = [[inbox_message(1)]]
+
+    async def scenario():
+        await fakes["ratings"].insert_many([rating(2), rating(3)])
+        await fakes["messages"].insert_many([inbox_message(1), inbox_message(2)])
+        return await export_history(1, CSV)
+
+    path, rows = asyncio.run(scenario())
+    documents = read(path, CSV)
+    assert rows == 5
+    assert [(row["type"], row["timestamp"]) for row in documents] == [
+        ("rating", rating(1)["timestamp"].isoformat()),
+        ("rating", rating(2)["timestamp"].isoformat()),
+        ("rating", rating(3)["timestamp"].isoformat()),
+        ("message", inbox_message(1)["timestamp"].isoformat()),
+        ("message", inbox_message(2)["timestamp"].isoformat()),
+    ]
+    assert documents[1]["from_username"] == "user2"
+
+
+def test_command_replies_then_sends_file_in_background(fakes, archive, monkeypatch):
+    sent = []
+
+    async def answer(self, text, *args, **kwargs):
+        sent.append(("answer", text))
+
+    async def answer_document(self, document, caption=None, **kwargs):
+        with open(document.path, encoding="utf-8") as file:
+            sent.append(("document", document.filename, json.load(file)))
+
+    monkeypatch.setattr(Message, "answer", answer)
+    monkeypatch.setattr(Message, "answer_document", answer_document)
+    user = User(id=1, is_bot=False, first_name="user")
+    message = Message(
+        message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"), from_user=user, text="/export json"
+    )
+
+    async def scenario():
+        await fakes["messages"].insert_one(inbox_message(1))
+        await export_handler.export_cmd(message)
+        replied = list(sent)
+        await asyncio.gather(*export_handler._tasks)
+        return replied
+
+    replied = asyncio.run(scenario())
+    assert replied == [("answer", "⏳ Готовим выгрузку, файл придёт сюда.")]
+    kind, filename, documents = sent[1]
+    assert kind == "document" and filename.startswith("history_1_") and filename.endswith(".json")
+    assert [document["text"] for document in documents] == ["текст 1"]
+    assert not export_handler._running
+
+
+def test_parse_export_args():
+    assert export_handler.parse_export_args("/export") == (CSV, False, None)
+    assert export_handler.parse_export_args("/export JSON gz 42") == (JSON, True, 42)
+    with pytest.raises(ValueError):
+        export_handler.parse_export_args("/export xml")
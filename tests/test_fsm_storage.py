@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from bench.fake_mongo import FakeCollection
+from bot.database import fsm_storage
+from bot.database.fsm_storage import FSMConflictError, MongoStorage
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+DOCUMENT_ID = "1:2:2::default"
+
+
+def _storage(collection, flush_delay=60):
+    return MongoStorage(collection=collection, cache_size=100, cache_ttl=60, flush_delay=flush_delay)
+
+
+def test_changes_written_once_on_flush():
+    async def scenario():
+        collection = FakeCollection("fsm")
+        storage = _storage(collection)
+        await storage.set_state(KEY, "rating")
+        await storage.update_data(KEY, {"ratings": {"humor": 7}})
+        before = await collection.count_documents({})
+        await storage.flush(KEY)
+        return before, await collection.find_one({"_id": DOCUMENT_ID})
+
+    before, document = asyncio.run(scenario())
+    assert before == 0
+    assert document["state"] == "rating"
+    assert document["data"] == {"ratings": {"humor": 7}}
+    assert document["version"] == 1
+
+
+def test_cleared_state_deletes_document():
+    async def scenario():
+        collection = FakeCollection("fsm")
+        storage = _storage(collection)
+        await storage.set_state(KEY, "rating")
+        await storage.flush(KEY)
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.flush(KEY)
+        return await collection.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_stale_cache_revalidated_against_other_process():
+    async def scenario():
+        collection = FakeCollection("fsm")
+        first, second = _storage(collection, 0.01), _storage(collection, 0.01)
+        await first.set_state(KEY, "one")
+        await first.flush(KEY)
+        assert await second.get_state(KEY) == "one"
+        await first.set_state(KEY, "two")
+        await first.flush(KEY)
+        await asyncio.sleep(0.02)
+        return await second.get_state(KEY)
+
+    assert asyncio.run(scenario()) == "two"
+
+
+def test_conflict_reapplies_own_change():
+    # Два процесса меняют разные части одного документа — обе правки сохраняются
+    async def scenario():
+        collection = FakeCollection("fsm")
+        first, second = _storage(collection), _storage(collection)
+        await first.set_state(KEY, "rating")
+        await first.flush(KEY)
+        await second.get_state(KEY)
+
+        await first.set_data(KEY, {"ratings": {"humor": 7}})
+        await first.flush(KEY)
+        await second.set_state(KEY, "message")
+        await second.flush(KEY)
+        return second.conflicts, await collection.find_one({"_id": DOCUMENT_ID})
+
+    conflicts, document = asyncio.run(scenario())
+    assert conflicts == 1
+    assert document["state"] == "message"
+    assert document["data"] == {"ratings": {"humor": 7}}
+    assert document["version"] == 3
+
+
+def test_persistent_conflict_raised():
+    class AlwaysChanged(FakeCollection):
+        async def update_one(self, *args, **kwargs):
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def scenario():
+        storage = _storage(AlwaysChanged("fsm"))
+        await storage.set_state(KEY, "rating")
+        await storage.flush(KEY)
+
+    with pytest.raises(FSMConflictError):
+        asyncio.run(scenario())
+
+
+def test_delayed_flush_retries_with_limit(monkeypatch):
+    monkeypatch.setattr(fsm_storage, "FSM_FLUSH_RETRIES", 2)
+
+    class Broken(FakeCollection):
+        calls = 0
+
+        async def update_one(self, *args, **kwargs):
+            Broken.calls += 1
+            raise ConnectionError("база недоступна")
+
+    async def scenario():
+        storage = _storage(Broken("fsm"), 0.01)
+        await storage.set_state(KEY, "rating")
+        # 0.01 + 0.02 + 0.04 с: первая попытка и два повтора с удвоением паузы
+        await asyncio.sleep(0.3)
+        record = storage._cache[DOCUMENT_ID]
+        return record.dirty, record.flush_handle
+
+    dirty, handle = asyncio.run(scenario())
+    assert Broken.calls == 3
+    assert dirty
+    assert handle is None
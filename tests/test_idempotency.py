@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from bench.fake_mongo import FakeCollection
+from bot.services.idempotency import IdempotencyGuard
+
+
+def _guard(collection=None):
+    return IdempotencyGuard(collection=collection or FakeCollection("idempotency"), ttl=60, max_size=100)
+
+
+def test_sequential_duplicate_suppressed():
+    async def scenario():
+        guard = _guard()
+        calls = []
+
+        async def action():
+            calls.append(1)
+            return "rating-id"
+
+        first = await guard.run("rate:1:2:update-10", action)
+        second = await guard.run("rate:1:2:update-10", action)
+        return calls, first, second, guard.duplicates
+
+    calls, first, second, duplicates = asyncio.run(scenario())
+    assert calls == [1]
+    assert first == ("rating-id", False)
+    assert second == ("rating-id", True)
+    assert duplicates == 1
+
+
+def test_concurrent_duplicates_wait_for_first_result():
+    async def scenario():
+        guard = _guard()
+        calls = []
+
+        async def action():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(*(guard.run("key", action) for _ in range(5)))
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert calls == [1]
+    assert sorted(results, key=lambda result: result[1]) == [(1, False)] + [(1, True)] * 4
+
+
+def test_duplicate_in_other_process_gets_stored_result():
+    # Второй экземпляр с пустым кэшем — как другой процесс с той же коллекцией
+    async def scenario():
+        collection = FakeCollection("idempotency")
+
+        async def action():
+            return "first"
+
+        async def other():
+            return "second"
+
+        await _guard(collection).run("key", action)
+        return await _guard(collection).run("key", other)
+
+    assert asyncio.run(scenario()) == ("first", True)
+
+
+def test_failed_action_can_be_retried():
+    async def scenario():
+        guard = _guard()
+
+        async def failing():
+            raise RuntimeError("сеть")
+
+        async def action():
+            return "ok"
+
+        with pytest.raises(RuntimeError):
+            await guard.run("key", failing)
+        return await guard.run("key", action)
+
+    assert asyncio.run(scenario()) == ("ok", False)
+
+
+def test_different_keys_run_independently():
+    async def scenario():
+        guard = _guard()
+
+        async def action():
+            return "done"
+
+        return [await guard.run(key, action) for key in ("a", "b")]
+
+    assert asyncio.run(scenario()) == [("done", False), ("done", False)]
+
+
+def test_key_kept_when_after_step_fails():
+    # Запись прошла, упало уведомление — повтор не пишет второй раз
+    async def scenario():
+        collection = FakeCollection("idempotency")
+        writes = []
+
+        async def action():
+            writes.append(1)
+            return "accepted"
+
+        async def after():
+            raise RuntimeError("очередь недоступна")
+
+        with pytest.raises(RuntimeError):
+            await _guard(collection).run("key", action, after)
+        retry = await _guard(collection).run("key", action)
+        return writes, retry, await collection.find_one({"_id": "key"})
+
+    writes, retry, document = asyncio.run(scenario())
+    assert writes == [1]
+    assert retry == ("accepted", True)
+    assert "pending_until" not in document
+
+
+def test_after_runs_once():
+    async def scenario():
+        guard = _guard()
+        calls = []
+
+        async def action():
+            return "ok"
+
+        async def after():
+            calls.append(1)
+
+        await guard.run("key", action, after)
+        await guard.run("key", action, after)
+        return calls
+
+    assert asyncio.run(scenario()) == [1]
+
+
+def test_expired_pending_key_taken_over():
+    # Процесс упал посреди действия: ключ остался в статусе «выполняется»
+    async def scenario():
+        collection = FakeCollection("idempotency")
+        now = datetime.utcnow()
+        for key, lease in (("stale", -1), ("live", 60)):
+            await collection.insert_one(
+                {"_id": key, "created_at": now, "result": None, "pending_until": now + timedelta(seconds=lease)}
+            )
+
+        async def action():
+            return "ok"
+
+        return await _guard(collection).run("stale", action), await _guard(collection).run("live", action)
+
+    stale, live = asyncio.run(scenario())
+    assert stale == ("ok", False)
+    assert live == (None, True)
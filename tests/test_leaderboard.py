@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from bot.database.aggregates import CRITERIA
+from bot.database.indexes import UnsupportedServerError, check_server_version
+from bot.services.leaderboard import OVERALL, Leaderboards
+
+
+def aggregate(user_id, score, count=5):
+    return {"user_id": user_id, "count": count, "sum": {criterion: score * count for criterion in CRITERIA}}
+
+
+def board(fakes, criterion=OVERALL):
+    documents = fakes["leaderboards"].documents
+    return next(item for item in documents if item["_id"] == criterion)["entries"]
+
+
+def test_updates_keep_one_sorted_entry_per_user(fakes):
+    async def scenario():
+        await fakes["users"].insert_one({"user_id": 1, "username": "first"})
+        leaderboards = Leaderboards(size=2, min_ratings=3, cache_ttl=0)
+        await leaderboards.apply_aggregate(aggregate(1, 3))
+        await leaderboards.apply_aggregate(aggregate(2, 4))
+        await leaderboards.apply_aggregate(aggregate(1, 5, count=6))
+        return await leaderboards.get(OVERALL)
+
+    entries = asyncio.run(scenario())
+    assert [entry["user_id"] for entry in entries] == [1, 2]
+    assert entries[0]["username"] == "first"
+    assert entries[0]["average"] == 5 and entries[0]["count"] == 6
+    assert [entry["user_id"] for entry in board(fakes)] == [1, 2]
+
+
+def test_below_min_ratings_is_skipped(fakes):
+    async def scenario():
+        leaderboards = Leaderboards(size=2, min_ratings=3)
+        await leaderboards.apply_aggregate(aggregate(1, 5, count=2))
+
+    asyncio.run(scenario())
+    assert fakes["leaderboards"].documents == []
+
+
+def test_capacity_trims_and_skips_weaker_candidates(fakes):
+    async def scenario():
+        leaderboards = Leaderboards(size=1, min_ratings=1)
+        for user_id, score in ((1, 5), (2, 4), (3, 3)):
+            await leaderboards.apply_aggregate(aggregate(user_id, score))
+        writes = []
+        collection = fakes["leaderboards"]
+        original = collection.bulk_write
+
+        async def bulk_write(operations, **kwargs):
+            writes.append(operations)
+            return await original(operations, **kwargs)
+
+        collection.bulk_write = bulk_write
+        # Слабее последнего места в заполненной таблице — запись не нужна
+        await leaderboards.apply_aggregate(aggregate(4, 1))
+        return writes
+
+    writes = asyncio.run(scenario())
+    assert [entry["user_id"] for entry in board(fakes)] == [1, 2]
+    assert writes == []
+
+
+def test_concurrent_updates_of_one_user_leave_single_entry(fakes):
+    async def scenario():
+        # Два процесса с собственными кэшами обновляют одного пользователя
+        first, second = Leaderboards(size=2, min_ratings=1), Leaderboards(size=2, min_ratings=1)
+        await asyncio.gather(
+            first.apply_aggregate(aggregate(1, 2)),
+            second.apply_aggregate(aggregate(1, 4, count=6)),
+        )
+
+    asyncio.run(scenario())
+    for criterion in CRITERIA + (OVERALL,):
+        assert [entry["user_id"] for entry in board(fakes, criterion)] == [1]
+
+
+class BuildInfoDatabase:
+    def __init__(self, version):
+        self.version = version
+
+    async def command(self, name):
+        assert name == "buildInfo"
+        return {"version": self.version, "versionArray": [int(part) for part in self.version.split(".")] + [0]}
+
+
+def test_server_version_check():
+    assert asyncio.run(check_server_version(BuildInfoDatabase("7.0.2"))) == (7, 0)
+    assert asyncio.run(check_server_version(BuildInfoDatabase("5.2.0"))) == (5, 2)
+    with pytest.raises(UnsupportedServerError):
+        asyncio.run(check_server_version(BuildInfoDatabase("5.0.14")))
@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime, timedelta
+from time import monotonic
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot.database.db import outbox_collection, users_collection
+from bot.services.outbox import (
+    FAILED,
+    LEASE,
+    PENDING,
+    PRIORITY_BULK,
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    SENDING,
+    SENT,
+    OutboxWorkerPool,
+    build_delivery,
+    enqueue_many,
+)
+
+METHOD = SendMessage(chat_id=1, text="x")
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **params):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((chat_id, text))
+
+
+def _pool(bot=None, **kwargs):
+    kwargs.setdefault("global_rate", 1000)
+    kwargs.setdefault("chat_rate", 1000)
+    kwargs.setdefault("bulk_rate", 1000)
+    return OutboxWorkerPool(bot or FakeBot(), workers=1, **kwargs)
+
+
+async def _enqueue(*deliveries):
+    for delivery in deliveries:
+        delivery.setdefault("_id", f"d{delivery['chat_id']}:{delivery['priority']}")
+    await enqueue_many(list(deliveries))
+
+
+async def _get(delivery_id):
+    return await outbox_collection.find_one({"_id": delivery_id})
+
+
+def test_claim_by_priority_and_lease(fakes):
+    async def scenario():
+        await _enqueue(build_delivery(1, "low", PRIORITY_LOW), build_delivery(2, "high", PRIORITY_HIGH))
+        claimed = await _pool()._claim()
+        return claimed, await _get("d1:20")
+
+    claimed, untouched = asyncio.run(scenario())
+    assert claimed["text"] == "high"
+    assert claimed["status"] == SENDING
+    assert claimed["attempts"] == 1
+    assert timedelta(0) < claimed["locked_until"] - datetime.utcnow() <= LEASE
+    assert untouched["status"] == PENDING
+
+
+def test_claim_skips_future_and_exhausted_bulk(fakes):
+    async def scenario():
+        later = build_delivery(1, "later")
+        later["not_before"] = datetime.utcnow() + timedelta(minutes=1)
+        await _enqueue(later, build_delivery(2, "bulk", PRIORITY_BULK))
+        pool = _pool(bulk_rate=1)
+        pool.bulk_bucket.try_acquire()
+        return await pool._claim()
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_expired_lease_requeued(fakes):
+    async def scenario():
+        await _enqueue(build_delivery(1, "a"), build_delivery(2, "b"))
+        pool = _pool()
+        expired, live = await pool._claim(), await pool._claim()
+        await outbox_collection.update_one(
+            {"_id": expired["_id"]}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        requeued = await pool.requeue_expired()
+        return requeued, await _get(expired["_id"]), await _get(live["_id"])
+
+    requeued, expired, live = asyncio.run(scenario())
+    assert requeued == 1
+    assert expired["status"] == PENDING and "locked_until" not in expired
+    assert live["status"] == SENDING
+
+
+def test_delivered(fakes):
+    async def scenario():
+        bot = FakeBot()
+        pool = _pool(bot)
+        await _enqueue(build_delivery(1, "hi"))
+        await pool._deliver(await pool._claim())
+        return bot.sent, await _get("d1:10"), pool.stats.sent
+
+    sent, delivery, count = asyncio.run(scenario())
+    assert sent == [(1, "hi")]
+    assert delivery["status"] == SENT and "locked_until" not in delivery
+    assert count == 1
+
+
+def test_retry_after_pauses_pool_without_attempt(fakes):
+    async def scenario():
+        pool = _pool(FakeBot(TelegramRetryAfter(METHOD, "flood", retry_after=5)))
+        await _enqueue(build_delivery(1, "hi"))
+        await pool._deliver(await pool._claim())
+        return pool, await _get("d1:10")
+
+    pool, delivery = asyncio.run(scenario())
+    assert delivery["status"] == PENDING
+    assert delivery["attempts"] == 0
+    assert timedelta(seconds=4) < delivery["not_before"] - datetime.utcnow() <= timedelta(seconds=5)
+    assert pool._paused_until > 0
+
+
+def test_paused_pool_reschedules_instead_of_waiting(fakes):
+    # Захваченная доставка не ждёт паузу: иначе аренда истекла бы во время ожидания
+    async def scenario():
+        bot = FakeBot()
+        pool = _pool(bot)
+        await _enqueue(build_delivery(1, "hi"))
+        delivery = await pool._claim()
+        pool._paused_until = monotonic() + 30
+        await asyncio.wait_for(pool._deliver(delivery), timeout=1)
+        return bot.sent, await _get("d1:10")
+
+    sent, delivery = asyncio.run(scenario())
+    assert sent == []
+    assert delivery["status"] == PENDING and delivery["attempts"] == 0
+
+
+def test_forbidden_fails_and_blocks_user(fakes):
+    async def scenario():
+        await users_collection.insert_one({"user_id": 1, "link_id": "l"})
+        pool = _pool(FakeBot(TelegramForbiddenError(METHOD, "bot was blocked by the user")))
+        await _enqueue(build_delivery(1, "hi"))
+        await pool._deliver(await pool._claim())
+        return await _get("d1:10"), await users_collection.find_one({"user_id": 1})
+
+    delivery, user = asyncio.run(scenario())
+    assert delivery["status"] == FAILED
+    assert "blocked" in delivery["last_error"]
+    assert user["blocked"] is True
+
+
+def test_errors_back_off_then_fail(fakes):
+    async def scenario():
+        pool = _pool(FakeBot(TelegramBadRequest(METHOD, "bad")), max_attempts=2)
+        await _enqueue(build_delivery(1, "hi"))
+        await pool._deliver(await pool._claim())
+        first = await _get("d1:10")
+        await outbox_collection.update_one({"_id": "d1:10"}, {"$set": {"not_before": datetime.utcnow()}})
+        await pool._deliver(await pool._claim())
+        return first, await _get("d1:10")
+
+    first, second = asyncio.run(scenario())
+    assert first["status"] == PENDING and first["attempts"] == 1
+    assert first["not_before"] > datetime.utcnow()
+    assert second["status"] == FAILED and second["attempts"] == 2
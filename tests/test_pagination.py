@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from bench.fake_mongo import FakeCollection
+from bot.database.pagination import (
+    NEWER,
+    OLDER,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    page_callback,
+    parse_page_callback,
+)
+
+
+def test_cursor_round_trip():
+    document = {"timestamp": datetime(2024, 3, 5, 12, 30, 15, 123000), "_id": ObjectId()}
+    assert decode_cursor(encode_cursor(document)) == (document["timestamp"], document["_id"])
+
+
+def test_cursor_keeps_milliseconds_only():
+    # Mongo хранит время с точностью до миллисекунд — курсор тоже
+    document = {"timestamp": datetime(2024, 3, 5, 12, 30, 15, 123456), "_id": ObjectId()}
+    timestamp, _ = decode_cursor(encode_cursor(document))
+    assert timestamp == datetime(2024, 3, 5, 12, 30, 15, 123000)
+
+
+def test_page_callback_round_trip():
+    document = {"timestamp": datetime(2023, 12, 31, 23, 59, 59), "_id": ObjectId()}
+    for direction in (OLDER, NEWER):
+        data = page_callback("msgs", direction, document)
+        assert len(data.encode()) <= 64
+        assert parse_page_callback(data, "msgs") == (direction, (document["timestamp"], document["_id"]))
+
+
+def test_first_page_has_no_cursor():
+    assert parse_page_callback("my_messages", "msgs") == (OLDER, None)
+
+
+@pytest.mark.parametrize("data", [
+    "msgs:x:lq1z2k:0123456789abcdef01234567",
+    "msgs:o:lq1z2k",
+    "msgs:o:lq1z2k:not-an-object-id",
+    "msgs:o:!!:0123456789abcdef01234567",
+])
+def test_malformed_cursor_rejected(data):
+    with pytest.raises(InvalidCursor):
+        parse_page_callback(data, "msgs")
+
+
+def _inbox():
+    # Семь сообщений, у пар одинаковое время — порядок внутри пары задаёт _id
+    collection = FakeCollection("messages")
+    documents = [
+        {"_id": ObjectId(f"{index:024x}"), "recipient_user_id": 1, "timestamp": datetime(2024, 1, 1, 0, index // 2)}
+        for index in range(7)
+    ]
+    asyncio.run(collection.insert_many(documents))
+    return collection, documents
+
+
+def _page(collection, direction=OLDER, anchor=None):
+    cursor = None if anchor is None else (anchor["timestamp"], anchor["_id"])
+    documents, has_older, has_newer = asyncio.run(
+        fetch_page(collection, {"recipient_user_id": 1}, None, 3, direction, cursor)
+    )
+    return [document["_id"] for document in documents], has_older, has_newer
+
+
+def test_fetch_pages_older():
+    collection, documents = _inbox()
+    ids = [document["_id"] for document in documents]
+    assert _page(collection) == (ids[6:3:-1], True, False)
+    assert _page(collection, OLDER, documents[4]) == (ids[3:0:-1], True, True)
+    assert _page(collection, OLDER, documents[1]) == ([ids[0]], False, True)
+
+
+def test_fetch_pages_newer():
+    collection, documents = _inbox()
+    ids = [document["_id"] for document in documents]
+    assert _page(collection, NEWER, documents[0]) == (ids[3:0:-1], True, True)
+    assert _page(collection, NEWER, documents[3]) == (ids[6:3:-1], True, False)
+
+
+def test_newer_page_from_removed_oldest_anchor_has_no_older():
+    # Якорь успел уйти в архив: старше показанной страницы ничего нет
+    collection, documents = _inbox()
+    asyncio.run(collection.delete_one({"_id": documents[0]["_id"]}))
+    ids = [document["_id"] for document in documents]
+    assert _page(collection, NEWER, documents[0]) == (ids[3:0:-1], False, True)
+
+
+def test_empty_newer_page_beyond_newest():
+    collection, documents = _inbox()
+    assert _page(collection, NEWER, documents[6]) == ([], True, False)
@@ -0,0 +1,64 @@
+import pytest
+
+from bot.utils import ratelimit
+from bot.utils.ratelimit import BucketTable, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_refill_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.try_acquire()
+    assert bucket.delay() == 0.5
+    clock[0] += 0.25
+    assert not bucket.try_acquire()
+    assert bucket.delay() == 0.25
+    clock[0] += 0.25
+    assert bucket.try_acquire()
+
+
+def test_refill_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.try_acquire()
+    clock[0] += 60
+    assert bucket.is_full()
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_release_returns_unused_token(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.try_acquire()
+    bucket.release()
+    assert bucket.try_acquire()
+    bucket.release()
+    bucket.release()
+    assert bucket.is_full()
+    assert [bucket.try_acquire() for _ in range(2)] == [True, False]
+
+
+def test_default_capacity_is_one_second_of_rate(clock):
+    assert TokenBucket(rate=30).capacity == 30
+    assert TokenBucket(rate=0.5).capacity == 1
+
+
+
+def test_bucket_table_evicts_oldest(clock):
+    table = BucketTable(rate=1, capacity=1, max_size=2)
+    assert table.try_acquire("a")
+    assert table.try_acquire("b")
+    assert table.try_acquire("c")
+    assert len(table) == 2
+    # "a" вытеснено и создаётся заново полным, "c" ещё пусто
+    assert table.try_acquire("a")
+    assert not table.try_acquire("c")
@@ -0,0 +1,55 @@
+import pytest
+
+from bot.handlers.rating_wizard import (
+    ACTION_ANSWER,
+    ACTION_SEND_ANONYMOUS,
+    CALLBACK_DATA_LIMIT,
+    InvalidWizardData,
+    pack,
+    unpack,
+)
+
+USER_ID = 123456789
+RECIPIENT_ID = 987654321
+
+
+def test_pack_unpack_round_trip():
+    data = pack(USER_ID, ACTION_ANSWER, RECIPIENT_ID, "5709")
+    assert unpack(USER_ID, data) == (ACTION_ANSWER, RECIPIENT_ID, "5709")
+
+
+def test_full_answers_fit_callback_data():
+    data = pack(USER_ID, ACTION_SEND_ANONYMOUS, 10**12, "12340yn")
+    assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+    assert unpack(USER_ID, data) == (ACTION_SEND_ANONYMOUS, 10**12, "12340yn")
+
+
+def test_signature_bound_to_user():
+    # Чужая кнопка, пересланная другому пользователю, не принимается
+    data = pack(USER_ID, ACTION_ANSWER, RECIPIENT_ID, "57")
+    with pytest.raises(InvalidWizardData):
+        unpack(USER_ID + 1, data)
+
+
+@pytest.mark.parametrize("part, value", [
+    (0, "wzn"),        # другое действие
+    (1, "abc"),        # другой получатель
+    (2, "99"),         # подменённые оценки
+    (3, "AAAAAAAA"),   # подменённая подпись
+])
+def test_tampered_data_rejected(part, value):
+    parts = pack(USER_ID, ACTION_ANSWER, RECIPIENT_ID, "57").split(":")
+    parts[part] = value
+    with pytest.raises(InvalidWizardData):
+        unpack(USER_ID, ":".join(parts))
+
+
+@pytest.mark.parametrize("data", ["wzr", "wzr:a:b", "wzr:a:b:c:d", ""])
+def test_malformed_data_rejected(data):
+    with pytest.raises(InvalidWizardData):
+        unpack(USER_ID, data)
+
+
+def test_too_many_answers_rejected():
+    with pytest.raises(InvalidWizardData):
+        unpack(USER_ID, pack(USER_ID, ACTION_ANSWER, RECIPIENT_ID, "12340yny"))
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from bot.database.aggregates import CRITERIA, add_archived_totals
+from bot.services.retention import MESSAGES, RATINGS, Retention, archived_documents
+
+NOW = datetime(2024, 6, 1)
+OLD = NOW - timedelta(days=100)
+
+
+def message(index, recipient, is_read=False, timestamp=OLD):
+    return {
+        "_id": f"m{index}",
+        "recipient_user_id": recipient,
+        "message_text": f"текст {index}",
+        "is_read": is_read,
+        "timestamp": timestamp + timedelta(seconds=index),
+    }
+
+
+def rating(index, recipient, score=5, timestamp=OLD):
+    return {
+        "_id": f"r{index}",
+        "to_user_id": recipient,
+        "from_user_id": 100 + index,
+        "anonymous": True,
+        "ratings": {criterion: score for criterion in CRITERIA},
+        "wants_relationship": False,
+        "knows_personally": True,
+        "timestamp": timestamp + timedelta(seconds=index),
+    }
+
+
+def unread(fakes):
+    return {user["user_id"]: user["unread_messages"] for user in fakes["users"].documents}
+
+
+async def seed_users(fakes, counters):
+    await fakes["users"].insert_many([
+        {"user_id": user_id, "link_id": f"link{user_id}", "unread_messages": count} for user_id, count in counters.items()
+    ])
+
+
+def test_sweep_messages_releases_unread_once(fakes):
+    async def scenario():
+        await seed_users(fakes, {1: 3, 2: 1})
+        await fakes["messages"].insert_many([
+            message(1, 1), message(2, 1), message(3, 1, is_read=True), message(4, 2),
+            message(5, 1, timestamp=NOW),
+        ])
+        return await Retention(archive_dir=None, batch_size=2).sweep(MESSAGES, NOW - timedelta(days=30))
+
+    removed = asyncio.run(scenario())
+    assert removed == 4
+    assert [document["_id"] for document in fakes["messages"].documents] == ["m5"]
+    assert unread(fakes) == {1: 1, 2: 0}
+
+
+def test_repeated_batch_after_crash_not_decremented_twice(fakes, monkeypatch):
+    collection = fakes["messages"]
+    original = collection.delete_many
+    crashed = []
+
+    async def delete_many(query, **kwargs):
+        # Падение на удалении прочитанных, после удаления непрочитанных
+        if "is_read" not in query and not crashed:
+            crashed.append(query)
+            raise ConnectionError("соединение потеряно")
+        return await original(query, **kwargs)
+
+    monkeypatch.setattr(collection, "delete_many", delete_many)
+
+    async def scenario():
+        await seed_users(fakes, {1: 2})
+        await collection.insert_many([message(1, 1), message(2, 1, is_read=True), message(3, 1)])
+        retention = Retention(archive_dir=None, batch_size=10)
+        with pytest.raises(ConnectionError):
+            await retention.sweep(MESSAGES, NOW)
+        return await retention.sweep(MESSAGES, NOW)
+
+    removed = asyncio.run(scenario())
+    assert removed == 1
+    assert collection.documents == []
+    assert unread(fakes) == {1: 0}
+
+
+def test_message_read_during_sweep_not_released(fakes, monkeypatch):
+    collection = fakes["messages"]
+    original = collection.delete_many
+
+    async def delete_many(query, **kwargs):
+        # Получатель открыл входящие между выборкой пачки и удалением
+        if query.get("is_read") is False:
+            await collection.update_many({"_id": "m1"}, {"$set": {"is_read": True}})
+            await fakes["users"].update_one({"user_id": 1}, {"$inc": {"unread_messages": -1}})
+        return await original(query, **kwargs)
+
+    monkeypatch.setattr(collection, "delete_many", delete_many)
+
+    async def scenario():
+        await seed_users(fakes, {1: 2})
+        await collection.insert_many([message(1, 1), message(2, 1)])
+        await Retention(archive_dir=None).sweep(MESSAGES, NOW)
+
+    asyncio.run(scenario())
+    assert unread(fakes) == {1: 0}
+
+
+def test_sweep_ratings_archives_and_keeps_totals(fakes, tmp_path):
+    async def scenario():
+        await fakes["ratings"].insert_many([rating(1, 1, 4), rating(2, 2, 6), rating(3, 1, 8), rating(4, 1, timestamp=NOW)])
+        retention = Retention(archive_dir=str(tmp_path), batch_size=2)
+        removed = await retention.sweep(RATINGS, NOW - timedelta(days=30))
+        archived = [batch async for batch in archived_documents(1, RATINGS, str(tmp_path))]
+        return removed, archived
+
+    removed, archived = asyncio.run(scenario())
+    assert removed == 3
+    assert [document["_id"] for document in fakes["ratings"].documents] == ["r4"]
+    assert [[document["_id"] for document in batch] for batch in archived] == [["r1"], ["r3"]]
+    assert archived[0][0]["timestamp"] == rating(1, 1)["timestamp"]
+    totals = {document["user_id"]: document for document in fakes["archived_totals"].documents}
+    assert totals[1]["count"] == 2 and totals[2]["count"] == 1
+    assert totals[1]["sum"][CRITERIA[0]] == 12
+
+
+def test_archived_totals_skip_repeated_batch(fakes):
+    first = [rating(1, 1, 4), rating(2, 2, 6)]
+    second = [rating(3, 1, 8)]
+
+    async def scenario():
+        await add_archived_totals("r1:r2:2", first)
+        # Повтор пачки после падения до удаления — и для нового, и для старого документа
+        await add_archived_totals("r1:r2:2", first)
+        await add_archived_totals("r3:r3:1", second)
+        await add_archived_totals("r3:r3:1", second)
+
+    asyncio.run(scenario())
+    totals = {document["user_id"]: document for document in fakes["archived_totals"].documents}
+    assert len(fakes["archived_totals"].documents) == 2
+    assert totals[1]["count"] == 2 and totals[1]["sum"][CRITERIA[0]] == 12
+    assert totals[2]["count"] == 1
+    assert totals[1]["batches"] == ["r1:r2:2", "r3:r3:1"]
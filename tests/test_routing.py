@@ -0,0 +1,157 @@
+import asyncio
+import queue
+from collections import Counter
+from types import SimpleNamespace
+
+from bot.cluster import receiver as receiver_module
+from bot.cluster.receiver import Receiver
+from bot.cluster.routing import owner_of, routing_key
+
+
+def update(update_id, user_id):
+    return {"update_id": update_id, "message": {"message_id": 1, "from": {"id": user_id}}}
+
+
+def user_owned_by(worker_id, workers, skip=()):
+    return next(
+        user_id for user_id in range(1, 10_000)
+        if owner_of(user_id, workers) == worker_id and user_id not in skip
+    )
+
+
+def test_routing_key_prefers_event_owner():
+    assert routing_key(update(1, 42)) == 42
+    assert routing_key({"update_id": 2, "poll_answer": {"user": {"id": 7}}}) == 7
+    assert routing_key({"update_id": 3, "channel_post": {"chat": {"id": -100}}}) == -100
+    assert routing_key({"update_id": 4, "poll": {"id": "p"}}) == 4
+
+
+def test_owner_is_stable_and_balanced():
+    workers = [0, 1, 2, 3]
+    owners = {key: owner_of(key, workers) for key in range(10_000)}
+    assert owners == {key: owner_of(key, list(reversed(workers))) for key in range(10_000)}
+    counts = Counter(owners.values())
+    assert min(counts.values()) > 2000
+
+
+def test_removing_worker_moves_only_its_keys():
+    before = {key: owner_of(key, [0, 1, 2, 3]) for key in range(10_000)}
+    after = {key: owner_of(key, [0, 1, 3]) for key in range(10_000)}
+    moved = {key for key in before if before[key] != after[key]}
+    assert moved == {key for key, owner in before.items() if owner == 2}
+
+
+class FakeProcess:
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+
+class LocalQueue(queue.Queue):
+    def close(self):
+        pass
+
+
+class LocalReceiver(Receiver):
+    # Воркеры — очереди в этом же процессе, их «обработку» ведёт тест
+    def _spawn(self, worker):
+        worker.queue = LocalQueue()
+        worker.processed = SimpleNamespace(value=0)
+        worker.sent = 0
+        worker.process = FakeProcess()
+        worker.started_at = 0.0
+        worker.respawn_at = None
+
+
+def process(worker, count=None):
+    handled = []
+    while count is None or len(handled) < count:
+        try:
+            handled.append(worker.queue.get_nowait())
+        except queue.Empty:
+            break
+        worker.processed.value += 1
+    return handled
+
+
+def make_receiver(workers=3):
+    receiver = LocalReceiver(bot=None, dp=None, workers=workers, max_pending=100)
+    receiver.start_workers()
+    return receiver
+
+
+def test_updates_of_one_user_stay_on_one_worker():
+    receiver = make_receiver()
+    user_id = user_owned_by(1, [0, 1, 2])
+    for update_id in range(5):
+        receiver.dispatch_raw(update(update_id, user_id))
+    workers = receiver._workers
+    assert [item["update_id"] for item in process(workers[1])] == [0, 1, 2, 3, 4]
+    assert process(workers[0]) == process(workers[2]) == []
+
+
+def test_dead_worker_queue_rerouted_in_order():
+    receiver = make_receiver()
+    workers = receiver._workers
+    victim = user_owned_by(2, [0, 1, 2])
+    bystander = user_owned_by(0, [0, 1, 2])
+    for update_id in range(4):
+        receiver.dispatch_raw(update(update_id, victim))
+    receiver.dispatch_raw(update(10, bystander))
+    # Воркер успел обработать одно сообщение, второе взял и упал вместе с ним
+    process(workers[2], 1)
+    workers[2].queue.get_nowait()
+    workers[2].process.alive = False
+
+    asyncio.run(receiver._handle_death(workers[2]))
+
+    assert receiver._alive == [0, 1]
+    received = {worker_id: process(workers[worker_id]) for worker_id in (0, 1)}
+    new_owner = owner_of(victim, [0, 1])
+    assert [item["update_id"] for item in received[new_owner] if routing_key(item) == victim] == [2, 3]
+    assert [item["update_id"] for item in received[0] if routing_key(item) == bystander] == [10]
+    assert workers[2].respawn_at is not None
+
+
+def test_rejoined_worker_gets_keys_back_after_barrier():
+    receiver = make_receiver()
+    workers = receiver._workers
+    victim = user_owned_by(2, [0, 1, 2])
+    workers[2].process.alive = False
+    asyncio.run(receiver._handle_death(workers[2]))
+
+    # Пока воркер лежит, его пользователь обслуживается другим
+    receiver.dispatch_raw(update(1, victim))
+    interim = workers[owner_of(victim, [0, 1])]
+
+    receiver._rejoin(workers[2])
+    receiver.dispatch_raw(update(2, victim))
+    # Барьер не пройден: новый апдейт придержан, чтобы не обогнать первый
+    assert len(receiver._held) == 1 and workers[2].queue.empty()
+    receiver._release_joined()
+    assert len(receiver._held) == 1
+
+    assert [item["update_id"] for item in process(interim)] == [1]
+    receiver._release_joined()
+    assert receiver._held == [] and 2 not in receiver._joining
+    assert [item["update_id"] for item in process(workers[2])] == [2]
+
+
+def test_rejoin_barrier_released_by_timeout(monkeypatch):
+    monkeypatch.setattr(receiver_module, "WORKER_REJOIN_TIMEOUT", 0)
+    receiver = make_receiver()
+    workers = receiver._workers
+    victim = user_owned_by(2, [0, 1, 2])
+    workers[2].process.alive = False
+    asyncio.run(receiver._handle_death(workers[2]))
+    receiver.dispatch_raw(update(1, victim))
+
+    receiver._rejoin(workers[2])
+    receiver.dispatch_raw(update(2, victim))
+    # Другой воркер завис — ключи возвращаются по истечении таймаута
+    receiver._release_joined()
+    assert receiver._held == []
+    assert [item["update_id"] for item in process(workers[2])] == [2]
@@ -0,0 +1,64 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from bot.database.aggregates import CRITERIA
+from bot.services.stats import compute_report
+
+# Четыре оценки за две недели: строки — оценки, столбцы — критерии
+SCORES = np.array([
+    [1, 2, 3, 4, 5],
+    [3, 4, 5, 6, 7],
+    [5, 6, 7, 8, 9],
+    [10, 10, 10, 10, 10],
+], dtype=np.int8)
+TIMESTAMPS = np.array([
+    "2024-01-08T10:00:00",  # понедельник
+    "2024-01-14T23:59:59",  # воскресенье той же недели
+    "2024-01-15T00:00:00",  # понедельник следующей
+    "2024-01-16T12:00:00",
+], dtype="datetime64[s]")
+
+
+def test_counts_histograms_and_means():
+    report = compute_report(SCORES, TIMESTAMPS, datetime(2024, 1, 17))
+    assert report["count"] == 4
+    assert report["histograms"]["appearance"] == [1, 0, 1, 0, 1, 0, 0, 0, 0, 1]
+    assert report["histograms"]["trust"] == [0, 0, 0, 0, 1, 0, 1, 0, 1, 1]
+    assert report["means"]["appearance"] == 4.75
+    assert report["means"]["trust"] == 7.75
+
+
+def test_percentiles_nearest():
+    # Отсортированные внешности: 1, 3, 5, 10
+    report = compute_report(SCORES, TIMESTAMPS, datetime(2024, 1, 17))
+    assert report["percentiles"]["appearance"] == {25: 3, 50: 5, 75: 5, 90: 10}
+
+
+def test_trend_by_monday_weeks():
+    # Средние строк: 3 и 5 в первую неделю, 7 и 10 во вторую
+    report = compute_report(SCORES, TIMESTAMPS, datetime(2024, 1, 17))
+    assert report["trend"] == [
+        (date(2024, 1, 8), 4.0, 2),
+        (date(2024, 1, 15), 6.25, 2),
+    ]
+
+
+def test_trend_rolling_window_and_empty_weeks():
+    # Через четыре недели окно уже не захватывает ни одной оценки
+    report = compute_report(SCORES, TIMESTAMPS, datetime(2024, 2, 12))
+    assert report["trend"] == [
+        (date(2024, 1, 8), 4.0, 2),
+        (date(2024, 1, 15), 6.25, 2),
+        (date(2024, 1, 22), 6.25, 0),
+        (date(2024, 1, 29), 6.25, 0),
+        (date(2024, 2, 5), 8.5, 0),
+        (date(2024, 2, 12), None, 0),
+    ]
+
+
+def test_scores_outside_range_are_clipped():
+    scores = np.zeros((1, len(CRITERIA)), dtype=np.int8)
+    report = compute_report(scores, TIMESTAMPS[:1], datetime(2024, 1, 8))
+    assert report["histograms"]["humor"][0] == 1
+    assert report["means"]["humor"] == 1.0